@@ -0,0 +1,100 @@
+"""
+Benchmark of pylms.repository.Repository.search_persons: thanks to the trigram index, only the persons having all the
+trigrams of the pattern are compared to it, instead of every person.
+The index pays off from the second search of a Repository (e.g. in a shell or pylmsd): a one-shot search scans the
+persons, the next one builds the index, which time is reported along with the number of searches it takes to recoup it.
+
+Run with: python benchmarks/name_search_benchmark.py
+Exits with status 1 if searching with the index is not much faster than comparing the pattern to every person, or if a
+one-shot search is slower than such a comparison.
+"""
+
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from pylms import storage
+from pylms.core import Person, search_match
+from pylms.repository import Repository
+
+PERSONS_COUNTS = [10_000, 40_000, 160_000]
+SYLLABLES = ["ba", "be", "bo", "da", "de", "di", "ka", "ko", "la", "li", "lu", "ma", "mi", "na", "no", "ra", "ri", "ro"]
+SYLLABLES += ["sa", "se", "ta", "to", "va", "vi", "ze"]
+# longest patterns narrow down the persons the most
+PATTERNS = ["bakoli", "rizeta", "monavi", "dekalu"]
+# minimum ratio between the time to compare the pattern to every person and the time of an indexed search
+MIN_SPEEDUP = 10
+# maximum ratio between the time of a one-shot search and the time to compare the pattern to every person
+MAX_ONE_SHOT_SLOWDOWN = 1.5
+
+
+def _name(rnd: random.Random) -> str:
+    return "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))).capitalize()
+
+
+def _best_time(function, repeat: int = 5, setup=lambda: None) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _read_repository() -> Repository:
+    repository = Repository(storage)
+    # reading the storage is not part of the search
+    repository.read_persons()
+    return repository
+
+
+def main() -> int:
+    rnd = random.Random(42)
+
+    timings = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with patch("pylms.storage.persons_file_name", str(Path(tmpdir) / "persons.db")):
+            for count in PERSONS_COUNTS:
+                persons = [Person(i, _name(rnd), _name(rnd)) for i in range(count)]
+                storage.store_persons(persons)
+                repositories = []
+
+                def new_repository() -> None:
+                    repositories[:] = [_read_repository()]
+
+                def scanned_repository() -> None:
+                    new_repository()
+                    repositories[0].search_persons(PATTERNS[0])
+
+                one_shot = _best_time(lambda: repositories[0].search_persons(PATTERNS[0]), setup=new_repository)
+                # the second search of a Repository builds the indexes
+                build = _best_time(lambda: repositories[0].search_persons(PATTERNS[0]), setup=scanned_repository)
+                repository = repositories[0]
+                indexed = _best_time(lambda: [repository.search_persons(pattern) for pattern in PATTERNS])
+                scan = _best_time(lambda: [[p for p in persons if search_match(pattern, p)] for pattern in PATTERNS])
+                indexed, scan = indexed / len(PATTERNS), scan / len(PATTERNS)
+                timings.append((count, one_shot, indexed, scan))
+                print(
+                    f"{count:>8} persons: one-shot {one_shot * 1000:8.3f} ms, indexed {indexed * 1000:8.3f} ms/search"
+                    f" (scan: {scan * 1000:8.3f} ms/search), index build {build * 1000:8.3f} ms"
+                    f" recouped after {build / (scan - indexed):.1f} searches"
+                )
+
+    last_count, last_one_shot, last_indexed, last_scan = timings[-1]
+    speedup = last_scan / last_indexed
+    print(f"indexed search is x{speedup:.0f} faster than a scan of {last_count} persons")
+    if speedup < MIN_SPEEDUP:
+        print(f"FAILURE: indexed search is less than x{MIN_SPEEDUP} faster than a scan")
+        return 1
+    if last_one_shot > last_scan * MAX_ONE_SHOT_SLOWDOWN:
+        print(f"FAILURE: one-shot search is more than x{MAX_ONE_SHOT_SLOWDOWN} slower than a scan")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""
+Benchmark of the memory used by pylms.core.Person: bytes per person with 1M persons in memory.
+
+Run with: python benchmarks/person_memory_benchmark.py
+Exits with status 1 if a Person uses more memory than expected.
+
+Names and creation dates are allocated before measuring: only the memory of the Persons themselves (object, id, tags,
+search keys and the reference in the list) is accounted for.
+"""
+
+import datetime
+import sys
+import tracemalloc
+
+from pylms.core import Person
+
+PERSONS_COUNT = 1_000_000
+# a slot-based Person uses about 175 bytes, plus about 150 bytes for the search keys of its first and last names (a
+# dict-based Person without search keys used about 225 bytes)
+MAX_BYTES_PER_PERSON = 350
+
+
+def main() -> int:
+    created = datetime.datetime(2024, 4, 16, 12, 40, 30)
+    firstnames = [f"Firstname{i}" for i in range(PERSONS_COUNT)]
+    lastnames = [f"Lastname{i}" for i in range(PERSONS_COUNT)]
+
+    tracemalloc.start()
+    persons = [Person(i, firstnames[i], lastnames[i], created) for i in range(PERSONS_COUNT)]
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    bytes_per_person = allocated / len(persons)
+    print(f"{PERSONS_COUNT:>8} persons: {allocated / 2**20:8.1f} MiB ({bytes_per_person:.1f} bytes/person)")
+    if bytes_per_person > MAX_BYTES_PER_PERSON:
+        print(f"FAILURE: a Person uses more than {MAX_BYTES_PER_PERSON} bytes")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Benchmark of pylms.storage.read_relationships: load time must grow linearly with the number of relationships.
+
+The cache of pylms.storage is cleared before each read, for relationships to be actually loaded.
+
+Run with: python benchmarks/read_relationships_benchmark.py
+Exits with status 1 if load time grows noticeably faster than the number of relationships.
+"""
+
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from pylms import storage
+from pylms.core import Person, Relationship, parent_enfant, copain_copine
+
+PERSONS_COUNT = 10_000
+RELATIONSHIPS_COUNTS = [10_000, 20_000, 40_000, 80_000]
+# tolerance on the ratio between the time per relationship of the largest and the smallest run
+MAX_GROWTH = 2.0
+
+
+def _best_time(function, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    rnd = random.Random(42)
+    persons = [Person(i, f"firstname{i}", f"lastname{i}") for i in range(PERSONS_COUNT)]
+    definitions = [parent_enfant, copain_copine]
+
+    timings = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_name = str(Path(tmpdir) / "relationships.db")
+        with patch("pylms.storage.relationships_file_name", file_name):
+            for count in RELATIONSHIPS_COUNTS:
+                storage.store_relationships(
+                    [Relationship(*rnd.sample(persons, 2), rnd.choice(definitions)) for _ in range(count)]
+                )
+                elapsed = _best_time(lambda: storage.clear_cache() or storage.read_relationships(persons))
+                timings.append((count, elapsed))
+                print(
+                    f"{count:>8} relationships: {elapsed * 1000:8.1f} ms ({elapsed / count * 1e6:.2f} µs/relationship)"
+                )
+
+    (first_count, first_time), (last_count, last_time) = timings[0], timings[-1]
+    growth = (last_time / last_count) / (first_time / first_count)
+    print(f"time per relationship grew by x{growth:.2f} for x{last_count // first_count} relationships")
+    if growth > MAX_GROWTH:
+        print(f"FAILURE: load time does not grow linearly (max growth x{MAX_GROWTH})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
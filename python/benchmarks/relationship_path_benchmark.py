@@ -0,0 +1,52 @@
+"""
+Benchmark of pylms.core.relationship_path: finding how two Persons are related must take milliseconds on a graph of
+100k Persons, once the PersonGraph is built.
+
+Run with: python benchmarks/relationship_path_benchmark.py
+Exits with status 1 if a search takes longer than MAX_MILLISECONDS on average.
+"""
+
+import random
+import sys
+import time
+
+from pylms.core import Person, PersonGraph, Relationship, parent_enfant, copain_copine, relationship_path
+
+PERSONS_COUNT = 100_000
+# more relationships than persons, so that most pairs of persons are related, through a dozen of relationships or so
+RELATIONSHIPS_COUNT = 150_000
+SEARCHES_COUNT = 200
+MAX_MILLISECONDS = 20.0
+
+
+def main() -> int:
+    rnd = random.Random(42)
+    definitions = [parent_enfant, copain_copine]
+    persons = [Person(i, f"firstname{i}", f"lastname{i}") for i in range(PERSONS_COUNT)]
+    relationships = [Relationship(*rnd.sample(persons, 2), rnd.choice(definitions)) for _ in range(RELATIONSHIPS_COUNT)]
+
+    start = time.perf_counter()
+    graph = PersonGraph(relationships)
+    print(f"PersonGraph of {PERSONS_COUNT} persons built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    pairs = [(rnd.randrange(PERSONS_COUNT), rnd.randrange(PERSONS_COUNT)) for _ in range(SEARCHES_COUNT)]
+    lengths = []
+    start = time.perf_counter()
+    for source_id, target_id in pairs:
+        path = relationship_path(graph, source_id, target_id)
+        lengths.append(len(path) if path is not None else None)
+    average = (time.perf_counter() - start) / SEARCHES_COUNT * 1000
+
+    related = [length for length in lengths if length is not None]
+    print(
+        f"{SEARCHES_COUNT} searches: {average:.2f} ms on average,"
+        f" {len(related)} related pairs (max {max(related, default=0)} relationships apart)"
+    )
+    if average > MAX_MILLISECONDS:
+        print(f"FAILURE: searches take longer than {MAX_MILLISECONDS} ms on average")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
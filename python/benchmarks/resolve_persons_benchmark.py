@@ -0,0 +1,58 @@
+"""
+Benchmark of pylms.core.resolve_persons: time must grow linearly with the number of persons and relationships.
+
+Run with: python benchmarks/resolve_persons_benchmark.py
+Exits with status 1 if time grows noticeably faster than the number of persons and relationships.
+"""
+
+import gc
+import random
+import sys
+import time
+
+from pylms.core import Person, Relationship, parent_enfant, copain_copine, resolve_persons
+
+# as many relationships as persons
+COUNTS = [10_000, 20_000, 40_000, 80_000]
+# tolerance on the ratio between the time per person of the largest and the smallest run (memory caches make it grow
+# somewhat, a quadratic algorithm would make it grow by x8)
+MAX_GROWTH = 3.0
+
+
+def _best_time(function, repeat: int = 3) -> float:
+    best = float("inf")
+    # garbage collections triggered by the allocations of large runs would blur the comparison
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best
+
+
+def main() -> int:
+    rnd = random.Random(42)
+    definitions = [parent_enfant, copain_copine]
+
+    timings = []
+    for count in COUNTS:
+        persons = [Person(i, f"firstname{i}", f"lastname{i}") for i in range(count)]
+        relationships = [Relationship(*rnd.sample(persons, 2), rnd.choice(definitions)) for _ in range(count)]
+        elapsed = _best_time(lambda: resolve_persons(persons, relationships))
+        timings.append((count, elapsed))
+        print(f"{count:>8} persons and relationships: {elapsed * 1000:8.1f} ms ({elapsed / count * 1e6:.2f} µs/person)")
+
+    (first_count, first_time), (last_count, last_time) = timings[0], timings[-1]
+    growth = (last_time / last_count) / (first_time / first_count)
+    print(f"time per person grew by x{growth:.2f} for x{last_count // first_count} persons and relationships")
+    if growth > MAX_GROWTH:
+        print(f"FAILURE: time does not grow linearly (max growth x{MAX_GROWTH})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
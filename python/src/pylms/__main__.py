@@ -1,18 +1,38 @@
 #!/bin/env python3
 
 import logging
+import os
+import shlex
 import sys
+from typing import Callable, Iterable
 from sys import argv
 import pylms.pylms
 from pylms.pylms import list_persons, store_person, update_person, delete_person, link_persons, search_persons
-from pylms.pylms import ExitPyLMS
-from pylms.cli import CLI
+from pylms.pylms import find_relationship_path, find_common_ancestors, list_clusters, show_stats, find_duplicates
+from pylms.pylms import merge_person, delete_persons, tag_persons, untag_persons
+from pylms.pylms import complete_person_name, ExitPyLMS, unit_of_work, resident_unit_of_work
+from pylms.cli import CLI, BatchCLI
+from pylms import sqlite_storage, daemon
+
+try:
+    import readline
+except ImportError:
+    # not available on every platform: the shell then has neither history nor completion
+    readline = None
+
+# history of the commands of the shell, next to the storage files
+history_file_name = ".pylms_history"
+history_length = 1000
 
 
 def main() -> None:
+    if daemon.run_client(argv[1:]):
+        return
+
     _cli = CLI()
     pylms.pylms.ios = _cli
     pylms.pylms.events = _cli
+    pylms.pylms.select_storage()
     logging.basicConfig(level=logging.INFO)
     try:
         _read_and_execute_commands()
@@ -20,9 +40,47 @@ def main() -> None:
         pass
 
 
+def daemon_main() -> None:
+    daemon_cli = daemon.DaemonCLI()
+    pylms.pylms.ios = daemon_cli
+    pylms.pylms.events = daemon_cli
+    pylms.pylms.select_storage()
+    logging.basicConfig(level=logging.INFO)
+    daemon.serve(daemon_cli, _execute_daemon_command)
+
+
+def _execute_daemon_command(args: list[str]) -> None:
+    """
+    Execute a command sent to pylmsd, in a resident unit of work (see resident_unit_of_work()).
+    """
+    if args[:1] in (["shell"], ["--batch"], ["migrate"]):
+        print(f"{args[0]} can't be run while pylmsd is running")
+        return
+
+    try:
+        with resident_unit_of_work():
+            _execute_command(args)
+    except ExitPyLMS:
+        pass
+    except Exception as e:
+        print(e)
+
+
 def _read_and_execute_commands() -> None:
     args: list[str] = argv[1:]
 
+    if args and args[0] == "--batch":
+        _command_batch(args[1:])
+        return
+
+    if args and args[0] == "shell":
+        _command_shell(args[1:])
+        return
+
+    _execute_command(args)
+
+
+def _execute_command(args: list[str]) -> None:
     if not args:
         _command_list()
         return
@@ -40,13 +98,198 @@ def _read_and_execute_commands() -> None:
         _command_delete(args[1:])
         return
 
+    if command == "delete-all":
+        _command_delete_all(args[1:])
+        return
+
+    if command == "tag":
+        _command_tag(args[1:], tag_persons)
+        return
+
+    if command == "untag":
+        _command_tag(args[1:], untag_persons)
+        return
+
     if command == "link":
         _command_link(args[1:])
         return
 
+    if command == "path":
+        _command_path(args[1:])
+        return
+
+    if command == "ancestors":
+        _command_ancestors(args[1:])
+        return
+
+    if command == "clusters":
+        _command_clusters(args[1:])
+        return
+
+    if command == "stats":
+        _command_stats(args[1:])
+        return
+
+    if command == "duplicates":
+        _command_duplicates(args[1:])
+        return
+
+    if command == "merge":
+        _command_merge(args[1:])
+        return
+
+    if command == "migrate":
+        _command_migrate(args[1:])
+        return
+
     _command_search(args)
 
 
+class _LineNumberFilter(logging.Filter):
+    """
+    Prefix the messages logged by the commands with the number of the line of the batch they are executed from.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.line_number = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.msg = f"Line {self.line_number}: {record.msg}"
+        return True
+
+
+def _command_batch(arguments: list[str]) -> None:
+    arguments_count = len(arguments)
+    if arguments_count > 1:
+        print(f"Too many arguments ({arguments_count})")
+        return
+
+    if arguments_count == 0 or arguments[0] == "-":
+        _execute_batch(sys.stdin)
+        return
+
+    try:
+        with open(arguments[0], "r") as f:
+            _execute_batch(f)
+    except FileNotFoundError:
+        print(f"No such file: {arguments[0]}")
+
+
+def _execute_batch(lines: Iterable[str]) -> None:
+    """
+    Execute the commands of the lines, one per line with the arguments of pylms (optionally preceded by "pylms"), in a
+    single unit of work: the storage is read at most once and written once, at the end.
+    Commands can't be interactive (see BatchCLI). A failing command is reported with its line number and does not stop
+    the batch: the changes it made are discarded, each line is applied either as a whole or not at all.
+    """
+    batch_cli = BatchCLI()
+    pylms.pylms.ios = batch_cli
+    pylms.pylms.events = batch_cli
+    line_number_filter = _LineNumberFilter()
+    pylms.pylms.logger.addFilter(line_number_filter)
+    failures_count = 0
+    try:
+        with unit_of_work() as repository:
+            for line_number, line in enumerate(lines, start=1):
+                line_number_filter.line_number = line_number
+                repository.savepoint()
+                try:
+                    args = shlex.split(line, comments=True)
+                    if not args:
+                        continue
+                    if args[0] == "pylms":
+                        args = args[1:]
+                    if args[:1] == ["--batch"]:
+                        raise ValueError("Batches can't be nested")
+                    if args[:1] == ["shell"]:
+                        raise ValueError("The shell can't be run from a batch")
+                    _execute_command(args)
+                except Exception as e:
+                    repository.rollback()
+                    failures_count += 1
+                    print(f"Line {line_number}: {e}")
+    finally:
+        pylms.pylms.logger.removeFilter(line_number_filter)
+    if failures_count:
+        print(f"{failures_count} commands failed")
+
+
+def _command_shell(arguments: list[str]) -> None:
+    arguments_count = len(arguments)
+    if arguments_count > 0:
+        print(f"Too many arguments ({arguments_count})")
+        return
+
+    _execute_shell()
+
+
+def _execute_shell() -> None:
+    """
+    Read and execute commands, with the arguments of pylms, until "exit" or CTRL+D.
+    The storage is read once and the Persons, Relationships and indexes are kept in memory between commands (see
+    resident_unit_of_work()), each command writing its own changes. CTRL+C cancels the command in progress.
+    """
+    if readline is not None:
+        _setup_readline()
+    print('PyLMS shell, type "exit" or hit CTRL+D to exit')
+    try:
+        while True:
+            try:
+                line = input("pylms> ")
+            except KeyboardInterrupt:
+                print()
+                continue
+            except EOFError:
+                print()
+                return
+
+            try:
+                args = shlex.split(line, comments=True)
+                if not args:
+                    continue
+                if args[0] == "pylms":
+                    args = args[1:]
+                if args in (["exit"], ["quit"]):
+                    return
+                if args[:1] in (["shell"], ["--batch"], ["migrate"]):
+                    raise ValueError(f"{args[0]} can't be run from the shell")
+                with resident_unit_of_work():
+                    _execute_command(args)
+            except (ExitPyLMS, KeyboardInterrupt):
+                print("Canceled")
+            except Exception as e:
+                print(e)
+    finally:
+        if readline is not None:
+            readline.write_history_file(history_file_name)
+
+
+def _setup_readline() -> None:
+    if os.path.exists(history_file_name):
+        readline.read_history_file(history_file_name)
+    readline.set_history_length(history_length)
+    readline.set_completer(_complete)
+    readline.parse_and_bind("tab: complete")
+
+
+# candidates of the completion in progress, see _complete()
+_completions: list[str] = []
+
+
+def _complete(text: str, state: int) -> str | None:
+    """
+    readline completer: complete the word being typed with the first names and last names of the Persons.
+    :param state: the index of the candidate to return, 0 for a new completion
+    :return: the candidate of index state, None if there is no more
+    """
+    global _completions
+    if state == 0:
+        with resident_unit_of_work():
+            _completions = complete_person_name(text)
+    return _completions[state] if state < len(_completions) else None
+
+
 def _command_list() -> None:
     list_persons()
 
@@ -90,6 +333,24 @@ def _command_delete(arguments: list[str]) -> None:
         print(f"Missing search pattern")
 
 
+def _command_delete_all(arguments: list[str]) -> None:
+    arguments_count = len(arguments)
+    if arguments_count < 1:
+        print(f"Too few arguments ({arguments_count})")
+        return
+
+    delete_persons(" ".join(arguments))
+
+
+def _command_tag(arguments: list[str], tag_command: Callable[[str, str], None]) -> None:
+    arguments_count = len(arguments)
+    if arguments_count < 2:
+        print(f"Too few arguments ({arguments_count})")
+        return
+
+    tag_command(arguments[0], " ".join(arguments[1:]))
+
+
 def _command_link(arguments: list[str]) -> None:
     arguments_count = len(arguments)
     if arguments_count < 2:
@@ -100,6 +361,85 @@ def _command_link(arguments: list[str]) -> None:
     link_persons(natural_link_request)
 
 
+def _command_path(arguments: list[str]) -> None:
+    arguments_count = len(arguments)
+    if arguments_count < 2:
+        print(f"Too few arguments ({arguments_count})")
+        return
+    if arguments_count > 2:
+        print(f"Too many arguments ({arguments_count})")
+        return
+
+    find_relationship_path(left_person_pattern=arguments[0], right_person_pattern=arguments[1])
+
+
+def _command_ancestors(arguments: list[str]) -> None:
+    arguments_count = len(arguments)
+    if arguments_count < 2:
+        print(f"Too few arguments ({arguments_count})")
+        return
+    if arguments_count > 2:
+        print(f"Too many arguments ({arguments_count})")
+        return
+
+    find_common_ancestors(left_person_pattern=arguments[0], right_person_pattern=arguments[1])
+
+
+def _command_clusters(arguments: list[str]) -> None:
+    arguments_count = len(arguments)
+    if arguments_count > 0:
+        print(f"Too many arguments ({arguments_count})")
+        return
+
+    list_clusters()
+
+
+def _command_stats(arguments: list[str]) -> None:
+    arguments_count = len(arguments)
+    if arguments_count > 0:
+        print(f"Too many arguments ({arguments_count})")
+        return
+
+    show_stats()
+
+
+def _command_duplicates(arguments: list[str]) -> None:
+    arguments_count = len(arguments)
+    if arguments_count > 0:
+        print(f"Too many arguments ({arguments_count})")
+        return
+
+    find_duplicates()
+
+
+def _command_merge(arguments: list[str]) -> None:
+    arguments_count = len(arguments)
+    if arguments_count < 2:
+        print(f"Too few arguments ({arguments_count})")
+        return
+    if arguments_count > 2:
+        print(f"Too many arguments ({arguments_count})")
+        return
+
+    merge_person(pattern=arguments[0], merged_person_pattern=arguments[1])
+
+
+def _command_migrate(arguments: list[str]) -> None:
+    arguments_count = len(arguments)
+    if arguments_count > 0:
+        print(f"Too many arguments ({arguments_count})")
+        return
+
+    try:
+        persons_count, relationships_count = sqlite_storage.migrate_from_json()
+    except ValueError as e:
+        print(e)
+        return
+    print(
+        f"Migrated {persons_count} Persons and {relationships_count} Relationships to {sqlite_storage.database_file_name}"
+    )
+
+
 def _command_search(arguments: list[str]) -> None:
     arguments_count = len(arguments)
     if arguments_count < 1:
@@ -0,0 +1,512 @@
+"""
+HTTP/JSON API over the commands of pylms, served with asyncio.
+
+The Persons, Relationships and indexes are kept in memory (see resident_unit_of_work()) and shared by the threads
+executing the commands of the requests (see CommandScheduler): read requests are executed concurrently, write requests
+one at a time, in order, by a single writer thread, once the reads in progress are done. A read never sees a write
+half-applied, and the event loop keeps accepting requests while commands write the storage or look for duplicates.
+
+Responses are JSON objects:
+  - 200: {"result": ..., "events": [...], "messages": [...]}, result being null for write requests, whose effects
+    are described by events (eg. {"event": "creating_person", "person": {...}})
+  - 400: {"errors": [...]}, the request is invalid or was refused (eg. a link making a person their own ancestor)
+  - 409: {"error": ..., "candidates": [...]}, several Persons match a pattern: nothing is selected, the request must
+    be made again with a more specific pattern
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Callable
+from urllib.parse import urlsplit, parse_qsl
+import pylms.pylms
+from pylms.core import Person, Relationship, RelationshipDefinition, RelationshipAlias
+from pylms.pylms import IOs, EventListener, Stats, resident_unit_of_work
+from pylms.pylms import list_persons, search_persons, store_person, update_person, delete_person, delete_persons
+from pylms.pylms import link_persons, merge_person, tag_persons, untag_persons, find_relationship_path
+from pylms.pylms import find_common_ancestors, list_clusters, show_stats, find_duplicates
+from pylms.storage import PersonEncoder, RelationshipEncoder
+
+logger = logging.getLogger(__name__)
+
+default_host = "127.0.0.1"
+default_port = 8080
+# larger request bodies are refused
+max_body_size = 1024 * 1024
+# threads executing the read requests concurrently
+reader_threads = 8
+
+
+class HttpError(Exception):
+    def __init__(self, status: HTTPStatus, message: str) -> None:
+        super().__init__(message)
+        self.status: HTTPStatus = status
+
+
+def _person_dict(person: Person) -> dict:
+    return PersonEncoder().default(person)
+
+
+def _relationship_dict(relationship: Relationship) -> dict:
+    return RelationshipEncoder().default(relationship)
+
+
+def _resolved_person_dict(resolved_person: (Person, list[Relationship])) -> dict:
+    person, relationships = resolved_person
+    return {**_person_dict(person), "relationships": [_relationship_dict(rl) for rl in relationships]}
+
+
+class ApiIOs(IOs, EventListener):
+    """
+    IOs and EventListener of a request: what the command shows is kept as its structured result and what it does as
+    events. Nothing is asked: confirmations are implied and, when several Persons match a pattern, none is selected.
+    """
+
+    def __init__(self, person_updates: dict | None = None) -> None:
+        """
+        :param person_updates: the new first name, last name and/or tags of the Person to update, if any
+        """
+        self.person_updates: dict = person_updates or {}
+        self.result: any = None
+        self.events: list[dict] = []
+        # the Persons a pattern matched when several did, see select_person()
+        self.candidates: list[Person] | None = None
+
+    def show_person(self, person: Person) -> None:
+        self.result = _person_dict(person)
+
+    def list_persons(self, persons: list[(Person, list[Relationship])]) -> None:
+        self.result = [_resolved_person_dict(resolved_person) for resolved_person in persons]
+
+    def select_person(self, persons: list[Person]) -> Person | None:
+        if self.candidates is None:
+            self.candidates = persons
+        return None
+
+    def update_person(self, person_to_update: Person) -> Person:
+        if "firstname" in self.person_updates:
+            person_to_update.firstname = self.person_updates["firstname"]
+        if "lastname" in self.person_updates:
+            person_to_update.lastname = self.person_updates["lastname"]
+        if "tags" in self.person_updates:
+            person_to_update.tags = self.person_updates["tags"]
+        self.events.append({"event": "updating_person", "person": _person_dict(person_to_update)})
+        return person_to_update
+
+    def list_clusters(self, clusters: list[list[(Person, list[Relationship])]]) -> None:
+        self.result = [[_resolved_person_dict(resolved_person) for resolved_person in cluster] for cluster in clusters]
+
+    def show_stats(self, stats: Stats) -> None:
+        self.result = {
+            "persons_count": stats.persons_count,
+            "relationships_count": stats.relationships_count,
+            "cluster_sizes": stats.cluster_sizes,
+            "isolated_persons_count": stats.isolated_persons_count,
+            "largest_cluster": [_person_dict(person) for person in stats.largest_cluster],
+        }
+
+    def list_duplicates(self, duplicates: list[tuple[Person, Person, float]]) -> None:
+        self.result = [
+            {"person": _person_dict(person), "other_person": _person_dict(other_person), "score": score}
+            for person, other_person, score in duplicates
+        ]
+
+    def show_relationship_path(self, person: Person, path: list[Relationship]) -> None:
+        self.result = {"person": _person_dict(person), "path": [_relationship_dict(rl) for rl in path]}
+
+    def creating_person(self, person: Person) -> None:
+        self.events.append({"event": "creating_person", "person": _person_dict(person)})
+
+    def deleting_person(self, person_to_delete: Person) -> None:
+        self.events.append({"event": "deleting_person", "person": _person_dict(person_to_delete)})
+
+    def deleting_persons(self, persons_to_delete: list[Person], relationships: list[Relationship]) -> None:
+        self.events.append(
+            {
+                "event": "deleting_persons",
+                "persons": [_person_dict(person) for person in persons_to_delete],
+                "relationships": [_relationship_dict(rl) for rl in relationships],
+            }
+        )
+
+    def tagging_persons(self, persons: list[Person], tag: str) -> None:
+        self.events.append({"event": "tagging_persons", "persons": [_person_dict(p) for p in persons], "tag": tag})
+
+    def untagging_persons(self, persons: list[Person], tag: str) -> None:
+        self.events.append({"event": "untagging_persons", "persons": [_person_dict(p) for p in persons], "tag": tag})
+
+    def merging_person(self, merged_person: Person, person: Person) -> None:
+        self.events.append(
+            {"event": "merging_person", "merged_person": _person_dict(merged_person), "person": _person_dict(person)}
+        )
+
+    def creating_link(self, rl_definition: RelationshipDefinition, person_left: Person, person_right: Person) -> None:
+        self.events.append(
+            {
+                "event": "creating_link",
+                "relationship": _relationship_dict(Relationship(person_left, person_right, rl_definition)),
+            }
+        )
+
+    def configured_from_alias(self, person: Person, alias: RelationshipAlias) -> None:
+        self.events.append({"event": "configured_from_alias", "person": _person_dict(person), "alias": alias.name})
+
+    def deleting_relationship(self, relationship, person: Person | None) -> None:
+        self.events.append({"event": "deleting_relationship", "relationship": _relationship_dict(relationship)})
+
+
+class _ThreadIOs(threading.local):
+    """
+    IOs and EventListener of pylms, standing for the ApiIOs of the command executed by the current thread: commands are
+    executed concurrently.
+    """
+
+    api_ios: ApiIOs | None = None
+
+    def __getattr__(self, name: str) -> any:
+        return getattr(self.api_ios, name)
+
+
+_thread_ios = _ThreadIOs()
+
+
+class _MessagesHandler(logging.Handler):
+    """
+    Keep the messages logged by a command, errors apart, but those logged by other threads.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.thread_id: int = threading.get_ident()
+        self.messages: list[str] = []
+        self.errors: list[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.thread != self.thread_id:
+            return
+        (self.errors if record.levelno >= logging.ERROR else self.messages).append(record.getMessage())
+
+
+def execute(command: Callable[[], None], person_updates: dict | None = None) -> tuple[HTTPStatus, dict]:
+    """
+    Execute the command in a resident unit of work, with an ApiIOs.
+    A command writing the storage must not be executed concurrently with any other, see CommandScheduler.
+    :param person_updates: see ApiIOs
+    :return: the status and the body of the response
+    """
+    api_ios = ApiIOs(person_updates)
+    _thread_ios.api_ios = api_ios
+    pylms.pylms.ios = _thread_ios
+    pylms.pylms.events = _thread_ios
+    messages_handler = _MessagesHandler()
+    pylms.pylms.logger.addHandler(messages_handler)
+    try:
+        with resident_unit_of_work():
+            command()
+    finally:
+        pylms.pylms.logger.removeHandler(messages_handler)
+        _thread_ios.api_ios = None
+
+    if api_ios.candidates is not None:
+        return HTTPStatus.CONFLICT, {
+            "error": f"{len(api_ios.candidates)} persons match, a more specific pattern is required",
+            "candidates": [_person_dict(person) for person in api_ios.candidates],
+        }
+    if messages_handler.errors:
+        return HTTPStatus.BAD_REQUEST, {"errors": messages_handler.errors}
+    return HTTPStatus.OK, {"result": api_ios.result, "events": api_ios.events, "messages": messages_handler.messages}
+
+
+def _required(values: dict, name: str) -> str:
+    value = values.get(name)
+    if value is None or value == "":
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"Missing {name}")
+    if not isinstance(value, str):
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"{name} must be a string")
+    return value
+
+
+def _optional(values: dict, name: str) -> str | None:
+    value = values.get(name)
+    if value is not None and not isinstance(value, str):
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"{name} must be a string")
+    return value
+
+
+def _tags(values: dict) -> list[str]:
+    value = values.get("tags")
+    if not isinstance(value, list) or not all(isinstance(tag, str) for tag in value):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "tags must be a list of strings")
+    return value
+
+
+def _person_updates(values: dict) -> dict:
+    """
+    :return: the new first name, last name and/or tags of the Person to update, see ApiIOs
+    """
+    person_updates = {}
+    if "firstname" in values:
+        person_updates["firstname"] = _required(values, "firstname")
+    if "lastname" in values:
+        person_updates["lastname"] = _optional(values, "lastname")
+    if "tags" in values:
+        person_updates["tags"] = _tags(values)
+    return person_updates
+
+
+def _get_persons(params: dict, _: dict) -> Callable[[], None]:
+    if "q" in params:
+        return lambda: search_persons(_required(params, "q"))
+    return list_persons
+
+
+def _post_persons(_: dict, body: dict) -> Callable[[], None]:
+    firstname = _required(body, "firstname")
+    lastname = _optional(body, "lastname")
+    return lambda: store_person(firstname, lastname)
+
+
+def _delete_persons(params: dict, _: dict) -> Callable[[], None]:
+    if "q" in params:
+        return lambda: delete_persons(_required(params, "q"))
+    pattern = _required(params, "pattern")
+    return lambda: delete_person(pattern)
+
+
+def _post_links(_: dict, body: dict) -> Callable[[], None]:
+    request = _required(body, "request")
+    return lambda: link_persons(request)
+
+
+def _post_merges(_: dict, body: dict) -> Callable[[], None]:
+    pattern = _required(body, "pattern")
+    merged_pattern = _required(body, "merged_pattern")
+    return lambda: merge_person(pattern, merged_pattern)
+
+
+def _post_tags(_: dict, body: dict) -> Callable[[], None]:
+    tag = _required(body, "tag")
+    q = _required(body, "q")
+    return lambda: tag_persons(tag, q)
+
+
+def _delete_tags(params: dict, _: dict) -> Callable[[], None]:
+    tag = _required(params, "tag")
+    q = _required(params, "q")
+    return lambda: untag_persons(tag, q)
+
+
+def _get_path(params: dict, _: dict) -> Callable[[], None]:
+    left = _required(params, "left")
+    right = _required(params, "right")
+    return lambda: find_relationship_path(left, right)
+
+
+def _get_ancestors(params: dict, _: dict) -> Callable[[], None]:
+    left = _required(params, "left")
+    right = _required(params, "right")
+    return lambda: find_common_ancestors(left, right)
+
+
+# (method, path) -> (whether the command writes, the command of the query parameters and the body of the request)
+_ROUTES: dict[tuple[str, str], tuple[bool, Callable[[dict, dict], Callable[[], None]]]] = {
+    ("GET", "/persons"): (False, _get_persons),
+    ("POST", "/persons"): (True, _post_persons),
+    ("DELETE", "/persons"): (True, _delete_persons),
+    ("POST", "/links"): (True, _post_links),
+    ("POST", "/merges"): (True, _post_merges),
+    ("POST", "/tags"): (True, _post_tags),
+    ("DELETE", "/tags"): (True, _delete_tags),
+    ("GET", "/path"): (False, _get_path),
+    ("GET", "/ancestors"): (False, _get_ancestors),
+    ("GET", "/clusters"): (False, lambda *_: list_clusters),
+    ("GET", "/stats"): (False, lambda *_: show_stats),
+    ("GET", "/duplicates"): (False, lambda *_: find_duplicates),
+}
+
+
+class CommandScheduler:
+    """
+    Execute the commands of the requests in threads, off the event loop: read commands concurrently, write commands
+    one at a time, in order, by a single writer thread. A write waits for the reads in progress, the reads received
+    after it wait for the write: a read never sees a write half-applied, and reads can't hold writes up indefinitely.
+    Must be used from the thread of the event loop.
+    """
+
+    def __init__(self) -> None:
+        self._readers = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix="pylmsapi-reader")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pylmsapi-writer")
+        self._condition = asyncio.Condition()
+        self._reads_count = 0
+        self._writes_count = 0
+        self._writing = False
+
+    async def read(self, command: Callable[[], None]) -> tuple[HTTPStatus, dict]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writes_count)
+            self._reads_count += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._readers, execute, command)
+        finally:
+            async with self._condition:
+                self._reads_count -= 1
+                self._condition.notify_all()
+
+    async def write(self, command: Callable[[], None], person_updates: dict | None = None) -> tuple[HTTPStatus, dict]:
+        """
+        :param person_updates: see ApiIOs
+        """
+        async with self._condition:
+            # counted as soon as received, so that the next reads wait for it
+            self._writes_count += 1
+            await self._condition.wait_for(lambda: not self._reads_count and not self._writing)
+            self._writing = True
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._writer, execute, command, person_updates)
+        finally:
+            async with self._condition:
+                self._writing = False
+                self._writes_count -= 1
+                self._condition.notify_all()
+
+    def close(self) -> None:
+        self._readers.shutdown()
+        self._writer.shutdown()
+
+    def __enter__(self) -> "CommandScheduler":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+async def _respond(scheduler: CommandScheduler, method: str, target: str, body: bytes) -> tuple[HTTPStatus, dict]:
+    url = urlsplit(target)
+    params = dict(parse_qsl(url.query))
+    if method == "PATCH" and url.path == "/persons":
+        values = _json_body(body)
+        pattern = _required(values, "pattern")
+        person_updates = _person_updates(values)
+        return await scheduler.write(lambda: update_person(pattern), person_updates)
+
+    route = _ROUTES.get((method, url.path))
+    if route is None:
+        if any(path == url.path for _, path in _ROUTES):
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, f"Unsupported method {method} for {url.path}")
+        raise HttpError(HTTPStatus.NOT_FOUND, f"No such resource {url.path}")
+
+    writes_storage, route_command = route
+    command = route_command(params, _json_body(body) if body else {})
+    if writes_storage:
+        return await scheduler.write(command)
+    return await scheduler.read(command)
+
+
+def _json_body(body: bytes) -> dict:
+    try:
+        values = json.loads(body)
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid JSON body")
+    if not isinstance(values, dict):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "JSON body must be an object")
+    return values
+
+
+async def _read_request(reader: asyncio.StreamReader) -> tuple[str, str, dict[str, str], bytes] | None:
+    """
+    :return: the method, the target, the headers (lowercase names) and the body of the request, None if the
+             connection was closed
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid request line")
+
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        content_length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+    if content_length > max_body_size:
+        raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Body larger than {max_body_size} bytes")
+    return method, target, headers, await reader.readexactly(content_length)
+
+
+async def _send_response(writer: asyncio.StreamWriter, status: HTTPStatus, body: dict, keep_alive: bool) -> None:
+    data = json.dumps(body).encode()
+    head = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        "Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(data)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    )
+    writer.write(head.encode("latin-1") + data)
+    await writer.drain()
+
+
+async def _handle_connection(scheduler: CommandScheduler, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+                if request is None:
+                    return
+                method, target, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, response = await _respond(scheduler, method, target, body)
+            except HttpError as e:
+                keep_alive = False
+                status, response = e.status, {"errors": [str(e)]}
+            except Exception as e:
+                logger.exception(f"Failed request: {e}")
+                keep_alive = False
+                status, response = HTTPStatus.INTERNAL_SERVER_ERROR, {"errors": [str(e)]}
+            await _send_response(writer, status, response, keep_alive)
+            if not keep_alive:
+                return
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str = default_host, port: int = default_port) -> None:
+    with CommandScheduler() as scheduler:
+        server = await asyncio.start_server(lambda r, w: _handle_connection(scheduler, r, w), host, port)
+        logger.info(f"Listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    if len(args) > 2:
+        print(f"Too many arguments ({len(args)})")
+        return
+
+    try:
+        port = int(args[0]) if args else default_port
+    except ValueError:
+        port = -1
+    if not 0 <= port <= 65535:
+        print(f"Invalid port {args[0]}, usage: pylmsapi [port [host]]")
+        return
+
+    pylms.pylms.select_storage()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(args[1] if len(args) > 1 else default_host, port))
+    except KeyboardInterrupt:
+        pass
@@ -1,5 +1,5 @@
-from pylms.core import RelationshipAlias
-from pylms.pylms import IOs, EventListener, ExitPyLMS
+from pylms.core import RelationshipAlias, relationship_path_repr
+from pylms.pylms import IOs, EventListener, ExitPyLMS, Stats
 from pylms.pylms import Person, Relationship, RelationshipDefinition
 
 
@@ -20,18 +20,47 @@ class CLI(IOs, EventListener):
 
     @staticmethod
     def _show_relationship_of(*, relationship: Relationship, person: Person) -> None:
-        other = relationship.right if relationship.left == person else relationship.left
+        other = relationship.right if relationship.left.person_id == person.person_id else relationship.left
         print(f"    -> {relationship.repr_for(person)} ({other.person_id}) {other}")
 
+    def _show_resolved_persons(self, resolved_persons: list[(Person, list[Relationship])]) -> None:
+        for person, rs in sorted(resolved_persons, key=lambda t: t[0].person_id):
+            self.show_person(person)
+            for r in rs:
+                self._show_relationship_of(relationship=r, person=person)
+
     def list_persons(self, resolved_persons: list[(Person, list[Relationship])]) -> None:
         if resolved_persons:
-            for person, rs in sorted(resolved_persons, key=lambda t: t[0].person_id):
-                self.show_person(person)
-                for r in rs:
-                    self._show_relationship_of(relationship=r, person=person)
+            self._show_resolved_persons(resolved_persons)
         else:
             print("No Person registered yet.")
 
+    def list_clusters(self, clusters: list[list[(Person, list[Relationship])]]) -> None:
+        if not clusters:
+            print("No Person registered yet.")
+        for index, cluster in enumerate(clusters):
+            print(f"Cluster {index + 1} ({len(cluster)} persons):")
+            self._show_resolved_persons(cluster)
+
+    def show_stats(self, stats: Stats) -> None:
+        print(f"Persons: {stats.persons_count}")
+        print(f"Relationships: {stats.relationships_count}")
+        print(f"Clusters: {len(stats.cluster_sizes)} ({stats.isolated_persons_count} isolated persons)")
+        sizes = [size for size in stats.cluster_sizes if size > 1]
+        if sizes:
+            print(f"Cluster sizes: {', '.join(str(size) for size in sizes)}")
+        if stats.largest_cluster:
+            print(f"Largest cluster: {len(stats.largest_cluster)} persons, including {stats.largest_cluster[0]}")
+
+    def list_duplicates(self, duplicates: list[tuple[Person, Person, float]]) -> None:
+        if not duplicates:
+            print("No duplicate found.")
+        for person, other_person, score in duplicates:
+            print(f"({person.person_id}) {person} ~ ({other_person.person_id}) {other_person}: {score:.0%}")
+
+    def show_relationship_path(self, person: Person, path: list[Relationship]) -> None:
+        print(relationship_path_repr(person, path))
+
     def _interactive_hit_some_keys(self, validate_input, message) -> str:
         while True:
             s = self._input_or_exit_pylms()
@@ -146,6 +175,33 @@ class CLI(IOs, EventListener):
         self._print_how_to_interrupt()
         self._interactive_hit_enter()
 
+    def _confirm_for_persons(self, message: str, persons: list[Person]) -> None:
+        print(message)
+        for person in sorted(persons, key=lambda p: p.person_id):
+            self.show_person(person)
+        self._print_how_to_interrupt()
+        self._interactive_hit_enter()
+
+    def deleting_persons(self, persons_to_delete: list[Person], relationships: list[Relationship]) -> None:
+        self._confirm_for_persons(
+            f"Hit ENTER to delete {len(persons_to_delete)} persons and {len(relationships)} relationships:",
+            persons_to_delete,
+        )
+
+    def tagging_persons(self, persons: list[Person], tag: str) -> None:
+        self._confirm_for_persons(f'Hit ENTER to add tag "{tag}" to {len(persons)} persons:', persons)
+
+    def untagging_persons(self, persons: list[Person], tag: str) -> None:
+        self._confirm_for_persons(f'Hit ENTER to remove tag "{tag}" from {len(persons)} persons:', persons)
+
+    def merging_person(self, merged_person: Person, person: Person) -> None:
+        print("Hit ENTER to merge:")
+        self.show_person(merged_person)
+        print("into:")
+        self.show_person(person)
+        self._print_how_to_interrupt()
+        self._interactive_hit_enter()
+
     def deleting_relationship(self, relationship: Relationship, person: Person) -> None:
         print("Hit ENTER to delete:")
         self._show_relationship_of(relationship=relationship, person=person)
@@ -161,3 +217,31 @@ class CLI(IOs, EventListener):
 
     def configured_from_alias(self, person: Person, alias: RelationshipAlias) -> None:
         print(f"Sex of {person} set to {person.sex} from alias {alias.name}")
+
+
+class BatchCLI(CLI):
+    """
+    CLI which never waits for the user, to execute commands from a script: confirmations are implied, and commands
+    requiring a choice or an input fail.
+    """
+
+    def _input_or_exit_pylms(self):
+        raise ValueError("Interactive input is not supported in batch mode")
+
+    def select_person(self, persons: list[Person]) -> Person | None:
+        raise ValueError(f"{len(persons)} persons match, a more specific pattern is required")
+
+    def deleting_person(self, person_to_delete: Person) -> None:
+        pass
+
+    def deleting_relationship(self, relationship: Relationship, person: Person) -> None:
+        pass
+
+    def creating_link(self, rl_definition: RelationshipDefinition, person_left: Person, person_right: Person) -> None:
+        pass
+
+    def merging_person(self, merged_person: Person, person: Person) -> None:
+        pass
+
+    def _confirm_for_persons(self, message: str, persons: list[Person]) -> None:
+        pass
@@ -1,7 +1,8 @@
 import datetime
 import logging
+import unicodedata
 from pylms.python_utils import require_not_none, first_not_none
-from typing import Callable
+from typing import Callable, Iterable
 
 COPAIN_COPINE_DEFAULT_NAME = "copain de"
 
@@ -24,7 +25,29 @@ MALE: Sex = Sex("MALE")
 FEMALE: Sex = Sex("FEMALE")
 
 
+def search_key(s: str) -> str:
+    """
+    :return: s case folded and without accents (combining marks of its compatibility decomposition), eg. "elodie" for
+             "Élodie"
+    """
+    key = "".join(c for c in unicodedata.normalize("NFKD", s.casefold()) if not unicodedata.combining(c))
+    # s itself when it is its own key, to not hold the same value twice in memory
+    return s if key == s else key
+
+
 class Person:
+    __slots__ = (
+        "person_id",
+        "_firstname",
+        "_lastname",
+        "_sex",
+        "_tags",
+        "created",
+        "_firstname_key",
+        "_lastname_key",
+        "_tag_keys",
+    )
+
     def __init__(
         self,
         person_id: int,
@@ -43,6 +66,7 @@ class Person:
         self.lastname = lastname
         self._sex = None if sex is None else Person._check_sex(sex)
         self._tags: list[str] = []
+        self._tag_keys: tuple[str, ...] = ()
         self.created = Person._check_or_set_created(created)
 
     @staticmethod
@@ -61,6 +85,35 @@ class Person:
         #     raise ValueError(f"created parameter must be a datetime (got {type(dt)})")
         return dt
 
+    @property
+    def firstname(self) -> str:
+        return self._firstname
+
+    @firstname.setter
+    def firstname(self, firstname: str) -> None:
+        self._firstname = firstname
+        self._firstname_key = search_key(firstname)
+
+    @property
+    def lastname(self) -> str | None:
+        return self._lastname
+
+    @lastname.setter
+    def lastname(self, lastname: str | None) -> None:
+        self._lastname = lastname
+        self._lastname_key = None if lastname is None else search_key(lastname)
+
+    @property
+    def firstname_key(self) -> str:
+        """
+        :return: the first name as compared to search patterns, see search_key()
+        """
+        return self._firstname_key
+
+    @property
+    def lastname_key(self) -> str | None:
+        return self._lastname_key
+
     @property
     def sex(self) -> Sex | None:
         return self._sex
@@ -84,6 +137,11 @@ class Person:
     @tags.setter
     def tags(self, tags: list[str]):
         self._tags = Person._ensure_strings(tags)
+        self._tag_keys = tuple(search_key(tag) for tag in tags)
+
+    @property
+    def tag_keys(self) -> tuple[str, ...]:
+        return self._tag_keys
 
     def __eq__(self, other: any) -> bool:
         if isinstance(other, Person):
@@ -94,6 +152,10 @@ class Person:
             )
         return False
 
+    def __hash__(self) -> int:
+        # equal Persons have the same id, while first name and last name can be changed
+        return hash(self.person_id)
+
     def __repr__(self) -> str:
         if self.lastname:
             return f"{self.firstname} {self.lastname}"
@@ -110,7 +172,28 @@ class PersonIdGenerator:
         return res
 
 
+def merge_persons(person: Person, other_person: Person) -> Person:
+    """
+    :return: a copy of person with the tags of both Persons (those of person first), the earliest creation date and
+             the sex of other_person if person has none. Sexes are not checked: they must not conflict
+    """
+    res = Person(
+        person_id=person.person_id,
+        firstname=person.firstname,
+        lastname=person.lastname,
+        created=min(person.created, other_person.created),
+        sex=other_person.sex if person.sex is None else person.sex,
+    )
+    tag_keys = set(person.tag_keys)
+    res.tags = person.tags + [
+        tag for tag, tag_key in zip(other_person.tags, other_person.tag_keys) if tag_key not in tag_keys
+    ]
+    return res
+
+
 class RelationshipAlias:
+    __slots__ = ("_name", "_left_person_sex", "_right_person_sex", "_reverse")
+
     def __init__(
         self,
         name: str,
@@ -167,6 +250,15 @@ class RelationshipAlias:
 
 
 class RelationshipDefinition:
+    __slots__ = (
+        "_name",
+        "_person_left_default_repr",
+        "_person_right_default_repr",
+        "_aliases",
+        "_directional",
+        "_alias_table",
+    )
+
     def __init__(
         self,
         name: str,
@@ -180,6 +272,24 @@ class RelationshipDefinition:
         self._person_right_default_repr: str = name if person_right_default_repr is None else person_right_default_repr
         self._aliases: list[RelationshipAlias] = [] if aliases is None else aliases[:]
         self._directional: bool = directional
+        self._alias_table: dict[tuple[bool, Sex | None], RelationshipAlias] = self._build_alias_table()
+
+    def _build_alias_table(self) -> dict[tuple[bool, Sex | None], RelationshipAlias]:
+        """
+        :return: the alias to represent a Person with, by direction (reverse) and sex of the Person. When several
+                 aliases have the same direction and sex, the first one is used
+        """
+        res = {}
+        for alias in self._aliases:
+            key = (alias.reverse, alias.left_person_sex)
+            if key in res:
+                logger.warning(
+                    f"More than one alias found for reverse={alias.reverse} and sex={alias.left_person_sex}"
+                    f" in {self._name}, {res[key].name} is used rather than {alias.name}"
+                )
+                continue
+            res[key] = alias
+        return res
 
     @property
     def name(self) -> str:
@@ -194,12 +304,7 @@ class RelationshipDefinition:
         return self._directional
 
     def _find_alias(self, reverse: bool, sex: Sex | None) -> RelationshipAlias | None:
-        aliases = [alias for alias in self._aliases if alias.reverse == reverse and alias.left_person_sex == sex]
-        if len(aliases) > 1:
-            logger.warning(f"More than one alias found for reverse={reverse} and sex={sex}")
-        if aliases:
-            return aliases[0]
-        return None
+        return self._alias_table.get((reverse, sex))
 
     def left_repr(self, person: Person) -> str:
         alias = self._find_alias(reverse=False, sex=person.sex)
@@ -244,8 +349,75 @@ copain_copine = RelationshipDefinition(
 
 relationship_definitions: list[RelationshipDefinition] = [parent_enfant, copain_copine]
 
+# kinships derived from the parent_enfant Relationships, which are not stored but computed by a KinshipView
+frere_soeur = RelationshipDefinition(
+    name="frère/sœur de",
+    aliases=[
+        RelationshipAlias("frère de", left_person_sex=MALE),
+        RelationshipAlias("sœur de", left_person_sex=FEMALE),
+    ],
+)
+
+grand_parent_petit_enfant = RelationshipDefinition(
+    name="grand-parent/petit-enfant de",
+    aliases=[
+        RelationshipAlias("grand-père de", left_person_sex=MALE),
+        RelationshipAlias("grand-mère de", left_person_sex=FEMALE),
+        RelationshipAlias("petit-fils de", left_person_sex=MALE, reverse=True),
+        RelationshipAlias("petite-fille de", left_person_sex=FEMALE, reverse=True),
+        RelationshipAlias("grand-parent de"),
+        RelationshipAlias("petit-enfant de", reverse=True),
+    ],
+    person_left_default_repr="grand-parent de",
+    person_right_default_repr="petit-enfant de",
+    directional=True,
+)
+
+oncle_tante_neveu_niece = RelationshipDefinition(
+    name="oncle/tante/neveu/nièce de",
+    aliases=[
+        RelationshipAlias("oncle de", left_person_sex=MALE),
+        RelationshipAlias("tante de", left_person_sex=FEMALE),
+        RelationshipAlias("neveu de", left_person_sex=MALE, reverse=True),
+        RelationshipAlias("nièce de", left_person_sex=FEMALE, reverse=True),
+    ],
+    person_left_default_repr="oncle/tante de",
+    person_right_default_repr="neveu/nièce de",
+    directional=True,
+)
+
+cousin_cousine = RelationshipDefinition(
+    name="cousin/cousine de",
+    aliases=[
+        RelationshipAlias("cousin de", left_person_sex=MALE),
+        RelationshipAlias("cousine de", left_person_sex=FEMALE),
+    ],
+)
+
+# looked up in an AncestorClosure rather than derived by a KinshipView
+ancetre_descendant = RelationshipDefinition(
+    name="ancêtre/descendant de",
+    aliases=[
+        RelationshipAlias("ancêtre de"),
+        RelationshipAlias("descendant de", reverse=True),
+    ],
+    person_left_default_repr="ancêtre de",
+    person_right_default_repr="descendant de",
+    directional=True,
+)
+
+derived_relationship_definitions: list[RelationshipDefinition] = [
+    frere_soeur,
+    grand_parent_petit_enfant,
+    oncle_tante_neveu_niece,
+    cousin_cousine,
+    ancetre_descendant,
+]
+
 
 class Relationship:
+    __slots__ = ("_person_left", "_person_right", "_definition")
+
     def __init__(self, person_left: Person, person_right: Person, definition: RelationshipDefinition) -> None:
         """
         A RelationshipDefinition has a default direction. Left and right designate People in the direction of this
@@ -267,6 +439,18 @@ class Relationship:
     def definition(self) -> RelationshipDefinition:
         return self._definition
 
+    def __eq__(self, other: any) -> bool:
+        if isinstance(other, Relationship):
+            return (
+                self._definition is other._definition
+                and self._person_left == other._person_left
+                and self._person_right == other._person_right
+            )
+        return False
+
+    def __hash__(self) -> int:
+        return hash((self._person_left.person_id, self._person_right.person_id, self._definition.name))
+
     def applies_to(self, person: Person) -> bool:
         return self._person_left == person or self._person_right == person
 
@@ -278,6 +462,417 @@ class Relationship:
         raise ValueError(f"{person} is neither the left nor right person of this {self._definition.name} relationship")
 
 
+def relationship_key(left_id: int, right_id: int, definition: RelationshipDefinition) -> tuple[str, int, int]:
+    """
+    :return: what two Relationships have in common when one is a duplicate of the other: the definition and both ids,
+             in any order if the definition is not directional
+    """
+    if not definition.directional and right_id < left_id:
+        left_id, right_id = right_id, left_id
+    return definition.name, left_id, right_id
+
+
+def _remove_identical(index: dict[int, list[Relationship]], person_id: int, relationship: Relationship) -> None:
+    relationships = index.get(person_id, [])
+    for i, rl in enumerate(relationships):
+        if rl is relationship:
+            del relationships[i]
+            break
+    if not relationships:
+        index.pop(person_id, None)
+
+
+class PersonGraph:
+    def __init__(self, relationships: list[Relationship]) -> None:
+        """
+        Index of Relationships by the id of their Persons, built in a single pass over the Relationships.
+        Lists returned by the methods of this class are those of the index: they must not be modified.
+        """
+        self._outgoing: dict[int, list[Relationship]] = {}
+        self._incoming: dict[int, list[Relationship]] = {}
+        self._all: dict[int, list[Relationship]] = {}
+        for relationship in relationships:
+            self.add(relationship)
+
+    def add(self, relationship: Relationship) -> None:
+        left_id, right_id = relationship.left.person_id, relationship.right.person_id
+        self._outgoing.setdefault(left_id, []).append(relationship)
+        self._incoming.setdefault(right_id, []).append(relationship)
+        self._all.setdefault(left_id, []).append(relationship)
+        if right_id != left_id:
+            self._all.setdefault(right_id, []).append(relationship)
+
+    def remove(self, relationship: Relationship) -> None:
+        left_id, right_id = relationship.left.person_id, relationship.right.person_id
+        _remove_identical(self._outgoing, left_id, relationship)
+        _remove_identical(self._incoming, right_id, relationship)
+        _remove_identical(self._all, left_id, relationship)
+        if right_id != left_id:
+            _remove_identical(self._all, right_id, relationship)
+
+    def outgoing(self, person_id: int) -> list[Relationship]:
+        """
+        :return: the Relationships the Person with the specified id is the left person of
+        """
+        return self._outgoing.get(person_id, [])
+
+    def incoming(self, person_id: int) -> list[Relationship]:
+        """
+        :return: the Relationships the Person with the specified id is the right person of
+        """
+        return self._incoming.get(person_id, [])
+
+    def relationships_of(self, person_id: int) -> list[Relationship]:
+        """
+        :return: the Relationships the Person with the specified id is part of, in the order they were added
+        """
+        return self._all.get(person_id, [])
+
+
+class KinshipView:
+    def __init__(self, relationships: list[Relationship]) -> None:
+        """
+        Materialized view of the kinships derived from the parent_enfant Relationships (see
+        derived_relationship_definitions), kept up to date as Relationships and Persons are added, updated or removed.
+
+        Derived Relationships are indexed in graph. A symmetric kinship (eg. frere_soeur) is materialized once in each
+        direction, so that it is found from either Person.
+        The derived Relationships a Person is the right person of only depend on the parent_enfant Relationships of its
+        parents, grandparents, uncles and aunts: a change is propagated by deriving again the Relationships of the
+        Persons it can affect (see _affected_by), not the whole view.
+        """
+        self._parents = PersonGraph([])
+        self._persons: dict[int, Person] = {}
+        self.graph = PersonGraph([])
+        # derived Relationships by id of their right person
+        self._derived: dict[int, list[Relationship]] = {}
+        for relationship in relationships:
+            if relationship.definition is parent_enfant:
+                self._add_parent_relationship(relationship)
+        for person_id in list(self._persons):
+            self._derive(person_id)
+
+    def _add_parent_relationship(self, relationship: Relationship) -> None:
+        self._parents.add(relationship)
+        self._persons.setdefault(relationship.left.person_id, relationship.left)
+        self._persons.setdefault(relationship.right.person_id, relationship.right)
+
+    def _parent_ids(self, person_ids: Iterable[int]) -> set[int]:
+        return {rl.left.person_id for person_id in person_ids for rl in self._parents.incoming(person_id)}
+
+    def _child_ids(self, person_ids: Iterable[int]) -> set[int]:
+        return {rl.right.person_id for person_id in person_ids for rl in self._parents.outgoing(person_id)}
+
+    def _affected_by(self, parent_id: int, child_id: int) -> set[int]:
+        """
+        :return: the ids of the Persons which derived Relationships may depend on parent_id being a parent of child_id
+        """
+        children = self._child_ids([parent_id])
+        return (
+            {child_id}
+            | children
+            | self._child_ids([child_id])
+            | self._child_ids(children)
+            | self._child_ids(self._child_ids(self._parent_ids([parent_id])))
+        )
+
+    def _derive(self, person_id: int) -> None:
+        """
+        Replace the derived Relationships the Person with the specified id is the right person of.
+        """
+        for rl in self._derived.pop(person_id, []):
+            self.graph.remove(rl)
+        person = self._persons.get(person_id)
+        if person is None:
+            return
+
+        parents = self._parent_ids([person_id])
+        grandparents = self._parent_ids(parents)
+        siblings = self._child_ids(parents) - {person_id}
+        uncles = self._child_ids(grandparents) - parents - {person_id}
+        cousins = self._child_ids(uncles) - siblings - {person_id}
+        derived = [
+            Relationship(person_left=self._persons[related_id], person_right=person, definition=definition)
+            for definition, related_ids in [
+                (frere_soeur, siblings),
+                (grand_parent_petit_enfant, grandparents - {person_id}),
+                (oncle_tante_neveu_niece, uncles),
+                (cousin_cousine, cousins),
+            ]
+            for related_id in sorted(related_ids)
+        ]
+        for rl in derived:
+            self.graph.add(rl)
+        if derived:
+            self._derived[person_id] = derived
+
+    def add(self, relationship: Relationship) -> None:
+        if relationship.definition is not parent_enfant:
+            return
+        self._add_parent_relationship(relationship)
+        for person_id in self._affected_by(relationship.left.person_id, relationship.right.person_id):
+            self._derive(person_id)
+
+    def update_person(self, person: Person) -> None:
+        person_id = person.person_id
+        if person_id not in self._persons:
+            return
+        self._persons[person_id] = person
+        # the Person is the right person of its own derived Relationships and the left person of those of its relatives
+        for related_id in {person_id} | {rl.right.person_id for rl in self.graph.outgoing(person_id)}:
+            self._derive(related_id)
+
+    def remove_person(self, person_id: int) -> None:
+        """
+        Remove the Person with the specified id and the parent_enfant Relationships it is part of.
+        """
+        affected = set()
+        for rl in list(self._parents.relationships_of(person_id)):
+            affected |= self._affected_by(rl.left.person_id, rl.right.person_id)
+            self._parents.remove(rl)
+        self._persons.pop(person_id, None)
+        for affected_id in affected:
+            self._derive(affected_id)
+
+
+class AncestorClosure:
+    def __init__(self, rows: Iterable[tuple[int, int, int]] = ()) -> None:
+        """
+        Transitive closure of the parent_enfant Relationships: every ancestor of every Person, with its depth (1 for a
+        parent, 2 for a grandparent, etc., the shortest one if there are several lines of descent).
+        :param rows: the (ancestor id, descendant id, depth) of the closure, see rows()
+        """
+        self._ancestors: dict[int, dict[int, int]] = {}
+        self._descendants: dict[int, dict[int, int]] = {}
+        self._parents: dict[int, set[int]] = {}
+        self._children: dict[int, set[int]] = {}
+        for ancestor_id, descendant_id, depth in rows:
+            self._set_depth(ancestor_id, descendant_id, depth)
+            if depth == 1:
+                self._parents.setdefault(descendant_id, set()).add(ancestor_id)
+                self._children.setdefault(ancestor_id, set()).add(descendant_id)
+
+    def _set_depth(self, ancestor_id: int, descendant_id: int, depth: int) -> None:
+        self._ancestors.setdefault(descendant_id, {})[ancestor_id] = depth
+        self._descendants.setdefault(ancestor_id, {})[descendant_id] = depth
+
+    def rows(self) -> list[tuple[int, int, int]]:
+        """
+        :return: the (ancestor id, descendant id, depth) of the closure
+        """
+        return [
+            (ancestor_id, descendant_id, depth)
+            for descendant_id, ancestors in self._ancestors.items()
+            for ancestor_id, depth in ancestors.items()
+        ]
+
+    def ancestors(self, person_id: int) -> dict[int, int]:
+        """
+        :return: the depth of each ancestor of the Person with the specified id, by id. Must not be modified.
+        """
+        return self._ancestors.get(person_id, {})
+
+    def descendants(self, person_id: int) -> dict[int, int]:
+        """
+        :return: the depth of each descendant of the Person with the specified id, by id. Must not be modified.
+        """
+        return self._descendants.get(person_id, {})
+
+    def is_ancestor(self, ancestor_id: int, descendant_id: int) -> bool:
+        return ancestor_id in self.ancestors(descendant_id)
+
+    def closest_common_ancestors(self, person_id: int, other_person_id: int) -> list[int]:
+        """
+        :return: the ids of the common ancestors of both Persons with the smallest sum of depths, by id
+        """
+        ancestors, other_ancestors = self.ancestors(person_id), self.ancestors(other_person_id)
+        distances = {
+            ancestor_id: depth + other_ancestors[ancestor_id]
+            for ancestor_id, depth in ancestors.items()
+            if ancestor_id in other_ancestors
+        }
+        closest = min(distances.values(), default=None)
+        return sorted(ancestor_id for ancestor_id, distance in distances.items() if distance == closest)
+
+    def add(self, parent_id: int, child_id: int) -> None:
+        """
+        :raises: ValueError if the child is the parent or one of its ancestors
+        """
+        if parent_id == child_id or self.is_ancestor(child_id, parent_id):
+            raise ValueError(f"Person {child_id} can't be a child of Person {parent_id}, which descends from it")
+
+        self._parents.setdefault(child_id, set()).add(parent_id)
+        self._children.setdefault(parent_id, set()).add(child_id)
+        ancestors = [(parent_id, 0), *self.ancestors(parent_id).items()]
+        descendants = [(child_id, 0), *self.descendants(child_id).items()]
+        for ancestor_id, ancestor_depth in ancestors:
+            for descendant_id, descendant_depth in descendants:
+                depth = ancestor_depth + 1 + descendant_depth
+                if depth < self.ancestors(descendant_id).get(ancestor_id, depth + 1):
+                    self._set_depth(ancestor_id, descendant_id, depth)
+
+    def merge_person(self, merged_person_id: int, person_id: int) -> None:
+        """
+        Replace the Person merged_person_id by the Person person_id in the parent_enfant Relationships, as
+        pylms.storage does, ignoring those which would make the latter its own ancestor.
+        """
+        parent_ids = self._parents.get(merged_person_id, set()) - {person_id}
+        child_ids = self._children.get(merged_person_id, set()) - {person_id}
+        self.remove_person(merged_person_id)
+        for parent_id, child_id in [
+            *((parent_id, person_id) for parent_id in parent_ids),
+            *((person_id, child_id) for child_id in child_ids),
+        ]:
+            try:
+                self.add(parent_id, child_id)
+            except ValueError as e:
+                logger.warning(f"Relationship ignored in ancestors: {e}")
+
+    def remove_person(self, person_id: int) -> None:
+        """
+        Remove the Person with the specified id and its parent_enfant Relationships, then compute again the ancestors of
+        its descendants only, parents first.
+        """
+        affected = set(self.descendants(person_id))
+        for ancestor_id in self._ancestors.pop(person_id, {}):
+            del self._descendants[ancestor_id][person_id]
+        for descendant_id in self._descendants.pop(person_id, {}):
+            del self._ancestors[descendant_id][person_id]
+        for parent_id in self._parents.pop(person_id, set()):
+            self._children[parent_id].discard(person_id)
+        for child_id in self._children.pop(person_id, set()):
+            self._parents[child_id].discard(person_id)
+
+        # topological order of the affected descendants
+        pending_parents = {
+            descendant_id: len(self._parents.get(descendant_id, set()) & affected) for descendant_id in affected
+        }
+        ready = [descendant_id for descendant_id, count in pending_parents.items() if count == 0]
+        while ready:
+            descendant_id = ready.pop()
+            self._compute_ancestors(descendant_id)
+            for child_id in self._children.get(descendant_id, set()):
+                if child_id in pending_parents:
+                    pending_parents[child_id] -= 1
+                    if pending_parents[child_id] == 0:
+                        ready.append(child_id)
+
+    def _compute_ancestors(self, person_id: int) -> None:
+        ancestors = {}
+        for parent_id in self._parents.get(person_id, set()):
+            ancestors[parent_id] = 1
+            for ancestor_id, depth in self.ancestors(parent_id).items():
+                if depth + 1 < ancestors.get(ancestor_id, depth + 2):
+                    ancestors[ancestor_id] = depth + 1
+        for ancestor_id in self._ancestors.pop(person_id, {}):
+            del self._descendants[ancestor_id][person_id]
+        for ancestor_id, depth in ancestors.items():
+            self._set_depth(ancestor_id, person_id, depth)
+
+
+def build_ancestor_closure(relationships: list[Relationship]) -> AncestorClosure:
+    """
+    :return: the AncestorClosure of the parent_enfant Relationships, ignoring (and reporting) those which would make a
+             Person its own ancestor
+    """
+    res = AncestorClosure()
+    for relationship in relationships:
+        if relationship.definition is not parent_enfant:
+            continue
+        try:
+            res.add(relationship.left.person_id, relationship.right.person_id)
+        except ValueError as e:
+            logger.warning(f"Relationship ignored in ancestors: {e}")
+    return res
+
+
+def _other_person_id(relationship: Relationship, person_id: int) -> int:
+    left_id = relationship.left.person_id
+    return relationship.right.person_id if left_id == person_id else left_id
+
+
+def _expand_level(
+    graph: PersonGraph,
+    frontier: list[int],
+    visited: dict[int, tuple[int, Relationship] | None],
+    other_visited: dict[int, tuple[int, Relationship] | None],
+) -> tuple[list[int], list[int]]:
+    """
+    Visit the neighbours of the Persons of the frontier which have not been visited yet.
+    :return: the next frontier and the ids of the Persons it shares with other_visited
+    """
+    next_frontier = []
+    meetings = []
+    for person_id in frontier:
+        for rl in graph.relationships_of(person_id):
+            other_id = _other_person_id(rl, person_id)
+            if other_id in visited:
+                continue
+            visited[other_id] = (person_id, rl)
+            next_frontier.append(other_id)
+            if other_id in other_visited:
+                meetings.append(other_id)
+    return next_frontier, meetings
+
+
+def _path_to(visited: dict[int, tuple[int, Relationship] | None], person_id: int) -> list[Relationship]:
+    """
+    :return: the Relationships from the Person with the specified id back to the origin of the search
+    """
+    path = []
+    while (step := visited[person_id]) is not None:
+        person_id, rl = step
+        path.append(rl)
+    return path
+
+
+def relationship_path(graph: PersonGraph, source_id: int, target_id: int) -> list[Relationship] | None:
+    """
+    Find one of the shortest chains of Relationships between two Persons, regardless of the direction of the
+    Relationships, with a breadth-first search from both Persons at once (always expanding the smallest frontier).
+    :return: the Relationships from the source Person to the target Person, None if they are not related
+    """
+    if source_id == target_id:
+        return []
+
+    # parent Person id and Relationship through which each Person was reached, by id, from each side
+    source_visited: dict[int, tuple[int, Relationship] | None] = {source_id: None}
+    target_visited: dict[int, tuple[int, Relationship] | None] = {target_id: None}
+    source_frontier, target_frontier = [source_id], [target_id]
+    while source_frontier and target_frontier:
+        if len(source_frontier) <= len(target_frontier):
+            source_frontier, meetings = _expand_level(graph, source_frontier, source_visited, target_visited)
+        else:
+            target_frontier, meetings = _expand_level(graph, target_frontier, target_visited, source_visited)
+        if meetings:
+            # Persons of the frontier are at the same distance from its side, not from the other side
+            paths = [
+                _path_to(source_visited, person_id)[::-1] + _path_to(target_visited, person_id)
+                for person_id in meetings
+            ]
+            return min(paths, key=len)
+    return None
+
+
+def relationship_path_repr(person: Person, path: list[Relationship]) -> str:
+    """
+    :return: the chain of Persons along path, from person, each followed by its representation in the next
+             Relationship (eg. "Paul — fils de — Jacques — père de — Tony")
+    """
+    parts = [str(person)]
+    person_id = person.person_id
+    for rl in path:
+        if rl.left.person_id == person_id:
+            parts.append(rl.definition.left_repr(rl.left))
+            person = rl.right
+        else:
+            parts.append(rl.definition.right_repr(rl.right))
+            person = rl.left
+        parts.append(str(person))
+        person_id = person.person_id
+    return " — ".join(parts)
+
+
 def resolve_persons(
     persons: list[Person],
     relationships: list[Relationship],
@@ -292,8 +887,313 @@ def resolve_persons(
         relationship_filter if relationship_filter else accepts_all
     )
 
+    graph = PersonGraph(relationships)
     return [
-        (person, list(filter(lambda r, p=person: r.applies_to(p) and relationship_filter(p, r), relationships)))
+        (person, [r for r in graph.relationships_of(person.person_id) if relationship_filter(person, r)])
         for person in persons
         if person_filter(person)
     ]
+
+
+def _search_match_name(pattern_key: str, person: Person) -> bool:
+    if person.lastname_key:
+        return pattern_key in person.lastname_key or pattern_key in person.firstname_key
+    return pattern_key in person.firstname_key
+
+
+def _search_match_tag(pattern_key: str, person: Person) -> bool:
+    for tag_key in person.tag_keys:
+        if pattern_key in tag_key:
+            return True
+    return False
+
+
+def search_match_name(pattern: str, person: Person) -> bool:
+    """
+    Test whether pattern is part of the first name or the last name of the Person, regardless of the case and accents.
+    """
+    return _search_match_name(search_key(pattern), person)
+
+
+def search_match(pattern: str, person: Person) -> bool:
+    """
+    Test whether pattern is part of the first name, the last name or any tag of the Person, regardless of the case and
+    accents.
+    """
+    pattern_key = search_key(pattern)
+    return _search_match_name(pattern_key, person) or _search_match_tag(pattern_key, person)
+
+
+def related_persons(
+    graph: PersonGraph, persons: list[Person], definition: RelationshipDefinition, alias: RelationshipAlias
+) -> list[Person]:
+    """
+    Follow one hop of a relationship search from the specified Persons.
+    The alias can be a forward (eg. "Père de Peter") or a reverse alias (eg. "Fils de John").
+    In the former case, the Persons are the _right_ person of the Relationships with the definition of the alias and
+    the _left_ person is returned, in the later case the other way around.
+    Finally, the alias can have a left person sex. If so, the returned Persons must also have the same sex.
+    :return: the Persons which are in the relationship described by definition and alias with any of the specified
+             Persons (eg. the Persons who are "Père de" any of them), once each
+    """
+    expected_sex = alias.left_person_sex
+    res = {}
+    for person in persons:
+        relationships = graph.outgoing(person.person_id) if alias.reverse else graph.incoming(person.person_id)
+        for rl in relationships:
+            if rl.definition is not definition:
+                continue
+            related = rl.right if alias.reverse else rl.left
+            if expected_sex is None or related.sex == expected_sex:
+                res[related.person_id] = related
+    return list(res.values())
+
+
+def _trigrams(s: str) -> set[str]:
+    return {s[i : i + 3] for i in range(len(s) - 2)}
+
+
+class TagIndex:
+    def __init__(self, persons: list[Person]) -> None:
+        """
+        Inverted index of the tags of the specified Persons: ids of the Persons by tag.
+        Tags are indexed by their search key, a term matches every tag it is part of (as search_match does).
+        The distinct tags are themselves indexed by trigram (see TrigramIndex), to find those a term is part of.
+        """
+        self._person_ids: set[int] = set()
+        self._index: dict[str, set[int]] = {}
+        self._tag_keys: dict[int, set[str]] = {}
+        self._tag_keys_by_trigram: dict[str, set[str]] = {}
+        for person in persons:
+            self.add(person)
+
+    def add(self, person: Person) -> None:
+        person_id = person.person_id
+        tag_keys = set(person.tag_keys)
+        self._person_ids.add(person_id)
+        self._tag_keys[person_id] = tag_keys
+        for tag_key in tag_keys:
+            if tag_key not in self._index:
+                self._index[tag_key] = set()
+                for trigram in _trigrams(tag_key):
+                    self._tag_keys_by_trigram.setdefault(trigram, set()).add(tag_key)
+            self._index[tag_key].add(person_id)
+
+    def remove(self, person_id: int) -> None:
+        self._person_ids.discard(person_id)
+        for tag_key in self._tag_keys.pop(person_id, ()):
+            person_ids = self._index[tag_key]
+            person_ids.discard(person_id)
+            if not person_ids:
+                del self._index[tag_key]
+                for trigram in _trigrams(tag_key):
+                    tag_keys = self._tag_keys_by_trigram[trigram]
+                    tag_keys.discard(tag_key)
+                    if not tag_keys:
+                        del self._tag_keys_by_trigram[trigram]
+
+    def update(self, person: Person) -> None:
+        self.remove(person.person_id)
+        self.add(person)
+
+    @property
+    def person_ids(self) -> set[int]:
+        return self._person_ids
+
+    def matching(self, term: str) -> set[int]:
+        """
+        :return: the ids of the Persons with a tag term is part of, regardless of the case and accents
+        """
+        term = search_key(term)
+        trigrams = _trigrams(term)
+        if trigrams:
+            postings = sorted((self._tag_keys_by_trigram.get(trigram, set()) for trigram in trigrams), key=len)
+            tag_keys = postings[0].intersection(*postings[1:])
+        else:
+            # term is too short for the trigrams, the (small) set of distinct tags is scanned, not the Persons
+            tag_keys = self._index.keys()
+        res = set()
+        for tag_key in tag_keys:
+            if term in tag_key:
+                res |= self._index[tag_key]
+        return res
+
+
+class TrigramIndex:
+    def __init__(self, persons: list[Person]) -> None:
+        """
+        Inverted index of the trigrams (substrings of 3 characters) of the search keys of the first and last names of
+        the specified Persons: ids of the Persons by trigram.
+        It narrows down the Persons a name search pattern may match to those having all the trigrams of the pattern.
+        """
+        self._index: dict[str, set[int]] = {}
+        self._trigrams: dict[int, set[str]] = {}
+        for person in persons:
+            self.add(person)
+
+    def add(self, person: Person) -> None:
+        person_id = person.person_id
+        trigrams = _trigrams(person.firstname_key)
+        if person.lastname_key:
+            trigrams |= _trigrams(person.lastname_key)
+        self._trigrams[person_id] = trigrams
+        for trigram in trigrams:
+            self._index.setdefault(trigram, set()).add(person_id)
+
+    def remove(self, person_id: int) -> None:
+        for trigram in self._trigrams.pop(person_id, ()):
+            person_ids = self._index[trigram]
+            person_ids.discard(person_id)
+            if not person_ids:
+                del self._index[trigram]
+
+    def update(self, person: Person) -> None:
+        self.remove(person.person_id)
+        self.add(person)
+
+    def candidates(self, pattern: str) -> set[int] | None:
+        """
+        :return: the ids of the Persons which first name or last name may contain pattern, regardless of the case and
+                 accents, or None if pattern is too short to narrow down the Persons
+        """
+        trigrams = _trigrams(search_key(pattern))
+        if not trigrams:
+            return None
+        postings = sorted((self._index.get(trigram, set()) for trigram in trigrams), key=len)
+        res = set(postings[0])
+        for person_ids in postings[1:]:
+            if not res:
+                break
+            res &= person_ids
+        return res
+
+
+class TagTerm:
+    def __init__(self, term: str) -> None:
+        self.term = term
+
+    def evaluate(self, index: TagIndex) -> set[int]:
+        return index.matching(self.term)
+
+    def __repr__(self) -> str:
+        return self.term
+
+
+class TagNot:
+    def __init__(self, operand) -> None:
+        self.operand = operand
+
+    def evaluate(self, index: TagIndex) -> set[int]:
+        return index.person_ids - self.operand.evaluate(index)
+
+    def __repr__(self) -> str:
+        return f"!{self.operand}"
+
+
+class TagAnd:
+    def __init__(self, operands: list) -> None:
+        self.operands = operands
+
+    def evaluate(self, index: TagIndex) -> set[int]:
+        res = self.operands[0].evaluate(index)
+        for operand in self.operands[1:]:
+            if not res:
+                break
+            res = res & operand.evaluate(index)
+        return res
+
+    def __repr__(self) -> str:
+        return "(" + " & ".join(repr(operand) for operand in self.operands) + ")"
+
+
+class TagOr:
+    def __init__(self, operands: list) -> None:
+        self.operands = operands
+
+    def evaluate(self, index: TagIndex) -> set[int]:
+        res = set()
+        for operand in self.operands:
+            res |= operand.evaluate(index)
+        return res
+
+    def __repr__(self) -> str:
+        return "(" + " | ".join(repr(operand) for operand in self.operands) + ")"
+
+
+TagQuery = TagTerm | TagNot | TagAnd | TagOr
+
+TAG_QUERY_OPERATORS = "&|!"
+_TAG_QUERY_TOKENS = TAG_QUERY_OPERATORS + "()"
+
+
+def is_tag_query(text: str) -> bool:
+    return any(operator in text for operator in TAG_QUERY_OPERATORS)
+
+
+def _tokenize_tag_query(text: str) -> list[str]:
+    tokens = []
+    term = ""
+    for c in text:
+        if c in _TAG_QUERY_TOKENS:
+            if term.strip():
+                tokens.append(term.strip())
+            term = ""
+            tokens.append(c)
+        else:
+            term += c
+    if term.strip():
+        tokens.append(term.strip())
+    return tokens
+
+
+def parse_tag_query(text: str) -> TagQuery:
+    """
+    Parse a combination of tags with operators & (and), | (or), ! (not) and parentheses, eg. "escalade & !boulot".
+    ! has precedence over &, which has precedence over |.
+    :raises: ValueError if text is not a valid tag query
+    """
+    tokens = _tokenize_tag_query(text)
+    position = 0
+
+    def peek() -> str | None:
+        return tokens[position] if position < len(tokens) else None
+
+    def next_token() -> str:
+        nonlocal position
+        token = peek()
+        if token is None:
+            raise ValueError("Unexpected end of tag query")
+        position += 1
+        return token
+
+    def parse_or() -> TagQuery:
+        operands = [parse_and()]
+        while peek() == "|":
+            next_token()
+            operands.append(parse_and())
+        return operands[0] if len(operands) == 1 else TagOr(operands)
+
+    def parse_and() -> TagQuery:
+        operands = [parse_not()]
+        while peek() == "&":
+            next_token()
+            operands.append(parse_not())
+        return operands[0] if len(operands) == 1 else TagAnd(operands)
+
+    def parse_not() -> TagQuery:
+        token = next_token()
+        if token == "!":
+            return TagNot(parse_not())
+        if token == "(":
+            res = parse_or()
+            if next_token() != ")":
+                raise ValueError("Missing ) in tag query")
+            return res
+        if token in _TAG_QUERY_TOKENS:
+            raise ValueError(f"Unexpected {token} in tag query")
+        return TagTerm(token)
+
+    query = parse_or()
+    if peek() is not None:
+        raise ValueError(f"Unexpected {peek()} in tag query")
+    return query
@@ -0,0 +1,250 @@
+"""
+pylmsd, a local daemon keeping the Persons, Relationships and indexes in memory, and the thin client pylms acts as when
+the daemon is running.
+
+The daemon listens on a Unix domain socket in the working directory and executes the commands sent by the clients, one
+at a time, the outputs and the inputs of the commands being relayed to the client.
+Messages are frames: the kind of the frame (1 byte), the length of the payload (4 bytes, big-endian) and the payload
+(UTF-8 text).
+"""
+
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+from contextlib import redirect_stdout
+from typing import Callable
+from pylms.cli import CLI
+from pylms.pylms import ExitPyLMS
+
+logger = logging.getLogger(__name__)
+
+socket_file_name = ".pylmsd.sock"
+# seconds a client is given to send its command and each input line, the command is cancelled past this delay: commands
+# being executed one at a time, a client must not hold the others up indefinitely
+input_timeout = 120
+
+# client to daemon
+COMMAND = b"C"  # payload: the arguments of pylms, as a JSON list
+LINE = b"L"  # payload: the line input by the user, after an INPUT frame
+# daemon to client
+OUTPUT = b"O"  # payload: text written to the standard output
+LOG = b"E"  # payload: text written to the standard error
+INPUT = b"I"  # no payload: a line must be input
+END = b"Z"  # no payload: the command is done
+
+_HEADER = struct.Struct(">cI")
+
+
+def send_frame(connection: socket.socket, kind: bytes, payload: str = "") -> None:
+    data = payload.encode()
+    connection.sendall(_HEADER.pack(kind, len(data)) + data)
+
+
+def receive_frame(connection: socket.socket) -> tuple[bytes, str]:
+    """
+    :return: the kind and the payload of the frame
+    :raise EOFError: if the connection is closed
+    """
+    kind, length = _HEADER.unpack(_receive_exactly(connection, _HEADER.size))
+    return kind, _receive_exactly(connection, length).decode()
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size > 0:
+        chunk = connection.recv(min(size, 65536))
+        if not chunk:
+            raise EOFError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _connect() -> socket.socket | None:
+    """
+    :return: a connection to the daemon, None if it is not running
+    """
+    # Unix domain sockets are not available on every platform
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_file_name):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_file_name)
+    except OSError:
+        # the socket file was left by a daemon which did not stop cleanly
+        connection.close()
+        return None
+    return connection
+
+
+def run_client(args: list[str]) -> bool:
+    """
+    Execute a command in the daemon, if it is running, relaying its outputs and inputs.
+    :param args: the arguments of pylms
+    :return: False if the daemon is not running, the command must then be executed directly
+    """
+    connection = _connect()
+    if connection is None:
+        return False
+
+    with connection:
+        send_frame(connection, COMMAND, json.dumps(args))
+        while True:
+            try:
+                kind, payload = receive_frame(connection)
+            except EOFError:
+                print("pylmsd stopped before the end of the command")
+                return True
+            if kind == OUTPUT:
+                sys.stdout.write(payload)
+                sys.stdout.flush()
+            elif kind == LOG:
+                sys.stderr.write(payload)
+            elif kind == INPUT:
+                try:
+                    line = input()
+                except (KeyboardInterrupt, EOFError):
+                    # closing the connection cancels the command
+                    print()
+                    return True
+                try:
+                    send_frame(connection, LINE, line)
+                except OSError:
+                    print("pylmsd stopped before the end of the command")
+                    return True
+            elif kind == END:
+                return True
+
+
+class _FrameWriter(io.TextIOBase):
+    """
+    Text stream sending what is written to the client, as frames of the specified kind, when flushed.
+    Once the client is gone, what is written is dropped: the command goes on without output.
+    """
+
+    def __init__(self, connection: socket.socket, kind: bytes, preceding: "_FrameWriter | None" = None) -> None:
+        """
+        :param preceding: the writer flushed first, for the client to receive what was written in order
+        """
+        super().__init__()
+        self._connection = connection
+        self._kind = kind
+        self._preceding = preceding
+        self._buffer: list[str] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        self._buffer.append(s)
+        return len(s)
+
+    def flush(self) -> None:
+        if self._preceding is not None:
+            self._preceding.flush()
+        if not self._buffer:
+            return
+        payload = "".join(self._buffer)
+        self._buffer = []
+        try:
+            send_frame(self._connection, self._kind, payload)
+        except OSError:
+            pass
+
+
+class DaemonCLI(CLI):
+    """
+    CLI whose inputs are made by the client of the command being executed.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.connection: socket.socket | None = None
+
+    def _input_or_exit_pylms(self):
+        sys.stdout.flush()
+        try:
+            send_frame(self.connection, INPUT)
+            kind, payload = receive_frame(self.connection)
+        except TimeoutError:
+            logger.error(f"No input within {input_timeout} seconds, the command is cancelled.")
+            raise ExitPyLMS()
+        except (OSError, EOFError, ValueError):
+            # the client was interrupted, or sent an invalid frame
+            raise ExitPyLMS()
+        if kind != LINE:
+            raise ExitPyLMS()
+        return payload
+
+
+def serve(daemon_cli: DaemonCLI, execute_command: Callable[[list[str]], None]) -> None:
+    """
+    Listen on the socket and execute the commands of the clients, until interrupted (CTRL+C or SIGTERM).
+    :param daemon_cli: the IOs and EventListener of the commands
+    :param execute_command: executes a command from the arguments of pylms
+    """
+    connection = _connect()
+    if connection is not None:
+        connection.close()
+        print(f"pylmsd is already running ({socket_file_name})")
+        return
+    if os.path.exists(socket_file_name):
+        os.remove(socket_file_name)
+
+    # stop as with CTRL+C, removing the socket file
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_file_name)
+        server.listen()
+        logger.info(f"Listening on {socket_file_name}")
+        try:
+            while True:
+                connection, _ = server.accept()
+                connection.settimeout(input_timeout)
+                with connection:
+                    try:
+                        _serve_connection(connection, daemon_cli, execute_command)
+                    except Exception:
+                        # a client must not stop the daemon
+                        logger.exception("Connection failed")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_file_name)
+
+
+def _serve_connection(
+    connection: socket.socket, daemon_cli: DaemonCLI, execute_command: Callable[[list[str]], None]
+) -> None:
+    try:
+        kind, payload = receive_frame(connection)
+        args = json.loads(payload) if kind == COMMAND else None
+    except (OSError, EOFError, ValueError) as e:
+        logger.warning(f"Invalid command frame: {e}")
+        return
+    if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+        logger.warning(f"Invalid command frame: {kind!r} {payload[:100]!r}")
+        return
+
+    output = _FrameWriter(connection, OUTPUT)
+    log_handler = logging.StreamHandler(_FrameWriter(connection, LOG, preceding=output))
+    log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    logging.getLogger().addHandler(log_handler)
+    daemon_cli.connection = connection
+    try:
+        with redirect_stdout(output):
+            execute_command(args)
+    finally:
+        daemon_cli.connection = None
+        logging.getLogger().removeHandler(log_handler)
+        output.flush()
+        log_handler.flush()
+    try:
+        send_frame(connection, END)
+    except OSError:
+        pass
@@ -0,0 +1,174 @@
+"""
+Detection of Persons which are likely the same person, registered twice.
+
+Rather than comparing every pair of Persons, Persons are grouped by blocking keys (the beginning of their name and its
+phonetic code) and only the pairs of Persons which share a key are scored.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+from functools import partial
+from itertools import combinations
+from pylms.core import Person, PersonGraph, Relationship
+
+# minimum score of the pairs reported as duplicates
+DEFAULT_THRESHOLD = 0.85
+# pairs are scored in other processes only when there are enough of them to pay for starting the processes
+PARALLEL_MIN_PAIRS = 20_000
+# number of pairs sent to a process at once
+_CHUNK_SIZE = 5_000
+# length of the name prefix used as blocking key
+_PREFIX_LENGTH = 3
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+# what is compared of a Person: its full name, its tags and the ids of the Persons it is related to (all as search keys)
+_Features = tuple[str, frozenset[str], frozenset[int]]
+
+
+def soundex(s: str) -> str:
+    """
+    :param s: a search key (see pylms.core.search_key)
+    :return: the Soundex code of the letters of s (eg. "r163" for "robert" and "rupert"), empty if s has no letter
+    """
+    letters = [c for c in s if "a" <= c <= "z"]
+    if not letters:
+        return ""
+    res = [letters[0]]
+    previous = _SOUNDEX_CODES.get(letters[0])
+    for c in letters[1:]:
+        code = _SOUNDEX_CODES.get(c)
+        if code is not None and code != previous:
+            res.append(code)
+            if len(res) == 4:
+                break
+        # h and w do not separate letters with the same code, vowels do
+        if c not in "hw":
+            previous = code
+    return "".join(res).ljust(4, "0")
+
+
+def blocking_keys(person: Person) -> set[str]:
+    """
+    :return: the keys of the blocks the Person belongs to: the beginning and the phonetic code of its last name, of its
+             first name if it has none
+    """
+    if person.lastname_key:
+        name, kind = person.lastname_key, "lastname"
+    else:
+        name, kind = person.firstname_key, "firstname"
+    keys = {f"{kind}:{name[:_PREFIX_LENGTH]}"}
+    code = soundex(name)
+    if code:
+        keys.add(f"{kind}-soundex:{code}")
+    return keys
+
+
+def candidate_pairs(persons: list[Person], max_block_size: int = 1_000) -> set[tuple[int, int]]:
+    """
+    :param max_block_size: blocks with more Persons are ignored, their key being too common to tell anything
+    :return: the ids of the pairs of Persons which share at least one blocking key, lowest id first
+    """
+    blocks: dict[str, list[int]] = {}
+    for person in persons:
+        for key in blocking_keys(person):
+            blocks.setdefault(key, []).append(person.person_id)
+
+    res = set()
+    for person_ids in blocks.values():
+        if len(person_ids) > max_block_size:
+            continue
+        for person_id, other_person_id in combinations(sorted(person_ids), 2):
+            res.add((person_id, other_person_id))
+    return res
+
+
+def _jaccard(s: frozenset, other: frozenset) -> float:
+    return len(s & other) / len(s | other)
+
+
+def _score(features: _Features, other_features: _Features, threshold: float) -> float | None:
+    """
+    :return: the similarity of the names, averaged with the similarity of the tags and of the related Persons when any
+             of both Persons has some, the name weighing three times as much. None if it is below threshold
+    """
+    name, tags, related_ids = features
+    other_name, other_tags, other_related_ids = other_features
+    total = 0.0
+    weights = 3
+    if tags or other_tags:
+        total += _jaccard(tags, other_tags)
+        weights += 1
+    if related_ids or other_related_ids:
+        total += _jaccard(related_ids, other_related_ids)
+        weights += 1
+
+    # the name similarity is computed only if the cheaper upper bounds of it can reach the threshold
+    matcher = SequenceMatcher(None, name, other_name)
+    for name_similarity in (matcher.real_quick_ratio, matcher.quick_ratio, matcher.ratio):
+        score = (total + 3 * name_similarity()) / weights
+        if score < threshold:
+            return None
+    return score
+
+
+def _score_pairs(pairs: list[tuple[_Features, _Features]], threshold: float) -> list[float | None]:
+    return [_score(features, other_features, threshold) for features, other_features in pairs]
+
+
+def _features(person: Person, graph: PersonGraph) -> _Features:
+    name = person.firstname_key if person.lastname_key is None else f"{person.firstname_key} {person.lastname_key}"
+    related_ids = frozenset(
+        rl.right.person_id if rl.left.person_id == person.person_id else rl.left.person_id
+        for rl in graph.relationships_of(person.person_id)
+    )
+    return name, frozenset(person.tag_keys), related_ids
+
+
+def find_duplicates(
+    persons: list[Person],
+    relationships: list[Relationship],
+    threshold: float = DEFAULT_THRESHOLD,
+    max_workers: int | None = None,
+) -> list[tuple[Person, Person, float]]:
+    """
+    Score the candidate pairs (see candidate_pairs()) by similarity of name, tags and related Persons, across several
+    processes if there are many of them.
+    A Person related to the other Person of a pair is not considered a duplicate of it.
+    :return: the pairs of Persons scoring at least threshold and their score, best score first
+    """
+    persons_by_id = {person.person_id: person for person in persons}
+    graph = PersonGraph(relationships)
+    features = {person.person_id: _features(person, graph) for person in persons}
+    pairs = [
+        (person_id, other_person_id)
+        for person_id, other_person_id in sorted(candidate_pairs(persons))
+        if other_person_id not in features[person_id][2]
+    ]
+    feature_pairs = [(features[person_id], features[other_person_id]) for person_id, other_person_id in pairs]
+
+    if len(feature_pairs) < PARALLEL_MIN_PAIRS:
+        scores = _score_pairs(feature_pairs, threshold)
+    else:
+        chunks = [feature_pairs[i : i + _CHUNK_SIZE] for i in range(0, len(feature_pairs), _CHUNK_SIZE)]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            scores = [
+                score
+                for chunk_scores in executor.map(partial(_score_pairs, threshold=threshold), chunks)
+                for score in chunk_scores
+            ]
+
+    res = [
+        (persons_by_id[person_id], persons_by_id[other_person_id], score)
+        for (person_id, other_person_id), score in zip(pairs, scores)
+        if score is not None
+    ]
+    res.sort(key=lambda t: (-t[2], t[0].person_id, t[1].person_id))
+    return res
@@ -4,9 +4,9 @@ import tkinter as tk
 from tkinter.scrolledtext import ScrolledText
 from typing import Callable
 
-from pylms.core import Person, Relationship, RelationshipAlias, RelationshipDefinition
+from pylms.core import Person, Relationship, RelationshipAlias, RelationshipDefinition, relationship_path_repr
 import pylms.pylms
-from pylms.pylms import IOs, EventListener
+from pylms.pylms import IOs, EventListener, Stats
 from pylms.pylms import list_persons, search_persons, store_person
 
 
@@ -105,12 +105,24 @@ class GuiIOs(IOs):
             for rl in rls:
                 self._show_relationship(person, rl)
 
+    def list_clusters(self, clusters: list[list[(Person, list[Relationship])]]) -> None:
+        raise RuntimeError("list_clusters should not have been called")
+
+    def show_stats(self, stats: Stats) -> None:
+        raise RuntimeError("show_stats should not have been called")
+
+    def list_duplicates(self, duplicates: list[tuple[Person, Person, float]]) -> None:
+        raise RuntimeError("list_duplicates should not have been called")
+
     def select_person(self, persons: list[Person]) -> Person | None:
         raise RuntimeError("select_person should not have been called")
 
     def update_person(self, person_to_update: Person) -> Person:
         raise RuntimeError("update_person should not have been called")
 
+    def show_relationship_path(self, person: Person, path: list[Relationship]) -> None:
+        self.gui_manager.write_line(relationship_path_repr(person, path))
+
 
 class GuiEventListener(EventListener):
     def __init__(self, tk_app: TkApp):
@@ -122,6 +134,18 @@ class GuiEventListener(EventListener):
     def deleting_person(self, person_to_delete: Person) -> None:
         raise RuntimeError("deleting_person should not have been called")
 
+    def deleting_persons(self, persons_to_delete: list[Person], relationships: list[Relationship]) -> None:
+        raise RuntimeError("deleting_persons should not have been called")
+
+    def tagging_persons(self, persons: list[Person], tag: str) -> None:
+        raise RuntimeError("tagging_persons should not have been called")
+
+    def untagging_persons(self, persons: list[Person], tag: str) -> None:
+        raise RuntimeError("untagging_persons should not have been called")
+
+    def merging_person(self, merged_person: Person, person: Person) -> None:
+        raise RuntimeError("merging_person should not have been called")
+
     def creating_link(self, rl_definition: RelationshipDefinition, person_left: Person, person_right: Person) -> None:
         raise RuntimeError("creating_link should not have been called")
 
@@ -166,6 +190,7 @@ def _main(window: tk.Tk):
 
     pylms.pylms.ios = GuiIOs(tk_app)
     pylms.pylms.events = GuiEventListener(tk_app)
+    pylms.pylms.select_storage()
     gui_logger = GuiLogger(tk_app)
     try:
         gui_logger.configure()
@@ -1,10 +1,19 @@
 from pylms import storage
+from pylms import storage as json_storage
+from pylms import sqlite_storage
+from pylms import duplicates
 from pylms.core import Person, PersonIdGenerator
-from pylms.core import relationship_definitions, RelationshipDefinition, Relationship, RelationshipAlias
-from pylms.core import resolve_persons
-from pylms.python_utils import require_not_none
+from pylms.core import relationship_definitions, RelationshipDefinition, Relationship, RelationshipAlias, parent_enfant
+from pylms.core import resolve_persons, is_tag_query, parse_tag_query, TagQuery, derived_relationship_definitions
+from pylms.core import merge_persons, search_key
+from pylms.python_utils import require_not_none, AhoCorasick
+from pylms.repository import Repository
 from abc import abstractmethod, ABC
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +22,29 @@ class ExitPyLMS(BaseException):
     pass
 
 
+class Stats:
+    def __init__(
+        self,
+        *,
+        persons_count: int,
+        relationships_count: int,
+        cluster_sizes: list[int],
+        largest_cluster: list[Person],
+    ) -> None:
+        """
+        :param cluster_sizes: number of Persons of each cluster, largest first
+        :param largest_cluster: the Persons of the largest cluster, by id
+        """
+        self.persons_count: int = persons_count
+        self.relationships_count: int = relationships_count
+        self.cluster_sizes: list[int] = cluster_sizes
+        self.largest_cluster: list[Person] = largest_cluster
+
+    @property
+    def isolated_persons_count(self) -> int:
+        return self.cluster_sizes.count(1)
+
+
 class IOs(ABC):
     @abstractmethod
     def show_person(self, person: Person) -> None:
@@ -30,6 +62,29 @@ class IOs(ABC):
     def update_person(self, person_to_update: Person) -> Person:
         pass
 
+    @abstractmethod
+    def list_clusters(self, clusters: list[list[(Person, list[Relationship])]]) -> None:
+        pass
+
+    @abstractmethod
+    def show_stats(self, stats: Stats) -> None:
+        pass
+
+    @abstractmethod
+    def list_duplicates(self, duplicates: list[tuple[Person, Person, float]]) -> None:
+        """
+        :param duplicates: pairs of Persons which are likely the same person, with their similarity (between 0 and 1)
+        """
+        pass
+
+    @abstractmethod
+    def show_relationship_path(self, person: Person, path: list[Relationship]) -> None:
+        """
+        :param person: the Person the path starts from
+        :param path: the Relationships from person to another Person
+        """
+        pass
+
 
 class EventListener(ABC):
     @abstractmethod
@@ -40,6 +95,30 @@ class EventListener(ABC):
     def deleting_person(self, person_to_delete: Person) -> None:
         pass
 
+    @abstractmethod
+    def deleting_persons(self, persons_to_delete: list[Person], relationships: list[Relationship]) -> None:
+        """
+        Confirm the deletion of several Persons at once.
+        :param relationships: the Relationships any of the Persons is part of, deleted along with them
+        """
+        pass
+
+    @abstractmethod
+    def tagging_persons(self, persons: list[Person], tag: str) -> None:
+        pass
+
+    @abstractmethod
+    def untagging_persons(self, persons: list[Person], tag: str) -> None:
+        pass
+
+    @abstractmethod
+    def merging_person(self, merged_person: Person, person: Person) -> None:
+        """
+        :param merged_person: the Person being deleted
+        :param person: the Person merged_person is being merged into
+        """
+        pass
+
     @abstractmethod
     def creating_link(self, rl_definition: RelationshipDefinition, person_left: Person, person_right: Person) -> None:
         pass
@@ -61,15 +140,185 @@ ios: IOs | None = None
 events: EventListener | None = None
 
 
-def list_persons() -> None:
-    persons = storage.read_persons()
+def select_storage() -> None:
+    """
+    Use the SQLite database when there is one in the working directory, the JSON files otherwise.
+    """
+    global storage
+    storage = sqlite_storage if sqlite_storage.database_exists() else json_storage
+
+
+# the Repository of the unit of work in progress, if any
+repository: Repository | None = None
+
 
-    resolved_persons = []
-    if persons:
-        relationships = storage.read_relationships(persons)
-        resolved_persons = resolve_persons(persons, relationships)
+@contextmanager
+def unit_of_work() -> Iterator[Repository]:
+    """
+    Provide a Repository through which the storage is read at most once and written at most once, when leaving the
+    context without error.
+    Contexts can be nested: only the outermost one creates a Repository and writes to the storage.
+    """
+    global repository
+    if repository is not None:
+        yield repository
+        return
+
+    repository = Repository(storage)
+    try:
+        yield repository
+        repository.flush()
+    except BaseException:
+        # Persons read from the storage may have been modified in place and not written
+        storage.clear_cache()
+        raise
+    finally:
+        repository = None
+
+
+# the Repository kept between units of work, along with the key of the storage it was last in sync with, see
+# resident_unit_of_work()
+_resident_repository: Repository | None = None
+_resident_storage_key: tuple | None = None
+# number of the resident units of work in progress, run concurrently by the threads of pylms.api
+_resident_count = 0
+_resident_lock = threading.Lock()
+
+
+@contextmanager
+def resident_unit_of_work() -> Iterator[Repository]:
+    """
+    Same as unit_of_work(), but the Repository, with the Persons, Relationships and indexes it holds, is kept for the
+    next resident unit of work: the storage is read once for all of them (e.g. the commands of a shell) and each one
+    only writes its own changes.
+    The Repository is dropped when leaving the context with an error, or when the storage was written to by another
+    process since the last resident unit of work (see storage_key() of the backends): the next resident unit of work
+    reads the storage again.
+    Resident units of work reading the storage can be run concurrently by several threads, provided none writes to it
+    meanwhile (see pylms.api): they share the Repository, which is only replaced while none is in progress.
+    """
+    global repository, _resident_repository, _resident_storage_key, _resident_count
+    with _resident_lock:
+        if _resident_count == 0:
+            storage_key = storage.storage_key()
+            if _resident_repository is None or storage_key != _resident_storage_key:
+                _resident_repository = Repository(storage)
+                _resident_storage_key = storage_key
+            repository = _resident_repository
+        _resident_count += 1
+    resident_repository = repository
+    try:
+        yield resident_repository
+        if resident_repository.flush():
+            # the storage is in sync with the Repository once written by it, but not when it was read only: it may have
+            # been written to by another process meanwhile
+            with _resident_lock:
+                _resident_storage_key = storage.storage_key()
+    except BaseException:
+        # pending changes and Persons modified in place must not be seen by the next unit of work
+        storage.clear_cache()
+        _resident_repository = None
+        raise
+    finally:
+        with _resident_lock:
+            _resident_count -= 1
+            if _resident_count == 0:
+                repository = None
+
+
+def _command(function: Callable) -> Callable:
+    """
+    Run the decorated function in a unit of work.
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with unit_of_work():
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def _sorted_clusters() -> list[list[int]]:
+    """
+    :return: the ids of the Persons of each cluster, largest clusters first
+    """
+    return sorted(repository.person_clusters(), key=lambda person_ids: (-len(person_ids), min(person_ids)))
+
+
+@_command
+def list_persons(by_cluster: bool = False) -> None:
+    """
+    List all Persons and their Relationships.
+    :param by_cluster: whether to group the Persons by cluster (see pylms.repository.Repository.person_clusters), largest
+                       clusters first, and by id within a cluster
+    """
+    persons = repository.read_persons()
+    if not persons:
+        if by_cluster:
+            ios.list_clusters([])
+        else:
+            ios.list_persons([])
+        return
+
+    resolved_persons = resolve_persons(persons, repository.read_relationships())
+    if not by_cluster:
+        ios.list_persons(resolved_persons)
+        return
+
+    resolved_by_id = {person.person_id: resolved for person, resolved in zip(persons, resolved_persons)}
+    ios.list_clusters(
+        [[resolved_by_id[person_id] for person_id in sorted(person_ids)] for person_ids in _sorted_clusters()]
+    )
+
+
+@_command
+def list_clusters() -> None:
+    """
+    List all Persons and their Relationships, grouped by cluster, see list_persons().
+    """
+    list_persons(by_cluster=True)
+
+
+@_command
+def show_stats() -> None:
+    persons = repository.read_persons()
+    clusters = _sorted_clusters() if persons else []
+    persons_by_id = {person.person_id: person for person in persons}
+    ios.show_stats(
+        Stats(
+            persons_count=len(persons),
+            relationships_count=len(repository.read_relationships()),
+            cluster_sizes=[len(person_ids) for person_ids in clusters],
+            largest_cluster=[persons_by_id[person_id] for person_id in sorted(clusters[0])] if clusters else [],
+        )
+    )
 
-    ios.list_persons(resolved_persons)
+
+@_command
+def find_duplicates() -> None:
+    """
+    List the pairs of Persons which are likely the same person, see pylms.duplicates.
+    """
+    persons = repository.read_persons()
+    relationships = repository.read_relationships()
+    ios.list_duplicates(duplicates.find_duplicates(persons, relationships))
+
+
+@_command
+def complete_person_name(text: str) -> list[str]:
+    """
+    :param text: the beginning of a first name or of a last name
+    :return: the first names and last names starting with text (case-insensitive and accent-insensitive), sorted
+    """
+    key = search_key(text)
+    names = set()
+    for person in repository.read_persons():
+        if person.firstname_key.startswith(key):
+            names.add(person.firstname)
+        if person.lastname_key is not None and person.lastname_key.startswith(key):
+            names.add(person.lastname)
+    return sorted(names)
 
 
 def _select_person(pattern: str) -> Person | None:
@@ -83,6 +332,7 @@ def _select_person(pattern: str) -> Person | None:
     return ios.select_person(persons)
 
 
+@_command
 def update_person(pattern: str) -> None:
     person_to_update: Person = _select_person(pattern)
     if not person_to_update:
@@ -90,71 +340,32 @@ def update_person(pattern: str) -> None:
 
     updated_person = ios.update_person(person_to_update)
 
-    storage.update_person(updated_person)
+    repository.update_person(updated_person)
 
 
 def _search_persons(pattern: str) -> list[Person]:
-    persons = storage.read_persons()
-
-    res = []
-    for person in persons:
-        if _search_match(pattern, person):
-            res.append(person)
-
-    return res
-
-
-def _search_match_name(pattern: str, person: Person) -> bool:
-    if person.lastname:
-        return pattern in person.lastname.lower() or pattern in person.firstname.lower()
-    return pattern in person.firstname.lower()
-
-
-def _search_match_tag(pattern: str, person: Person) -> bool:
-    if person.tags:
-        for tag in person.tags:
-            if pattern in tag.lower():
-                return True
-    return False
-
-
-def _search_match(pattern: str, person: Person) -> bool:
-    pattern = pattern.lower()
-    return _search_match_name(pattern, person) or _search_match_tag(pattern, person)
-
-
-def store_person(firstname: str) -> None:
-    persons = storage.read_persons()
-    id_generator = PersonIdGenerator(persons)
-    person = Person(person_id=id_generator.next_person_id(), firstname=firstname)
-    events.creating_person(person)
-    storage.store_persons([person] + persons)
+    return repository.search_persons(pattern)
 
 
+@_command
 def store_person(firstname: str, lastname: str = None) -> None:
-    persons = storage.read_persons()
-    id_generator = PersonIdGenerator(persons)
-    person = Person(person_id=id_generator.next_person_id(), firstname=firstname, lastname=lastname)
+    person = Person(person_id=repository.next_person_id(), firstname=firstname, lastname=lastname)
     events.creating_person(person)
-    storage.store_persons([person] + persons)
+    repository.add_person(person)
 
 
+@_command
 def delete_person(pattern: str) -> None:
     person_to_delete: Person = _select_person(pattern)
     if not person_to_delete:
         return
 
-    persons = storage.read_persons()
-    relationships = storage.read_relationships(persons[:])
+    relationships = repository.read_relationships_of([person_to_delete])
 
     events.deleting_person(person_to_delete)
-    persons.remove(person_to_delete)
-    for relationship in relationships[:]:
-        if relationship.right == person_to_delete or relationship.left == person_to_delete:
-            events.deleting_relationship(relationship, person_to_delete)
-            relationships.remove(relationship)
-    storage.store_persons(persons)
-    storage.store_relationships(relationships)
+    for relationship in relationships:
+        events.deleting_relationship(relationship, person_to_delete)
+    repository.delete_person(person_to_delete)
 
 
 class LinkRequest:
@@ -177,14 +388,18 @@ class SearchRequest:
         self,
         *,
         pattern: str,
-        definition: RelationshipDefinition | None = None,
-        alias: RelationshipAlias | None = None,
+        relationships: list[tuple[RelationshipDefinition, RelationshipAlias]] | None = None,
+        tag_query: TagQuery | None = None,
     ):
+        """
+        :param relationships: the relationships to follow from the Persons matching pattern, in the order of the
+                              request (eg. "Mère de Père de John" is the mother of the father of John)
+        """
         self.pattern = require_not_none(pattern, "pattern can't be None")
-        if (definition is None) != (alias is None):
-            raise ValueError("Either both definition and alias must be provided or neither of them")
-        self.definition: RelationshipDefinition | None = definition
-        self.alias: RelationshipAlias | None = alias
+        if tag_query is not None and relationships:
+            raise ValueError("A tag query can't be combined with a relationship")
+        self.relationships: list[tuple[RelationshipDefinition, RelationshipAlias]] = relationships or []
+        self.tag_query: TagQuery | None = tag_query
 
 
 class RelationshipPattern:
@@ -205,35 +420,43 @@ class RelationshipPattern:
         self.pattern_after: str | None = pattern_after
 
 
-def _find_relationship_by_alias(
-    definition: RelationshipDefinition, alias: RelationshipAlias, request: str
-) -> RelationshipPattern | None:
-    name = alias.name.lower()
-    try:
-        index = request.index(name)
-        return RelationshipPattern(
-            pattern_before=request[0:index],
-            definition=definition,
-            alias=alias,
-            pattern_after=request[index + len(name) :],
-        )
-    except ValueError:
-        return None
+# compiled from relationship_definitions on first use, see _alias_matcher()
+_alias_matcher_cache: tuple[list[RelationshipDefinition], AhoCorasick] | None = None
+
+
+def _alias_matcher() -> AhoCorasick:
+    """
+    :return: the automaton finding the (lower case) names of the aliases of relationship_definitions and
+             derived_relationship_definitions, compiled again only if relationship_definitions is replaced
+    """
+    global _alias_matcher_cache
+    if _alias_matcher_cache is None or _alias_matcher_cache[0] is not relationship_definitions:
+        definitions = relationship_definitions + derived_relationship_definitions
+        matcher = AhoCorasick([(alias.name.lower(), (rl, alias)) for rl in definitions for alias in rl.aliases])
+        _alias_matcher_cache = relationship_definitions, matcher
+    return _alias_matcher_cache[1]
 
 
 def _find_relationship_pattern(request: str) -> RelationshipPattern | None:
+    """
+    Find the alias in request which occurs first, the longest one if several occur at the same position.
+    """
     if len(request) == 0:
         return None
 
     request: str = request.lower()
 
-    for rl in relationship_definitions:
-        for alias in rl.aliases:
-            rl_pattern = _find_relationship_by_alias(rl, alias, request)
-            if rl_pattern:
-                return rl_pattern
+    match = _alias_matcher().find_leftmost_longest(request)
+    if match is None:
+        return None
 
-    return None
+    start, end, (definition, alias) = match
+    return RelationshipPattern(
+        pattern_before=request[0:start],
+        definition=definition,
+        alias=alias,
+        pattern_after=request[end:],
+    )
 
 
 def _parse_nl_link_request(natural_language_link_request: str) -> LinkRequest | None:
@@ -247,6 +470,10 @@ def _parse_nl_link_request(natural_language_link_request: str) -> LinkRequest |
         logger.error("Unsupported link request: wrong number of person patterns")
         return None
 
+    if rl_pattern.definition in derived_relationship_definitions:
+        logger.error(f"Unsupported link request: {rl_pattern.alias.name} is derived from {parent_enfant.name} links")
+        return None
+
     return LinkRequest(
         left_person_pattern=pattern_before,
         right_person_pattern=pattern_after,
@@ -256,6 +483,13 @@ def _parse_nl_link_request(natural_language_link_request: str) -> LinkRequest |
 
 
 def _parse_search_request(search_request: str) -> SearchRequest | None:
+    if is_tag_query(search_request):
+        try:
+            return SearchRequest(pattern=search_request, tag_query=parse_tag_query(search_request))
+        except ValueError as e:
+            logger.error(f"Unsupported tag search request: {e}")
+            return None
+
     rl_pattern = _find_relationship_pattern(search_request)
     if rl_pattern is None:
         return SearchRequest(pattern=search_request)
@@ -264,9 +498,44 @@ def _parse_search_request(search_request: str) -> SearchRequest | None:
         logger.error(f"Unsupported relationship search request has prefix: {rl_pattern.pattern_before}")
         return None
 
-    return SearchRequest(
-        pattern=rl_pattern.pattern_after.strip(), definition=rl_pattern.definition, alias=rl_pattern.alias
-    )
+    # aliases can be chained (eg. "Mère de Père de John"), until something else than an alias comes up
+    relationships = [(rl_pattern.definition, rl_pattern.alias)]
+    pattern = rl_pattern.pattern_after
+    while (rl_pattern := _find_relationship_pattern(pattern)) is not None and not rl_pattern.pattern_before.strip():
+        relationships.append((rl_pattern.definition, rl_pattern.alias))
+        pattern = rl_pattern.pattern_after
+
+    return SearchRequest(pattern=pattern.strip(), relationships=relationships)
+
+
+@_command
+def merge_person(pattern: str, merged_person_pattern: str) -> None:
+    """
+    Merge the Person matching merged_person_pattern into the Person matching pattern, see Repository.merge_person.
+    """
+    person = _select_person(pattern)
+    merged_person = _select_person(merged_person_pattern)
+
+    if person is None:
+        logger.info(f'No match for "{pattern}".')
+    if merged_person is None:
+        logger.info(f'No match for "{merged_person_pattern}".')
+    if person is None or merged_person is None:
+        return
+
+    if person.person_id == merged_person.person_id:
+        logger.error(f"Unsupported merge request: {person} can't be merged into itself")
+        return
+    if person.sex is not None and merged_person.sex is not None and person.sex != merged_person.sex:
+        logger.error(f"Unsupported merge request: {merged_person} and {person} have different sexes")
+        return
+    # a Person can't descend from itself
+    if repository.is_ancestor(person, merged_person) or repository.is_ancestor(merged_person, person):
+        logger.error(f"Unsupported merge request: {merged_person} is an ancestor or a descendant of {person}")
+        return
+
+    events.merging_person(merged_person, person)
+    repository.merge_person(merged_person, merge_persons(person, merged_person))
 
 
 def _configure_person(alias: RelationshipAlias, person: Person, configure_method: str) -> Person:
@@ -275,10 +544,11 @@ def _configure_person(alias: RelationshipAlias, person: Person, configure_method
     if configured_person is None:
         return person
     events.configured_from_alias(alias=alias, person=configured_person)
-    storage.update_person(person)
+    repository.update_person(configured_person)
     return configured_person
 
 
+@_command
 def link_persons(natural_language_link_request: str) -> None:
     link_request = _parse_nl_link_request(natural_language_link_request)
     if link_request is None:
@@ -294,6 +564,15 @@ def link_persons(natural_language_link_request: str) -> None:
     if rq_person_left is None or rq_person_right is None:
         return
 
+    # a Person can't descend from itself
+    if link_request.definition is parent_enfant:
+        parent, child = link_request.alias.to_relationship_definition_direction(
+            left_person=rq_person_left, right_person=rq_person_right
+        )
+        if parent.person_id == child.person_id or repository.is_ancestor(child, parent):
+            logger.error(f"Unsupported link request: {child} is {parent} or one of their ancestors")
+            return
+
     # configure persons from alias, if any
     person_left = _configure_person(link_request.alias, rq_person_left, "configure_left_person")
     person_right = _configure_person(link_request.alias, rq_person_right, "configure_right_person")
@@ -304,73 +583,158 @@ def link_persons(natural_language_link_request: str) -> None:
 
     # create link
     events.creating_link(link_request.definition, rl_person_left, rl_person_right)
-    persons = storage.read_persons()
-    relationships = storage.read_relationships(persons)
     relationship = Relationship(
         person_left=rl_person_left,
         person_right=rl_person_right,
         definition=link_request.definition,
     )
-    storage.store_relationships(relationships + [relationship])
-
-
-def _rl_match(search_request: SearchRequest, rl: Relationship) -> bool:
-    """
-    Test whether the provided Relationship match the SearchRequest.
-    First, a matching relationship must have the same definition as the SearchRequest.
-    Then, the SearchRequest can have a forward (eg. "Père de Peter")  or a reverse alias (eg. "Fils de John").
-    In the former case, a matching relationship must have the _right_ person matching the pattern ("Peter"),
-    in the later case a matching relationship must have the _left_ person matching the pattern ("John" this time).
-    Finally, the alias in the SearchRequest can have a left person sex. If so, the person must also have the same sex.
-    """
-    if rl.definition != search_request.definition:
-        return False
-
-    person_to_match_pattern, person_to_match_sex = rl.right, rl.left
-    if search_request.alias.reverse:
-        person_to_match_pattern, person_to_match_sex = rl.left, rl.right
-    if _search_match(search_request.pattern, person_to_match_pattern):
-        expected_sex = search_request.alias.left_person_sex
-        if expected_sex:
-            return person_to_match_sex.sex == expected_sex
-        return True
-
-    return False
+    repository.add_relationship(relationship)
 
 
 def _search_request_relationship(search_request: SearchRequest) -> list[Person]:
-    persons = storage.read_persons()
-    relationships = storage.read_relationships(persons)
+    # the relationship closest to the pattern is followed first
+    *outer_relationships, (definition, alias) = search_request.relationships
+    persons = repository.search_related_persons(definition, alias, search_request.pattern)
+    for definition, alias in reversed(outer_relationships):
+        if not persons:
+            break
+        persons = repository.related_persons_of(persons, definition, alias)
+    return persons
 
-    return [r.right if search_request.alias.reverse else r.left for r in relationships if _rl_match(search_request, r)]
 
-
-def search_persons(search_request_string: str) -> None:
+def _search_request_persons(search_request_string: str) -> list[Person] | None:
+    """
+    :return: the Persons matching the search request, once each, None if the request is not supported
+    """
     search_request = _parse_search_request(search_request_string)
+    if search_request is None:
+        return None
 
-    if search_request.definition:
+    if search_request.tag_query:
+        person_hits = repository.search_tags(search_request.tag_query)
+    elif search_request.relationships:
         person_hits = _search_request_relationship(search_request)
     else:
         person_hits = _search_persons(search_request_string)
 
     if not person_hits:
         logger.info(f'No match for "{search_request_string}".')
+    # a Person may be hit more than once (eg. through several relationships)
+    return list(dict.fromkeys(person_hits))
+
+
+@_command
+def search_persons(search_request_string: str) -> None:
+    persons = _search_request_persons(search_request_string)
+    if not persons:
         return
 
-    persons = storage.read_persons()
+    relationships = repository.read_relationships_of(persons)
+
+    ios.list_persons(resolve_persons(persons=persons, relationships=relationships))
 
-    resolved_persons = []
-    if persons:
-        relationships = storage.read_relationships(persons)
 
-        def p_filter(p: Person) -> bool:
-            return p in person_hits
+@_command
+def delete_persons(search_request_string: str) -> None:
+    """
+    Delete every Person matching the search request, and the Relationships they are part of, after a single
+    confirmation.
+    """
+    persons_to_delete = _search_request_persons(search_request_string)
+    if not persons_to_delete:
+        return
 
-        def rl_filter(p: Person, _: Relationship) -> bool:
-            return p in person_hits
+    relationships = repository.read_relationships_of(persons_to_delete)
 
-        resolved_persons = resolve_persons(
-            persons=persons, relationships=relationships, person_filter=p_filter, relationship_filter=rl_filter
-        )
+    events.deleting_persons(persons_to_delete, relationships)
+    repository.delete_persons(persons_to_delete)
+
+
+@_command
+def tag_persons(tag: str, search_request_string: str) -> None:
+    """
+    Add the tag to every Person matching the search request which does not have it yet, after a single confirmation.
+    """
+    persons = _search_request_persons(search_request_string)
+    if not persons:
+        return
+
+    tag_key = search_key(tag)
+    persons_to_tag = [person for person in persons if tag_key not in person.tag_keys]
+    if not persons_to_tag:
+        logger.info(f'Every Person matching "{search_request_string}" already has tag "{tag}".')
+        return
+
+    events.tagging_persons(persons_to_tag, tag)
+    for person in persons_to_tag:
+        person.tags = person.tags + [tag]
+    repository.update_persons(persons_to_tag)
+
+
+@_command
+def untag_persons(tag: str, search_request_string: str) -> None:
+    """
+    Remove the tag (regardless of the case and accents) from every Person matching the search request, after a single
+    confirmation.
+    """
+    persons = _search_request_persons(search_request_string)
+    if not persons:
+        return
+
+    tag_key = search_key(tag)
+    persons_to_untag = [person for person in persons if tag_key in person.tag_keys]
+    if not persons_to_untag:
+        logger.info(f'No Person matching "{search_request_string}" has tag "{tag}".')
+        return
+
+    events.untagging_persons(persons_to_untag, tag)
+    for person in persons_to_untag:
+        person.tags = [t for t, t_key in zip(person.tags, person.tag_keys) if t_key != tag_key]
+    repository.update_persons(persons_to_untag)
+
+
+@_command
+def find_relationship_path(left_person_pattern: str, right_person_pattern: str) -> None:
+    """
+    Show how the Persons matching the specified patterns are related, through as few Relationships as possible.
+    """
+    person_left = _select_person(left_person_pattern)
+    person_right = _select_person(right_person_pattern)
+
+    if person_left is None:
+        logger.info(f'No match for "{left_person_pattern}".')
+    if person_right is None:
+        logger.info(f'No match for "{right_person_pattern}".')
+    if person_left is None or person_right is None:
+        return
+
+    path = repository.relationship_path(person_left, person_right)
+    if path is None:
+        logger.info(f"{person_left} and {person_right} are not related.")
+        return
+
+    ios.show_relationship_path(person_left, path)
+
+
+@_command
+def find_common_ancestors(left_person_pattern: str, right_person_pattern: str) -> None:
+    """
+    Show the closest common ancestors of the Persons matching the specified patterns.
+    """
+    person_left = _select_person(left_person_pattern)
+    person_right = _select_person(right_person_pattern)
+
+    if person_left is None:
+        logger.info(f'No match for "{left_person_pattern}".')
+    if person_right is None:
+        logger.info(f'No match for "{right_person_pattern}".')
+    if person_left is None or person_right is None:
+        return
+
+    ancestors = repository.closest_common_ancestors(person_left, person_right)
+    if not ancestors:
+        logger.info(f"{person_left} and {person_right} have no common ancestor.")
+        return
 
-    ios.list_persons(resolved_persons)
+    relationships = repository.read_relationships_of(ancestors)
+    ios.list_persons(resolve_persons(persons=ancestors, relationships=relationships))
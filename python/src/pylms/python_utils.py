@@ -21,3 +21,112 @@ def first_not_none(*args: T | None) -> T:
         if t is not None:
             return t
     raise ValueError("At least one parameter must be not None")
+
+
+class AhoCorasick:
+    def __init__(self, patterns: list[tuple[str, T]]) -> None:
+        """
+        Automaton finding all the occurrences of several patterns in a text in a single pass over the text.
+        :param patterns: the patterns to find, along with the value to return for each. When a pattern is provided
+                         more than once, its first value is kept
+        """
+        # states are indexes in these lists, state 0 is the root
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        # for each state, the (length, value) of the patterns ending at this state, longest first
+        self._output: list[list[tuple[int, T]]] = [[]]
+
+        for pattern, value in patterns:
+            if not pattern:
+                raise ValueError("pattern can't be empty")
+            state = 0
+            for c in pattern:
+                next_state = self._goto[state].get(c)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][c] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            if not self._output[state]:
+                self._output[state].append((len(pattern), value))
+
+        # breadth first, so that the failure state of a state is computed before its own
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for c, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(c, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find_all(self, text: str) -> list[tuple[int, int, T]]:
+        """
+        :return: start, end (exclusive) and value of every occurrence of the patterns in text, by end then longest
+                 first
+        """
+        res = []
+        state = 0
+        for index, c in enumerate(text):
+            while state and c not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(c, 0)
+            for length, value in self._output[state]:
+                res.append((index + 1 - length, index + 1, value))
+        return res
+
+    def find_leftmost_longest(self, text: str) -> tuple[int, int, T] | None:
+        """
+        :return: start, end (exclusive) and value of the occurrence of the patterns in text which starts first, the
+                 longest one if several start at the same index, or None if there is none
+        """
+        return min(self.find_all(text), key=lambda match: (match[0], -match[1]), default=None)
+
+
+class UnionFind:
+    def __init__(self) -> None:
+        """
+        Disjoint sets of elements, merged with union() in near constant time (union by size and path halving).
+        """
+        self._parents: dict = {}
+        self._sizes: dict = {}
+
+    def add(self, element: T) -> None:
+        """
+        Add element as a set of its own, unless it is already known.
+        """
+        if element not in self._parents:
+            self._parents[element] = element
+            self._sizes[element] = 1
+
+    def find(self, element: T) -> T:
+        """
+        :return: the representative of the set of element, which is added if unknown
+        """
+        self.add(element)
+        parents = self._parents
+        while parents[element] != element:
+            parents[element] = parents[parents[element]]
+            element = parents[element]
+        return element
+
+    def union(self, element: T, other_element: T) -> None:
+        root, other_root = self.find(element), self.find(other_element)
+        if root == other_root:
+            return
+        if self._sizes[root] < self._sizes[other_root]:
+            root, other_root = other_root, root
+        self._parents[other_root] = root
+        self._sizes[root] += self._sizes.pop(other_root)
+
+    def groups(self) -> list[list[T]]:
+        """
+        :return: the sets, each in the order its elements were added, by order of their first element
+        """
+        res = {}
+        for element in self._parents:
+            res.setdefault(self.find(element), []).append(element)
+        return list(res.values())
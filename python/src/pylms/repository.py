@@ -0,0 +1,539 @@
+from pylms.core import Person, PersonIdGenerator, PersonGraph, Relationship, RelationshipAlias, RelationshipDefinition
+from pylms.core import search_match, search_match_name, related_persons, relationship_path, TagIndex, TagQuery
+from pylms.core import KinshipView, TrigramIndex, derived_relationship_definitions
+from pylms.core import AncestorClosure, ancetre_descendant, build_ancestor_closure, parent_enfant, relationship_key
+from pylms.python_utils import UnionFind
+from pylms.storage import ADD_PERSON, UPDATE_PERSON, DELETE_PERSON, ADD_RELATIONSHIP, MERGE_PERSON
+from types import ModuleType
+
+
+def _with_persons(rl: Relationship, persons: dict[int, Person]) -> Relationship:
+    """
+    :param persons: Persons by id
+    :return: rl if it references the specified Persons or is unrelated to them, otherwise a copy of rl referencing them
+             in place of the (outdated) Persons with the same ids
+    """
+    left = persons.get(rl.left.person_id, rl.left)
+    right = persons.get(rl.right.person_id, rl.right)
+    if left is rl.left and right is rl.right:
+        return rl
+    return Relationship(person_left=left, person_right=right, definition=rl.definition)
+
+
+def _merge_person_relationships(
+    relationships: list[Relationship], merged_person_id: int, person: Person
+) -> list[Relationship]:
+    """
+    :return: the Relationships with the Person merged_person_id replaced by person, but those which would link the
+             latter to itself or duplicate another Relationship, as replayed by pylms.storage
+    """
+    res = []
+    keys = set()
+    for rl in relationships:
+        if {merged_person_id, person.person_id}.isdisjoint((rl.left.person_id, rl.right.person_id)):
+            res.append(rl)
+            continue
+        left = person if rl.left.person_id == merged_person_id else rl.left
+        right = person if rl.right.person_id == merged_person_id else rl.right
+        key = relationship_key(left.person_id, right.person_id, rl.definition)
+        if left.person_id == right.person_id or key in keys:
+            continue
+        keys.add(key)
+        res.append(
+            rl
+            if left is rl.left and right is rl.right
+            else Relationship(person_left=left, person_right=right, definition=rl.definition)
+        )
+    return res
+
+
+class Repository:
+    def __init__(self, backend: ModuleType) -> None:
+        """
+        In-memory view of a storage backend (pylms.storage or pylms.sqlite_storage) for the duration of a unit of work,
+        or of several ones when kept by pylms.pylms.resident_unit_of_work(): the views it derives (eg. KinshipView) and
+        its indexes are then kept as well, until the storage is written to by another process.
+
+        Persons and Relationships are read from the backend at most once, changes are applied in memory and recorded to
+        be written to the backend at once by flush().
+        Queries are run in memory unless the backend runs them itself (see QUERY_PUSHDOWN).
+        Pending changes are replayed on top of what is read from the backend later on, but for a backend running queries
+        itself: they are staged in its open transaction instead (see pylms.sqlite_storage.stage_changes()), to be
+        written by flush() along with the later ones.
+        """
+        self._backend = backend
+        self._pushdown: bool = getattr(backend, "QUERY_PUSHDOWN", False) is True
+        self._persons: list[Person] | None = None
+        self._relationships: list[Relationship] | None = None
+        self._graph: PersonGraph | None = None
+        self._kinship: KinshipView | None = None
+        # read from the backend (or built) on first use, see _ancestor_closure()
+        self._closure: AncestorClosure | None = None
+        # whether the closure was built rather than read, to be written by flush()
+        self._closure_built: bool = False
+        # ids of the Persons connected by Relationships, see person_clusters()
+        self._clusters: UnionFind | None = None
+        # indexes of the Persons, built together on first use, see _index_persons()
+        self._person_index: dict[int, Person] | None = None
+        self._tag_index: TagIndex | None = None
+        self._name_index: TrigramIndex | None = None
+        # whether a name search was run by a scan of the Persons, see search_persons()
+        self._scanned: bool = False
+        # next id to give to a Person, computed on first use, see next_person_id()
+        self._next_person_id: int | None = None
+        self._changes: list[tuple[str, Person | Relationship | tuple[Person, Person]]] = []
+        # whether changes were staged by the backend, see _sync()
+        self._staged: bool = False
+        # number of the pending changes kept by rollback(), see savepoint()
+        self._savepoint: int = 0
+
+    def _sync(self) -> None:
+        """
+        Make the pending changes visible to the next queries of a backend running them itself.
+        Other backends are left as is: the pending changes are replayed on top of what is read from them instead.
+        """
+        if self._pushdown and self._changes:
+            self._backend.stage_changes(self._changes)
+            self._changes = []
+            self._staged = True
+
+    def read_persons(self) -> list[Person]:
+        if self._persons is None:
+            self._sync()
+            persons = self._backend.read_persons()
+            if not self._changes:
+                self._persons = persons
+                return self._persons
+
+            # the pending changes are replayed on top of the Persons written, see _sync()
+            persons_by_id = {person.person_id: person for person in persons}
+            for kind, o in self._changes:
+                if kind == ADD_PERSON:
+                    persons_by_id[o.person_id] = o
+                elif kind == UPDATE_PERSON and o.person_id in persons_by_id:
+                    persons_by_id[o.person_id] = o
+                elif kind == DELETE_PERSON:
+                    persons_by_id.pop(o.person_id, None)
+                elif kind == MERGE_PERSON:
+                    persons_by_id.pop(o[0].person_id, None)
+            self._persons = list(persons_by_id.values())
+        return self._persons
+
+    def read_relationships(self) -> list[Relationship]:
+        if self._relationships is None:
+            persons = self.read_persons()
+            self._sync()
+            if not self._changes:
+                self._relationships = self._backend.read_relationships(persons) if persons else []
+                return self._relationships
+
+            # the pending changes are replayed on top of the Relationships written, those of the Persons deleted since
+            # included, see _sync()
+            deleted_persons = [
+                o if kind == DELETE_PERSON else o[0]
+                for kind, o in self._changes
+                if kind in (DELETE_PERSON, MERGE_PERSON)
+            ]
+            relationships = (
+                self._backend.read_relationships(persons + deleted_persons) if persons or deleted_persons else []
+            )
+            for kind, o in self._changes:
+                if kind == ADD_RELATIONSHIP:
+                    relationships.append(o)
+                elif kind == DELETE_PERSON:
+                    relationships = [
+                        rl for rl in relationships if o.person_id not in (rl.left.person_id, rl.right.person_id)
+                    ]
+                elif kind == MERGE_PERSON:
+                    merged_person, person = o
+                    relationships = _merge_person_relationships(relationships, merged_person.person_id, person)
+            # the Persons were updated since, see update_persons()
+            persons_by_id = {person.person_id: person for person in persons}
+            self._relationships = [_with_persons(rl, persons_by_id) for rl in relationships]
+        return self._relationships
+
+    def _person_graph(self) -> PersonGraph:
+        if self._graph is None:
+            self._graph = PersonGraph(self.read_relationships())
+        return self._graph
+
+    def _kinship_view(self) -> KinshipView:
+        if self._kinship is None:
+            self._kinship = KinshipView(self.read_relationships())
+        return self._kinship
+
+    def _ancestor_closure(self) -> AncestorClosure:
+        """
+        Only used with backends which do not run queries themselves.
+        """
+        if self._closure is None:
+            closure = self._backend.read_ancestors()
+            if closure is None:
+                self._closure = build_ancestor_closure(self.read_relationships())
+                self._closure_built = True
+                return self._closure
+
+            # the closure is as written, the pending changes are replayed on top of it
+            for kind, o in self._changes:
+                if kind == ADD_RELATIONSHIP and o.definition is parent_enfant:
+                    closure.add(o.left.person_id, o.right.person_id)
+                elif kind == DELETE_PERSON:
+                    closure.remove_person(o.person_id)
+                elif kind == MERGE_PERSON:
+                    merged_person, person = o
+                    closure.merge_person(merged_person.person_id, person.person_id)
+            self._closure = closure
+        return self._closure
+
+    def _pushed_down(self, definition: RelationshipDefinition) -> bool:
+        # kinships are derived in memory, ancestors are looked up by the backend
+        return self._pushdown and (
+            definition is ancetre_descendant or definition not in derived_relationship_definitions
+        )
+
+    def _index_persons(self) -> None:
+        if self._person_index is None:
+            persons = self.read_persons()
+            self._tag_index = TagIndex(persons)
+            self._name_index = TrigramIndex(persons)
+            # set last: the indexes are complete once it is
+            self._person_index = {person.person_id: person for person in persons}
+
+    def _persons_by_id(self, person_ids: set[int]) -> list[Person]:
+        return [self._person_index[person_id] for person_id in sorted(person_ids)]
+
+    def next_person_id(self) -> int:
+        if self._next_person_id is None:
+            if self._pushdown and self._persons is None:
+                self._sync()
+                self._next_person_id = self._backend.next_person_id()
+            else:
+                self._next_person_id = PersonIdGenerator(self.read_persons()).next_person_id()
+        return self._next_person_id
+
+    def search_persons(self, pattern: str) -> list[Person]:
+        """
+        :return: the Persons which first name, last name or any tag contains pattern (see pylms.core.search_match), by id
+        """
+        if self._pushdown:
+            self._sync()
+            return self._backend.search_persons(pattern)
+        if self._person_index is None and not self._scanned:
+            # building the indexes costs more than a scan: it only pays off from the next search on (e.g. in a shell)
+            self._scanned = True
+            return sorted(
+                (person for person in self.read_persons() if search_match(pattern, person)), key=lambda p: p.person_id
+            )
+        self._index_persons()
+        candidates = self._name_index.candidates(pattern)
+        if candidates is None:
+            # pattern is too short for the trigram index
+            return self._persons_by_id(
+                {person_id for person_id, person in self._person_index.items() if search_match(pattern, person)}
+            )
+        person_ids = {
+            person_id for person_id in candidates if search_match_name(pattern, self._person_index[person_id])
+        }
+        return self._persons_by_id(person_ids | self._tag_index.matching(pattern))
+
+    def search_tags(self, query: TagQuery) -> list[Person]:
+        """
+        :return: the Persons which tags satisfy the query, by id
+        """
+        if self._pushdown:
+            self._sync()
+            return self._backend.search_tags(query)
+        self._index_persons()
+        return self._persons_by_id(query.evaluate(self._tag_index))
+
+    def search_related_persons(
+        self, definition: RelationshipDefinition, alias: RelationshipAlias, pattern: str
+    ) -> list[Person]:
+        if self._pushed_down(definition):
+            self._sync()
+            return self._backend.search_related_persons(definition, alias, pattern)
+        return self.related_persons_of(self.search_persons(pattern), definition, alias)
+
+    def related_persons_of(
+        self, persons: list[Person], definition: RelationshipDefinition, alias: RelationshipAlias
+    ) -> list[Person]:
+        """
+        :return: the Persons in the relationship described by definition and alias with any of the specified Persons,
+                 see pylms.core.related_persons
+        """
+        if self._pushed_down(definition):
+            self._sync()
+            return self._backend.related_persons_of(persons, definition, alias)
+        if definition is ancetre_descendant:
+            closure = self._ancestor_closure()
+            lookup = closure.descendants if alias.reverse else closure.ancestors
+            self._index_persons()
+            return self._persons_by_id(
+                {related_id for person in persons for related_id in lookup(person.person_id)}
+                & self._person_index.keys()
+            )
+        if definition in derived_relationship_definitions:
+            return related_persons(self._kinship_view().graph, persons, definition, alias)
+        return related_persons(self._person_graph(), persons, definition, alias)
+
+    def is_ancestor(self, ancestor: Person, descendant: Person) -> bool:
+        if self._pushdown:
+            self._sync()
+            return self._backend.is_ancestor(ancestor, descendant)
+        return self._ancestor_closure().is_ancestor(ancestor.person_id, descendant.person_id)
+
+    def closest_common_ancestors(self, person: Person, other_person: Person) -> list[Person]:
+        """
+        :return: the common ancestors of both Persons with the smallest sum of depths, by id
+        """
+        if self._pushdown:
+            self._sync()
+            return self._backend.closest_common_ancestors(person, other_person)
+        ancestor_ids = self._ancestor_closure().closest_common_ancestors(person.person_id, other_person.person_id)
+        self._index_persons()
+        return self._persons_by_id(set(ancestor_ids) & self._person_index.keys())
+
+    def read_relationships_of(self, persons: list[Person]) -> list[Relationship]:
+        """
+        :return: the Relationships any of the specified Persons is part of
+        """
+        if self._pushdown:
+            self._sync()
+            return self._backend.read_relationships_of(persons)
+        graph = self._person_graph()
+        if len(persons) == 1:
+            return list(graph.relationships_of(persons[0].person_id))
+        # a Relationship between two of the Persons must be returned once
+        relationships = {}
+        for person in persons:
+            for rl in graph.relationships_of(person.person_id):
+                relationships[id(rl)] = rl
+        return list(relationships.values())
+
+    def relationship_path(self, source: Person, target: Person) -> list[Relationship] | None:
+        """
+        :return: one of the shortest chains of Relationships from source to target, None if they are not related, see
+                 pylms.core.relationship_path
+        """
+        return relationship_path(self._person_graph(), source.person_id, target.person_id)
+
+    def person_clusters(self) -> list[list[int]]:
+        """
+        :return: the ids of the Persons of each cluster, i.e. Persons connected through Relationships, whatever their
+                 direction or definition
+        """
+        if self._clusters is None:
+            clusters = UnionFind()
+            for person in self.read_persons():
+                clusters.add(person.person_id)
+            for rl in self.read_relationships():
+                clusters.union(rl.left.person_id, rl.right.person_id)
+            self._clusters = clusters
+        return self._clusters.groups()
+
+    def add_person(self, person: Person) -> None:
+        if self._persons is not None:
+            self._persons.append(person)
+        if self._person_index is not None:
+            self._person_index[person.person_id] = person
+            self._tag_index.add(person)
+            self._name_index.add(person)
+        if self._clusters is not None:
+            self._clusters.add(person.person_id)
+        if self._next_person_id is not None:
+            self._next_person_id = max(self._next_person_id, person.person_id + 1)
+        self._changes.append((ADD_PERSON, person))
+
+    def update_person(self, person_to_update: Person) -> None:
+        self.update_persons([person_to_update])
+
+    def update_persons(self, persons_to_update: list[Person]) -> None:
+        """
+        Update the specified Persons in a single pass over the Persons and the Relationships.
+        """
+        persons_by_id = {person.person_id: person for person in persons_to_update}
+        if self._persons is not None:
+            self._persons = [persons_by_id.get(person.person_id, person) for person in self._persons]
+        if self._relationships is not None:
+            self._relationships = [_with_persons(rl, persons_by_id) for rl in self._relationships]
+            self._graph = None
+        for person in persons_to_update:
+            if self._person_index is not None and person.person_id in self._person_index:
+                self._person_index[person.person_id] = person
+                self._tag_index.update(person)
+                self._name_index.update(person)
+            if self._kinship is not None:
+                self._kinship.update_person(person)
+            self._changes.append((UPDATE_PERSON, person))
+
+    def delete_person(self, person_to_delete: Person) -> None:
+        """
+        Delete the specified Person and any Relationship it is part of.
+        """
+        self.delete_persons([person_to_delete])
+
+    def delete_persons(self, persons_to_delete: list[Person]) -> None:
+        """
+        Delete the specified Persons and any Relationship they are part of, in a single pass over the Persons and the
+        Relationships.
+        """
+        person_ids = {person.person_id for person in persons_to_delete}
+        if self._persons is not None:
+            self._persons = [person for person in self._persons if person.person_id not in person_ids]
+        if self._relationships is not None:
+            self._relationships = [
+                rl
+                for rl in self._relationships
+                if rl.left.person_id not in person_ids and rl.right.person_id not in person_ids
+            ]
+            self._graph = None
+        for person in persons_to_delete:
+            person_id = person.person_id
+            if self._person_index is not None:
+                self._person_index.pop(person_id, None)
+                self._tag_index.remove(person_id)
+                self._name_index.remove(person_id)
+            if self._kinship is not None:
+                self._kinship.remove_person(person_id)
+            if self._closure is not None:
+                self._closure.remove_person(person_id)
+            self._changes.append((DELETE_PERSON, person))
+        # clusters can't be split
+        self._clusters = None
+
+    def _merged_relationships(self, merged_person: Person, person: Person) -> dict[int, Relationship | None]:
+        """
+        :return: by id() of each Relationship of either Person, the Relationship to replace it with, None if it must be
+                 dropped
+        """
+        graph = self._person_graph()
+        merged_person_id = merged_person.person_id
+        res = {}
+        keys = set()
+        # Relationships of person come first, so that they are kept rather than their duplicates
+        for rl in [*graph.relationships_of(person.person_id), *graph.relationships_of(merged_person_id)]:
+            left = person if rl.left.person_id in (merged_person_id, person.person_id) else rl.left
+            right = person if rl.right.person_id in (merged_person_id, person.person_id) else rl.right
+            key = relationship_key(left.person_id, right.person_id, rl.definition)
+            if left is right or key in keys:
+                res[id(rl)] = None
+                continue
+            keys.add(key)
+            res[id(rl)] = Relationship(person_left=left, person_right=right, definition=rl.definition)
+        return res
+
+    def merge_person(self, merged_person: Person, person: Person) -> None:
+        """
+        Merge merged_person into person: replace the former by the latter in every Relationship, but those which would
+        link person to itself or duplicate another Relationship, then delete merged_person.
+        Only the Relationships of both Persons are visited, through the index of Relationships by Person.
+        :param person: the Person merged_person is merged into, as updated by the merge (see pylms.core.merge_persons)
+        """
+        merged_person_id, person_id = merged_person.person_id, person.person_id
+        if self._closure is not None:
+            # the rewired parent_enfant Relationships are added to the ancestor closure
+            self.read_relationships()
+        if self._persons is not None:
+            self._persons = [
+                person if p.person_id == person_id else p for p in self._persons if p.person_id != merged_person_id
+            ]
+        rewired_parent_relationships = []
+        if self._relationships is not None:
+            merged_relationships = self._merged_relationships(merged_person, person)
+            relationships = []
+            for rl in self._relationships:
+                if id(rl) not in merged_relationships:
+                    relationships.append(rl)
+                    continue
+                self._graph.remove(rl)
+                new_rl = merged_relationships[id(rl)]
+                if new_rl is None:
+                    continue
+                self._graph.add(new_rl)
+                relationships.append(new_rl)
+                if new_rl.definition is parent_enfant and merged_person_id in (rl.left.person_id, rl.right.person_id):
+                    rewired_parent_relationships.append(new_rl)
+            self._relationships = relationships
+        if self._person_index is not None:
+            self._person_index.pop(merged_person_id, None)
+            self._tag_index.remove(merged_person_id)
+            self._name_index.remove(merged_person_id)
+            if person_id in self._person_index:
+                self._person_index[person_id] = person
+                self._tag_index.update(person)
+                self._name_index.update(person)
+        if self._kinship is not None:
+            self._kinship.remove_person(merged_person_id)
+            self._kinship.update_person(person)
+            for rl in rewired_parent_relationships:
+                self._kinship.add(rl)
+        if self._closure is not None:
+            self._closure.remove_person(merged_person_id)
+            for rl in rewired_parent_relationships:
+                self._closure.add(rl.left.person_id, rl.right.person_id)
+        # clusters can't be split
+        self._clusters = None
+        self._changes.append((UPDATE_PERSON, person))
+        self._changes.append((MERGE_PERSON, (merged_person, person)))
+
+    def add_relationship(self, relationship: Relationship) -> None:
+        if self._relationships is not None:
+            self._relationships.append(relationship)
+        if self._graph is not None:
+            self._graph.add(relationship)
+        if self._kinship is not None:
+            self._kinship.add(relationship)
+        if self._clusters is not None:
+            self._clusters.union(relationship.left.person_id, relationship.right.person_id)
+        if self._closure is not None and relationship.definition is parent_enfant:
+            self._closure.add(relationship.left.person_id, relationship.right.person_id)
+        self._changes.append((ADD_RELATIONSHIP, relationship))
+
+    def savepoint(self) -> None:
+        """
+        Mark the pending changes kept by the next rollback(), e.g. those of the commands run so far.
+        """
+        if self._pushdown:
+            self._sync()
+            self._backend.savepoint()
+        self._savepoint = len(self._changes)
+
+    def rollback(self) -> None:
+        """
+        Discard the changes made since the last savepoint(), along with everything read or derived: it is read again
+        from the backend, with the pending changes kept replayed on top of it.
+        """
+        if self._pushdown:
+            self._backend.rollback_to_savepoint()
+        else:
+            # Persons read from the storage may have been modified in place
+            self._backend.clear_cache()
+        self._changes = self._changes[: self._savepoint]
+        self._persons = None
+        self._relationships = None
+        self._graph = None
+        self._kinship = None
+        self._closure = None
+        self._closure_built = False
+        self._clusters = None
+        self._person_index = None
+        self._tag_index = None
+        self._name_index = None
+        self._next_person_id = None
+
+    def flush(self) -> bool:
+        """
+        Write pending changes, if any, to the backend at once, followed by the ancestor closure if it was built: once
+        written, the backend replays the later changes on top of it (see pylms.storage.read_ancestors()).
+        :return: whether changes were written
+        """
+        written = bool(self._changes or self._staged)
+        if written:
+            self._backend.apply_changes(self._changes)
+            self._changes = []
+            self._staged = False
+            self._savepoint = 0
+        if self._closure_built:
+            self._backend.store_ancestors(self._closure.rows())
+            self._closure_built = False
+        return written
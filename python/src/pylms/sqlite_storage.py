@@ -0,0 +1,696 @@
+"""
+Storage of Persons and Relationships in a SQLite database.
+
+Exposes the same functions as pylms.storage, but searches and lookups are run by SQLite, using indexes, rather than by
+loading every Person and Relationship in memory.
+"""
+
+from contextlib import closing, contextmanager
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import sqlite3
+from typing import Iterator
+from pylms import storage as json_storage
+from pylms.core import Person, Relationship, RelationshipAlias, RelationshipDefinition, search_key
+from pylms.core import TagQuery, TagTerm, TagNot, TagAnd, TagOr, parent_enfant, ancetre_descendant
+from pylms.storage import _from_sex, _parse_sex
+from pylms.storage import ADD_PERSON, UPDATE_PERSON, DELETE_PERSON, ADD_RELATIONSHIP, MERGE_PERSON
+
+database_file_name = "pylms.sqlite"
+
+# queries are run by SQLite rather than in memory by pylms.repository.Repository
+QUERY_PUSHDOWN = True
+
+# full-text index of the search keys of the names and tags of the Persons, by person_id (rowid), since version 3 of the
+# content: a pattern of at least 3 characters is matched as a substring by its trigrams, using the index
+_NAMES_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5 (firstname, lastname, tags, tokenize = 'trigram');
+"""
+
+# the tags of the Persons of the specified ids, their search keys separated by new lines
+_INDEX_NAMES = """
+INSERT INTO names (rowid, firstname, lastname, tags)
+SELECT person_id, firstname_lower, lastname_lower,
+    (SELECT group_concat(tag_lower, char(10)) FROM (SELECT tag_lower FROM tags WHERE tags.person_id = persons.person_id))
+FROM persons
+"""
+
+# *_lower columns hold search keys (see pylms.core.search_key) since version 1 of the content, see _migrate()
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS persons (
+    person_id INTEGER PRIMARY KEY,
+    firstname TEXT NOT NULL,
+    lastname TEXT,
+    created TEXT NOT NULL,
+    sex TEXT,
+    firstname_lower TEXT NOT NULL,
+    lastname_lower TEXT
+);
+CREATE INDEX IF NOT EXISTS persons_firstname_lower ON persons (firstname_lower);
+CREATE INDEX IF NOT EXISTS persons_lastname_lower ON persons (lastname_lower);
+
+CREATE TABLE IF NOT EXISTS tags (
+    person_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    tag_lower TEXT NOT NULL,
+    PRIMARY KEY (person_id, position)
+);
+CREATE INDEX IF NOT EXISTS tags_tag_lower ON tags (tag_lower);
+
+CREATE TABLE IF NOT EXISTS relationships (
+    left_id INTEGER NOT NULL,
+    right_id INTEGER NOT NULL,
+    definition TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS relationships_left_right_definition ON relationships (left_id, right_id, definition);
+CREATE INDEX IF NOT EXISTS relationships_right ON relationships (right_id);
+
+CREATE TABLE IF NOT EXISTS ancestors (
+    ancestor_id INTEGER NOT NULL,
+    descendant_id INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id)
+);
+CREATE INDEX IF NOT EXISTS ancestors_descendant ON ancestors (descendant_id);
+""" + _NAMES_SCHEMA
+
+# version of the content of the database, see _migrate()
+_USER_VERSION = 3
+
+# the ancestors table seen as Relationships of ancetre_descendant, see _relationships_table()
+_ANCESTORS_AS_RELATIONSHIPS = """(
+    SELECT rowid, ancestor_id AS left_id, descendant_id AS right_id, :definition AS definition FROM ancestors
+)"""
+
+# tags are aggregated as a JSON array, in their original order, to load a Person with a single row
+_PERSON_COLUMNS = """
+    {p}.person_id, {p}.firstname, {p}.lastname, {p}.created, {p}.sex,
+    (SELECT json_group_array(tag) FROM (SELECT tag FROM tags WHERE person_id = {p}.person_id ORDER BY position))
+"""
+
+# search key of the pattern is matched as a substring of search keys (not with LIKE, which gives a special meaning to '%'
+# and '_')
+_PERSON_MATCH = """(
+    instr({p}.firstname_lower, :pattern) > 0
+    OR instr({p}.lastname_lower, :pattern) > 0
+    OR EXISTS (SELECT 1 FROM tags WHERE tags.person_id = {p}.person_id AND instr(tags.tag_lower, :pattern) > 0)
+)"""
+
+# the Persons the full-text index (see _NAMES_SCHEMA) finds for :names, a superset of those matching the pattern
+_PERSON_CANDIDATES = "{p}.person_id IN (SELECT rowid FROM names WHERE names MATCH :names) AND "
+
+# patterns shorter than a trigram can't be looked up in the full-text index
+_MIN_INDEXED_PATTERN_LENGTH = 3
+
+
+def database_exists() -> bool:
+    return Path(database_file_name).exists()
+
+
+def storage_key() -> tuple:
+    """
+    :return: a value which changes whenever the database is written to, by this process or another one: the file change
+             counter of its header, incremented by every write transaction (see https://www.sqlite.org/fileformat.html),
+             along with the inode, should the file be replaced
+    """
+    try:
+        with open(database_file_name, "rb") as f:
+            f.seek(24)
+            return database_file_name, os.fstat(f.fileno()).st_ino, f.read(4)
+    except FileNotFoundError:
+        return database_file_name, None, None
+
+
+def _fts_phrase(key: str) -> str:
+    return '"' + key.replace('"', '""') + '"'
+
+
+def _person_match(p: str, pattern: str) -> tuple[str, dict]:
+    """
+    :return: the SQL condition on Persons {p} matching the specified pattern, see _PERSON_MATCH, and its parameters
+    """
+    key = search_key(pattern)
+    if len(key) < _MIN_INDEXED_PATTERN_LENGTH:
+        return _PERSON_MATCH.format(p=p), {"pattern": key}
+    return (_PERSON_CANDIDATES + _PERSON_MATCH).format(p=p), {"pattern": key, "names": _fts_phrase(key)}
+
+
+# open transaction holding the changes staged by stage_changes(), until written by apply_changes()
+_staged: sqlite3.Connection | None = None
+# whether the open transaction holds a savepoint, see savepoint()
+_savepoint: bool = False
+
+
+def clear_cache() -> None:
+    """
+    Roll back the staged changes, if any (see stage_changes()). Nothing is cached: every read queries the database.
+    """
+    global _staged, _savepoint
+    _savepoint = False
+    if _staged is not None:
+        connection, _staged = _staged, None
+        connection.rollback()
+        connection.close()
+
+
+@contextmanager
+def _reading() -> Iterator[sqlite3.Connection]:
+    """
+    :return: the connection holding the staged changes, if any, so that they are seen by the queries, a new connection
+             otherwise
+    """
+    if _staged is not None:
+        yield _staged
+        return
+    with closing(_connect()) as connection:
+        yield connection
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    :raises: sqlite3.OperationalError if there is no database, it is only created by migrate_from_json()
+    """
+    connection = sqlite3.connect(Path(database_file_name).absolute().as_uri() + "?mode=rw", uri=True)
+    _migrate(connection)
+    return connection
+
+
+def create_database() -> sqlite3.Connection:
+    """
+    Create the database, if it does not exist yet, with its schema.
+    :return: a connection to the database
+    """
+    connection = sqlite3.connect(database_file_name)
+    connection.executescript(_SCHEMA)
+    _migrate(connection)
+    return connection
+
+
+def _migrate(connection: sqlite3.Connection) -> None:
+    (user_version,) = connection.execute("PRAGMA user_version").fetchone()
+    if user_version >= _USER_VERSION:
+        return
+
+    with connection:
+        if user_version < 1:
+            # *_lower columns hold search keys (see pylms.core.search_key) rather than lower case values
+            connection.create_function("search_key", 1, _search_key, deterministic=True)
+            connection.execute(
+                "UPDATE persons SET firstname_lower = search_key(firstname), lastname_lower = search_key(lastname)"
+            )
+            connection.execute("UPDATE tags SET tag_lower = search_key(tag)")
+        if user_version < 2:
+            # the ancestors table holds the closure of the parent_enfant Relationships
+            _compute_ancestors(connection)
+        if user_version < 3:
+            # the names table indexes the search keys of the names and tags
+            connection.execute(_NAMES_SCHEMA)
+            connection.execute("DELETE FROM names")
+            connection.execute(_INDEX_NAMES)
+        connection.execute(f"PRAGMA user_version = {_USER_VERSION}")
+
+
+def _compute_ancestors(connection: sqlite3.Connection, descendant_ids: list[int] | None = None) -> None:
+    """
+    Compute again the ancestors (see pylms.core.AncestorClosure) of the specified Persons, of every Person if None.
+    """
+    if descendant_ids is None:
+        # no condition on the ids, which would prevent SQLite from using the indexes
+        connection.execute("DELETE FROM ancestors")
+        condition = ""
+    else:
+        connection.execute(
+            "DELETE FROM ancestors WHERE descendant_id IN (SELECT value FROM json_each(:ids))",
+            {"ids": json.dumps(descendant_ids)},
+        )
+        condition = " AND right_id IN (SELECT value FROM json_each(:ids))"
+    # the depth is bounded by the number of parent_enfant Relationships, should they form a cycle
+    connection.execute(
+        "INSERT INTO ancestors (ancestor_id, descendant_id, depth)"
+        " WITH RECURSIVE up(ancestor_id, descendant_id, depth) AS ("
+        f"  SELECT left_id, right_id, 1 FROM relationships WHERE definition = :definition{condition}"
+        "  UNION"
+        "  SELECT r.left_id, up.descendant_id, up.depth + 1 FROM up"
+        "  JOIN relationships r ON r.right_id = up.ancestor_id AND r.definition = :definition"
+        "  WHERE up.depth < (SELECT count(*) FROM relationships WHERE definition = :definition)"
+        " )"
+        " SELECT ancestor_id, descendant_id, min(depth) FROM up WHERE ancestor_id != descendant_id"
+        " GROUP BY ancestor_id, descendant_id",
+        {"ids": json.dumps(descendant_ids), "definition": parent_enfant.name},
+    )
+
+
+def _add_ancestors(connection: sqlite3.Connection, parent_id: int, child_id: int) -> None:
+    """
+    Add to the ancestors of the child and of its descendants the parent and its ancestors.
+    """
+    connection.execute(
+        "INSERT INTO ancestors (ancestor_id, descendant_id, depth)"
+        " SELECT a.ancestor_id, d.descendant_id, a.depth + 1 + d.depth"
+        " FROM (SELECT :parent AS ancestor_id, 0 AS depth"
+        "  UNION ALL SELECT ancestor_id, depth FROM ancestors WHERE descendant_id = :parent) a,"
+        " (SELECT :child AS descendant_id, 0 AS depth"
+        "  UNION ALL SELECT descendant_id, depth FROM ancestors WHERE ancestor_id = :child) d"
+        " WHERE a.ancestor_id != d.descendant_id"
+        " ON CONFLICT (ancestor_id, descendant_id) DO UPDATE SET depth = min(depth, excluded.depth)",
+        {"parent": parent_id, "child": child_id},
+    )
+
+
+def _search_key(s: str | None) -> str | None:
+    return None if s is None else search_key(s)
+
+
+def _to_person(row: tuple) -> Person:
+    person_id, firstname, lastname, created, sex, tags = row
+    res = Person(
+        person_id=person_id,
+        firstname=firstname,
+        lastname=lastname,
+        created=datetime.fromisoformat(created),
+        sex=_parse_sex(sex),
+    )
+    res.tags = json.loads(tags)
+    return res
+
+
+def _insert_persons(connection: sqlite3.Connection, persons: list[Person]) -> None:
+    connection.executemany(
+        "INSERT INTO persons (person_id, firstname, lastname, created, sex, firstname_lower, lastname_lower)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                p.person_id,
+                p.firstname,
+                p.lastname,
+                str(p.created),
+                _from_sex(p.sex),
+                p.firstname_key,
+                p.lastname_key,
+            )
+            for p in persons
+        ],
+    )
+    _insert_tags(connection, persons)
+    _index_names(connection, [p.person_id for p in persons])
+
+
+def _insert_tags(connection: sqlite3.Connection, persons: list[Person]) -> None:
+    connection.executemany(
+        "INSERT INTO tags (person_id, position, tag, tag_lower) VALUES (?, ?, ?, ?)",
+        [
+            (p.person_id, position, tag, tag_key)
+            for p in persons
+            for position, (tag, tag_key) in enumerate(zip(p.tags, p.tag_keys))
+        ],
+    )
+
+
+def _index_names(connection: sqlite3.Connection, person_ids: list[int]) -> None:
+    """
+    Index again the names and tags of the specified Persons, once written, see _NAMES_SCHEMA.
+    """
+    parameters = {"ids": json.dumps(person_ids)}
+    connection.execute("DELETE FROM names WHERE rowid IN (SELECT value FROM json_each(:ids))", parameters)
+    connection.execute(_INDEX_NAMES + " WHERE person_id IN (SELECT value FROM json_each(:ids))", parameters)
+
+
+def _insert_relationships(connection: sqlite3.Connection, relationships: list[Relationship]) -> None:
+    connection.executemany(
+        "INSERT INTO relationships (left_id, right_id, definition) VALUES (?, ?, ?)",
+        [(rl.left.person_id, rl.right.person_id, rl.definition.name) for rl in relationships],
+    )
+    for rl in relationships:
+        if rl.definition is parent_enfant:
+            _add_ancestors(connection, rl.left.person_id, rl.right.person_id)
+
+
+def store_persons(persons: list[Person]) -> None:
+    if not persons:
+        raise ValueError("Can't store an empty list of Persons.")
+
+    with closing(_connect()) as connection, connection:
+        connection.execute("DELETE FROM names")
+        connection.execute("DELETE FROM tags")
+        connection.execute("DELETE FROM persons")
+        _insert_persons(connection, persons)
+
+
+def read_persons() -> list[Person]:
+    with _reading() as connection:
+        rows = connection.execute(f"SELECT {_PERSON_COLUMNS.format(p='persons')} FROM persons ORDER BY person_id")
+        return [_to_person(row) for row in rows]
+
+
+def _update_person(connection: sqlite3.Connection, p: Person) -> None:
+    connection.execute(
+        "UPDATE persons SET firstname = ?, lastname = ?, created = ?, sex = ?, firstname_lower = ?, lastname_lower = ?"
+        " WHERE person_id = ?",
+        (p.firstname, p.lastname, str(p.created), _from_sex(p.sex), p.firstname_key, p.lastname_key, p.person_id),
+    )
+    connection.execute("DELETE FROM tags WHERE person_id = ?", (p.person_id,))
+    _insert_tags(connection, [p])
+    _index_names(connection, [p.person_id])
+
+
+def _delete_person(connection: sqlite3.Connection, person_id: int) -> None:
+    descendant_ids = [
+        descendant_id
+        for (descendant_id,) in connection.execute(
+            "SELECT descendant_id FROM ancestors WHERE ancestor_id = ?", (person_id,)
+        )
+    ]
+    connection.execute("DELETE FROM ancestors WHERE ancestor_id = ? OR descendant_id = ?", (person_id, person_id))
+    connection.execute("DELETE FROM relationships WHERE left_id = ? OR right_id = ?", (person_id, person_id))
+    if descendant_ids:
+        _compute_ancestors(connection, descendant_ids)
+    connection.execute("DELETE FROM names WHERE rowid = ?", (person_id,))
+    connection.execute("DELETE FROM tags WHERE person_id = ?", (person_id,))
+    connection.execute("DELETE FROM persons WHERE person_id = ?", (person_id,))
+
+
+def _merge_person(connection: sqlite3.Connection, person_id: int, into_id: int) -> None:
+    """
+    Replace the Person person_id by the Person into_id in the Relationships, drop those which would link the latter to
+    itself or duplicate another Relationship, then delete the Person person_id.
+    """
+    descendant_ids = [
+        descendant_id
+        for (descendant_id,) in connection.execute(
+            "SELECT descendant_id FROM ancestors WHERE ancestor_id IN (?, ?)", (person_id, into_id)
+        )
+    ]
+    connection.execute("DELETE FROM ancestors WHERE ancestor_id = ? OR descendant_id = ?", (person_id, person_id))
+    parameters = {
+        "id": person_id,
+        "into": into_id,
+        "undirected": json.dumps([d.name for d in json_storage.relationship_definitions if not d.directional]),
+    }
+    connection.execute("UPDATE relationships SET left_id = :into WHERE left_id = :id", parameters)
+    connection.execute("UPDATE relationships SET right_id = :into WHERE right_id = :id", parameters)
+    # duplicates are told apart by the definition and both ids, in any order if the definition is not directional
+    connection.execute(
+        "DELETE FROM relationships WHERE (left_id = :into OR right_id = :into) AND ("
+        " left_id = right_id OR rowid NOT IN ("
+        "  SELECT min(rowid) FROM relationships WHERE left_id = :into OR right_id = :into"
+        "  GROUP BY definition,"
+        "  CASE WHEN definition IN (SELECT value FROM json_each(:undirected)) THEN min(left_id, right_id) ELSE left_id END,"
+        "  CASE WHEN definition IN (SELECT value FROM json_each(:undirected)) THEN max(left_id, right_id) ELSE right_id END"
+        " ))",
+        parameters,
+    )
+    _compute_ancestors(connection, [into_id, *descendant_ids])
+    connection.execute("DELETE FROM names WHERE rowid = ?", (person_id,))
+    connection.execute("DELETE FROM tags WHERE person_id = ?", (person_id,))
+    connection.execute("DELETE FROM persons WHERE person_id = ?", (person_id,))
+
+
+def _apply_changes(
+    connection: sqlite3.Connection, changes: list[tuple[str, Person | Relationship | tuple[Person, Person]]]
+) -> None:
+    for kind, o in changes:
+        if kind == ADD_PERSON:
+            _insert_persons(connection, [o])
+        elif kind == UPDATE_PERSON:
+            _update_person(connection, o)
+        elif kind == DELETE_PERSON:
+            _delete_person(connection, o.person_id)
+        elif kind == ADD_RELATIONSHIP:
+            _insert_relationships(connection, [o])
+        elif kind == MERGE_PERSON:
+            merged_person, person = o
+            _merge_person(connection, merged_person.person_id, person.person_id)
+        else:
+            raise ValueError(f"Unsupported change {kind}")
+
+
+def stage_changes(changes: list[tuple[str, Person | Relationship | tuple[Person, Person]]]) -> None:
+    """
+    Apply the specified changes, in order, in a transaction left open: they are seen by the next queries of this
+    process, but only written, with any other staged changes, by apply_changes(). Holding the transaction, the process
+    holds the write lock of the database until then, clear_cache() rolls it back.
+    """
+    global _staged
+    if _staged is None:
+        _staged = _connect()
+    try:
+        _apply_changes(_staged, changes)
+    except BaseException:
+        if _savepoint:
+            # the changes staged before the savepoint are kept, see rollback_to_savepoint()
+            _staged.execute("ROLLBACK TO staged")
+        else:
+            clear_cache()
+        raise
+
+
+def savepoint() -> None:
+    """
+    Mark the staged changes kept by the next rollback_to_savepoint(), in place of the previous mark.
+    """
+    global _staged, _savepoint
+    if _staged is None:
+        _staged = _connect()
+    if _savepoint:
+        _staged.execute("RELEASE staged")
+    elif not _staged.in_transaction:
+        # the savepoint must not be the outermost one: releasing it would commit the transaction
+        _staged.execute("BEGIN")
+    _staged.execute("SAVEPOINT staged")
+    _savepoint = True
+
+
+def rollback_to_savepoint() -> None:
+    """
+    Roll back the changes staged since the last savepoint(), if any.
+    """
+    if _savepoint:
+        _staged.execute("ROLLBACK TO staged")
+
+
+def apply_changes(changes: list[tuple[str, Person | Relationship | tuple[Person, Person]]]) -> None:
+    """
+    Apply the specified changes, in order, in a single transaction, along with the staged ones (see stage_changes()).
+    :param changes: kind of change (eg. ADD_PERSON) and the Person, Relationship or pair of Persons it applies to
+    """
+    global _staged, _savepoint
+    connection, _staged, _savepoint = _staged or _connect(), None, False
+    with closing(connection), connection:
+        _apply_changes(connection, changes)
+
+
+def add_person(person: Person) -> None:
+    apply_changes([(ADD_PERSON, person)])
+
+
+def update_person(person_to_update: Person) -> None:
+    apply_changes([(UPDATE_PERSON, person_to_update)])
+
+
+def delete_person(person_to_delete: Person) -> None:
+    """
+    Delete the specified Person and any Relationship it is part of.
+    """
+    apply_changes([(DELETE_PERSON, person_to_delete)])
+
+
+def next_person_id() -> int:
+    with _reading() as connection:
+        (max_id,) = connection.execute("SELECT max(person_id) FROM persons").fetchone()
+        return 0 if max_id is None else max_id + 1
+
+
+def search_persons(pattern: str) -> list[Person]:
+    condition, parameters = _person_match("p", pattern)
+    with _reading() as connection:
+        rows = connection.execute(
+            f"SELECT {_PERSON_COLUMNS.format(p='p')} FROM persons p WHERE {condition} ORDER BY p.person_id", parameters
+        )
+        return [_to_person(row) for row in rows]
+
+
+def _tag_query_condition(query: TagQuery, parameters: list[str]) -> str:
+    """
+    :return: the SQL condition on Persons p equivalent to query, with parameters appended to the specified list
+    """
+    if isinstance(query, TagTerm):
+        key = search_key(query.term)
+        condition = "EXISTS (SELECT 1 FROM tags WHERE tags.person_id = p.person_id AND instr(tags.tag_lower, ?) > 0)"
+        if len(key) < _MIN_INDEXED_PATTERN_LENGTH:
+            parameters.append(key)
+            return condition
+        # narrowed down to the Persons the full-text index finds, see _PERSON_CANDIDATES
+        parameters.extend(["tags : " + _fts_phrase(key), key])
+        return f"(p.person_id IN (SELECT rowid FROM names WHERE names MATCH ?) AND {condition})"
+    if isinstance(query, TagNot):
+        return f"NOT {_tag_query_condition(query.operand, parameters)}"
+    if isinstance(query, TagAnd):
+        return "(" + " AND ".join(_tag_query_condition(operand, parameters) for operand in query.operands) + ")"
+    if isinstance(query, TagOr):
+        return "(" + " OR ".join(_tag_query_condition(operand, parameters) for operand in query.operands) + ")"
+    raise ValueError(f"Unsupported tag query {query}")
+
+
+def search_tags(query: TagQuery) -> list[Person]:
+    parameters = []
+    condition = _tag_query_condition(query, parameters)
+    with _reading() as connection:
+        rows = connection.execute(
+            f"SELECT {_PERSON_COLUMNS.format(p='p')} FROM persons p WHERE {condition} ORDER BY p.person_id", parameters
+        )
+        return [_to_person(row) for row in rows]
+
+
+def _relationships_table(definition: RelationshipDefinition) -> str:
+    """
+    :return: the table (or subquery) of the Relationships of the specified definition, with columns rowid, left_id,
+             right_id and definition
+    """
+    return _ANCESTORS_AS_RELATIONSHIPS if definition is ancetre_descendant else "relationships"
+
+
+def search_related_persons(definition: RelationshipDefinition, alias: RelationshipAlias, pattern: str) -> list[Person]:
+    # see pylms.core.related_persons
+    matched_column, result_column = ("left_id", "right_id") if alias.reverse else ("right_id", "left_id")
+    condition, parameters = _person_match("matched", pattern)
+    with _reading() as connection:
+        rows = connection.execute(
+            f"SELECT {_PERSON_COLUMNS.format(p='result')} FROM {_relationships_table(definition)} r"
+            f" JOIN persons matched ON matched.person_id = r.{matched_column}"
+            f" JOIN persons result ON result.person_id = r.{result_column}"
+            f" WHERE r.definition = :definition AND {condition}"
+            " AND (:sex IS NULL OR result.sex = :sex)"
+            " ORDER BY r.rowid",
+            {"definition": definition.name, "sex": _from_sex(alias.left_person_sex), **parameters},
+        )
+        return [_to_person(row) for row in rows]
+
+
+def related_persons_of(
+    persons: list[Person], definition: RelationshipDefinition, alias: RelationshipAlias
+) -> list[Person]:
+    """
+    :return: the Persons in the relationship described by definition and alias with any of the specified Persons,
+             see pylms.core.related_persons
+    """
+    matched_column, result_column = ("left_id", "right_id") if alias.reverse else ("right_id", "left_id")
+    with _reading() as connection:
+        rows = connection.execute(
+            f"SELECT {_PERSON_COLUMNS.format(p='result')} FROM persons result"
+            f" WHERE result.person_id IN (SELECT r.{result_column} FROM {_relationships_table(definition)} r"
+            f" WHERE r.{matched_column} IN (SELECT value FROM json_each(:ids)) AND r.definition = :definition)"
+            " AND (:sex IS NULL OR result.sex = :sex)"
+            " ORDER BY result.person_id",
+            {
+                "ids": json.dumps([person.person_id for person in persons]),
+                "definition": definition.name,
+                "sex": _from_sex(alias.left_person_sex),
+            },
+        )
+        return [_to_person(row) for row in rows]
+
+
+def is_ancestor(ancestor: Person, descendant: Person) -> bool:
+    with _reading() as connection:
+        row = connection.execute(
+            "SELECT 1 FROM ancestors WHERE ancestor_id = ? AND descendant_id = ?",
+            (ancestor.person_id, descendant.person_id),
+        ).fetchone()
+        return row is not None
+
+
+def closest_common_ancestors(person: Person, other_person: Person) -> list[Person]:
+    """
+    :return: the common ancestors of both Persons with the smallest sum of depths, by id
+    """
+    with _reading() as connection:
+        rows = connection.execute(
+            "WITH common(ancestor_id, distance) AS ("
+            " SELECT a.ancestor_id, a.depth + b.depth FROM ancestors a"
+            " JOIN ancestors b ON b.ancestor_id = a.ancestor_id"
+            " WHERE a.descendant_id = :person AND b.descendant_id = :other_person"
+            ")"
+            f" SELECT {_PERSON_COLUMNS.format(p='p')} FROM persons p JOIN common ON common.ancestor_id = p.person_id"
+            " WHERE common.distance = (SELECT min(distance) FROM common)"
+            " ORDER BY p.person_id",
+            {"person": person.person_id, "other_person": other_person.person_id},
+        )
+        return [_to_person(row) for row in rows]
+
+
+def _to_relationships(rows: list[tuple], persons: list[Person]) -> list[Relationship]:
+    return json_storage.to_relationships(
+        [{"left": left_id, "right": right_id, "definition": definition} for left_id, right_id, definition in rows],
+        persons,
+    )
+
+
+def store_relationships(relationships: list[Relationship]) -> None:
+    if not relationships:
+        raise ValueError("Can't store an empty list of Relationships.")
+
+    with closing(_connect()) as connection, connection:
+        connection.execute("DELETE FROM relationships")
+        connection.execute("DELETE FROM ancestors")
+        _insert_relationships(connection, relationships)
+
+
+def read_relationships(persons: list[Person]) -> list[Relationship]:
+    if not persons:
+        raise ValueError("Persons can't be empty")
+
+    with _reading() as connection:
+        rows = connection.execute("SELECT left_id, right_id, definition FROM relationships ORDER BY rowid").fetchall()
+    return _to_relationships(rows, persons)
+
+
+def read_relationships_of(persons: list[Person]) -> list[Relationship]:
+    """
+    :return: the Relationships any of the specified Persons is part of
+    """
+    person_ids = json.dumps([person.person_id for person in persons])
+    with _reading() as connection:
+        rows = connection.execute(
+            "SELECT left_id, right_id, definition FROM relationships"
+            " WHERE left_id IN (SELECT value FROM json_each(:ids)) OR right_id IN (SELECT value FROM json_each(:ids))"
+            " ORDER BY rowid",
+            {"ids": person_ids},
+        ).fetchall()
+        other_ids = json.dumps(list({person_id for row in rows for person_id in row[0:2]}))
+        related = connection.execute(
+            f"SELECT {_PERSON_COLUMNS.format(p='persons')} FROM persons"
+            " WHERE person_id IN (SELECT value FROM json_each(:ids))",
+            {"ids": other_ids},
+        )
+        related_persons = [_to_person(row) for row in related]
+    return _to_relationships(rows, related_persons)
+
+
+def add_relationship(relationship: Relationship) -> None:
+    apply_changes([(ADD_RELATIONSHIP, relationship)])
+
+
+def migrate_from_json() -> tuple[int, int]:
+    """
+    Copy the Persons and Relationships of the JSON files (see pylms.storage) into the SQLite database, created if need
+    be.
+    :return: the number of Persons and Relationships copied
+    :raises: ValueError if there are no Persons to copy or the SQLite database already contains Persons
+    """
+    persons = json_storage.read_persons()
+    if not persons:
+        # the database would be used from then on, with none of the Persons created in the meantime
+        raise ValueError("No Persons to migrate")
+    relationships = json_storage.read_relationships(persons)
+
+    with closing(create_database()) as connection, connection:
+        (count,) = connection.execute("SELECT count(*) FROM persons").fetchone()
+        if count:
+            raise ValueError(f"SQLite database {database_file_name} is not empty")
+        _insert_persons(connection, persons)
+        _insert_relationships(connection, relationships)
+
+    return len(persons), len(relationships)
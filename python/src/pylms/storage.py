@@ -1,10 +1,59 @@
+from contextlib import contextmanager
 from datetime import datetime
 import json
+import os
 from pathlib import Path
-from pylms.core import Person, Relationship, relationship_definitions, Sex, MALE, FEMALE
+import threading
+from pylms.core import Person, Relationship, relationship_definitions, relationship_key, Sex, MALE, FEMALE
+from pylms.core import AncestorClosure, parent_enfant
+from typing import Callable, Iterator
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows: the storage is then only locked between the threads of a process
+    fcntl = None
 
 persons_file_name = "persons.db"
 relationships_file_name = "relationships.db"
+# closure of the parent_enfant Relationships (see pylms.core.AncestorClosure) as of a position in the relationships
+# journal, the later operations of which are replayed on top of it, see read_ancestors()
+ancestors_file_name = "ancestors.db"
+# each store (persons, relationships) is made of a snapshot file and an append-only journal file of operations applied
+# on top of the snapshot, named after the snapshot file with this suffix
+journal_suffix = ".journal"
+# a journal is folded back into its snapshot once it is larger than the snapshot and than this size (in bytes)
+journal_compaction_min_size = 64 * 1024
+# entries being appended to the journals, kept until they all are, see apply_changes()
+transaction_file_name = "transaction.db"
+# locked by the process writing the files (see _locked()), named after the transaction file with this suffix
+lock_suffix = ".lock"
+
+# queries are run in memory by pylms.repository.Repository, see pylms.sqlite_storage
+QUERY_PUSHDOWN = False
+
+# kinds of changes, see apply_changes()
+ADD_PERSON = "add_person"
+UPDATE_PERSON = "update_person"
+DELETE_PERSON = "delete_person"
+ADD_RELATIONSHIP = "add_relationship"
+# applies to a (merged Person, Person it is merged into) pair
+MERGE_PERSON = "merge_person"
+
+_OP_ADD = "add"
+_OP_UPDATE = "update"
+_OP_DELETE = "delete"
+_OP_DELETE_PERSON = "delete_person"
+_OP_MERGE_PERSON = "merge_person"
+
+# bumped on every write to the files, see _store_key()
+_generation = 0
+# Persons and Relationships of the last read, along with the key of the files they were read from
+_persons_cache: tuple[tuple, list[Person]] | None = None
+_relationships_cache: tuple[tuple, list[Person], list[Relationship]] | None = None
+# held along with the lock file, which is open while either is held, see _locked()
+_lock = threading.RLock()
+_lock_file = None
 
 
 def _from_sex(sex: Sex | None) -> str | None:
@@ -40,16 +89,19 @@ class PersonEncoder(json.JSONEncoder):
         return super().default(o)
 
 
+def _parse_sex(sex: str | None) -> Sex | None:
+    if sex is None:
+        return None
+    if sex == "M":
+        return MALE
+    if sex == "F":
+        return FEMALE
+    raise ValueError(f"Unsupported value {sex} for sex")
+
+
 def _to_sex(o: dict) -> Sex | None:
     try:
-        sex = o["sex"]
-        if sex is None:
-            return None
-        if sex == "M":
-            return MALE
-        if sex == "F":
-            return FEMALE
-        raise ValueError(f"Unsupported value {sex} for sex")
+        return _parse_sex(o["sex"])
     except KeyError:
         return None
 
@@ -76,25 +128,321 @@ def to_person(o: dict) -> Person:
     return res
 
 
-def store_persons(persons: list[Person]) -> None:
-    if not persons:
-        raise ValueError("Can't store an empty list of Persons.")
+def _journal_file_name(file_name: str) -> str:
+    return file_name + journal_suffix
 
-    with open(persons_file_name, "w") as f:
-        f.write(json.dumps(persons, cls=PersonEncoder))
 
+def _file_key(file_name: str) -> tuple[int, int, int] | None:
+    try:
+        stat = os.stat(file_name)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
 
-def read_persons() -> list[Person]:
-    file = Path(persons_file_name)
+
+def _store_key(file_name: str) -> tuple:
+    """
+    :return: a value which changes whenever the snapshot or the journal of the specified store is written to, either by
+             another process (inode, size or modification time of the files) or by this one (_generation, which also
+             catches writes within the resolution of the modification time)
+    """
+    return file_name, _file_key(file_name), _file_key(_journal_file_name(file_name)), _generation
+
+
+def _written() -> None:
+    global _generation
+    _generation += 1
+
+
+def storage_key() -> tuple:
+    """
+    :return: a value which changes whenever the Persons or the Relationships are written to, by this process or another
+             one, see _store_key()
+    """
+    _recover()
+    return _store_key(persons_file_name), _store_key(relationships_file_name)
+
+
+def clear_cache() -> None:
+    """
+    Discard the Persons and Relationships kept from the last read.
+    Persons are shared with the cache: this must be called when a Person was modified in place but not written.
+    """
+    global _persons_cache, _relationships_cache
+    _persons_cache = None
+    _relationships_cache = None
+
+
+def _read_snapshot(file_name: str) -> list[dict]:
+    file = Path(file_name)
     if file.exists():
         with file.open("r") as f:
             content = f.read()
             if content:
-                return [to_person(s) for s in json.loads(content)]
+                return json.loads(content)
 
     return []
 
 
+def _read_journal(file_name: str, offset: int = 0) -> list[dict]:
+    """
+    :param offset: position in the journal of the first entry to read
+    """
+    file = Path(_journal_file_name(file_name))
+    if file.exists():
+        with file.open("rb") as f:
+            f.seek(offset)
+            lines = f.read().decode().split("\n")
+        # the last line is either empty or incomplete, left by an interrupted append (see _journal_size())
+        return [json.loads(line) for line in lines[:-1] if line.strip()]
+
+    return []
+
+
+def _journal_size(journal_file_name: str) -> int:
+    """
+    :return: the size of the journal up to its last complete line, the entries are appended from there
+    """
+    try:
+        f = open(journal_file_name, "rb")
+    except FileNotFoundError:
+        return 0
+    with f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            index = f.read(end - start).rfind(b"\n")
+            if index >= 0:
+                return start + index + 1
+            end = start
+        return 0
+
+
+def _write_synced(file_name: str, content: str) -> None:
+    with open(file_name, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _fsync_directory(file_name: str) -> None:
+    """
+    Flush to disk the directory entries of the specified file: its creation, renaming or removal.
+    """
+    if not hasattr(os, "O_DIRECTORY"):
+        # not supported on Windows, where renaming a file is durable once done
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(file_name)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(file_name: str, content: str) -> None:
+    """
+    Replace the content of the specified file by writing a temporary file, flushed to disk, renamed over it: should the
+    process crash, the file holds either its previous or its new content.
+    """
+    temp_file_name = file_name + ".tmp"
+    _write_synced(temp_file_name, content)
+    os.replace(temp_file_name, file_name)
+    _fsync_directory(file_name)
+
+
+def _append_journal(journal_file_name: str, size: int, lines: str) -> None:
+    """
+    Append the lines to the journal once truncated to the specified size, dropping anything an interrupted append may
+    have written, so that appending the same lines again has no further effect.
+    """
+    created = not os.path.exists(journal_file_name)
+    with open(journal_file_name, "a") as f:
+        f.truncate(size)
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    if created:
+        _fsync_directory(journal_file_name)
+
+
+def _replace_snapshot(snapshot_file_name: str, new_snapshot_file_name: str, journal_file_name: str) -> None:
+    """
+    Replace the snapshot by the new one, which includes the operations of the journal, and remove the journal.
+    Once the new snapshot is in place, only the removal of the journal is done again.
+    """
+    if os.path.exists(new_snapshot_file_name):
+        os.replace(new_snapshot_file_name, snapshot_file_name)
+    Path(journal_file_name).unlink(missing_ok=True)
+    _fsync_directory(snapshot_file_name)
+
+
+def _apply_transaction(transaction: list[dict]) -> None:
+    """
+    Apply the steps of the transaction, each of which can be applied again with no further effect: appends to a journal
+    (see _append_journal()) and replacements of a snapshot (see _replace_snapshot()).
+    """
+    for step in transaction:
+        if "lines" in step:
+            _append_journal(step["journal"], step["size"], step["lines"])
+        else:
+            _replace_snapshot(step["snapshot"], step["new_snapshot"], step["journal"])
+
+
+@contextmanager
+def _locked() -> Iterator[None]:
+    """
+    Hold the exclusive lock of the storage, shared by the threads of this process and by the processes writing the
+    same files (pylms, pylmsgui, pylmsapi): a transaction must neither be run nor completed by two of them at once.
+    Reentrant: the lock is only released once the outermost block is left.
+    """
+    global _lock_file
+    with _lock:
+        if _lock_file is not None or fcntl is None:
+            yield
+            return
+        # closing the file releases the lock
+        with open(transaction_file_name + lock_suffix, "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            _lock_file = f
+            try:
+                yield
+            finally:
+                _lock_file = None
+
+
+def _run_transaction(transaction: list[dict]) -> None:
+    """
+    Write the transaction to the transaction file, at once (see _atomic_write()), and apply it afterward. Should it be
+    interrupted, it is applied again from the transaction file on the next read or write (see _recover()), so that
+    either all or none of its steps are applied.
+    """
+    with _locked():
+        _atomic_write(transaction_file_name, json.dumps(transaction))
+        _apply_transaction(transaction)
+        _end_transaction()
+
+
+def _end_transaction() -> None:
+    Path(transaction_file_name).unlink(missing_ok=True)
+    # a transaction file found again after a crash would truncate the journals appended to since
+    _fsync_directory(transaction_file_name)
+    _written()
+
+
+def _recover() -> None:
+    """
+    Complete the transaction interrupted by a crash, if any (see _run_transaction()).
+    """
+    file = Path(transaction_file_name)
+    if not file.exists():
+        return
+    with _locked():
+        # the transaction may have been run by another process, which held the lock until it was done
+        if not file.exists():
+            return
+        with file.open("r") as f:
+            transaction = json.loads(f.read())
+        _apply_transaction(transaction)
+        _end_transaction()
+
+
+def _file_size(file_name: str) -> int:
+    try:
+        return os.stat(file_name).st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _compact_if_needed(file_name: str, replay: Callable[[], list[dict]]) -> None:
+    journal_size = _file_size(_journal_file_name(file_name))
+    if journal_size > max(journal_compaction_min_size, _file_size(file_name)):
+        _compact(file_name, replay)
+
+
+def _store_snapshot(file_name: str, content: str) -> None:
+    """
+    Replace the snapshot of the specified store and remove its journal, in a transaction: should the process crash
+    in between, the journal can't be replayed on top of the new snapshot.
+    """
+    new_snapshot_file_name = str(file_name) + ".new"
+    _write_synced(new_snapshot_file_name, content)
+    _run_transaction(
+        [
+            {
+                "snapshot": str(file_name),
+                "new_snapshot": new_snapshot_file_name,
+                "journal": str(_journal_file_name(file_name)),
+            }
+        ]
+    )
+
+
+def _compact(file_name: str, replay: Callable[[], list[dict]]) -> None:
+    """
+    Fold the journal of the specified store into its snapshot and remove the journal.
+    Works on the serialized records: neither Persons nor Relationships are instantiated.
+    """
+    with _locked():
+        _store_snapshot(file_name, json.dumps(replay()))
+
+
+def compact() -> None:
+    """
+    Fold the journals of both persons and relationships into their respective snapshot.
+    """
+    with _locked():
+        _recover()
+        _compact(persons_file_name, _replay_persons)
+        _compact(relationships_file_name, _replay_relationships)
+
+
+def _replay_persons() -> list[dict]:
+    records = {int(o["id"]): o for o in _read_snapshot(persons_file_name)}
+    for entry in _read_journal(persons_file_name):
+        op = entry["op"]
+        if op == _OP_ADD:
+            records[int(entry["person"]["id"])] = entry["person"]
+        elif op == _OP_UPDATE:
+            person_id = int(entry["person"]["id"])
+            # an update of a Person deleted in the meantime must not resurrect it
+            if person_id in records:
+                records[person_id] = entry["person"]
+        elif op == _OP_DELETE:
+            records.pop(int(entry["id"]), None)
+        else:
+            raise ValueError(f"Unsupported operation {op} in persons journal")
+    return list(records.values())
+
+
+def store_persons(persons: list[Person]) -> None:
+    if not persons:
+        raise ValueError("Can't store an empty list of Persons.")
+
+    with _locked():
+        _recover()
+        # the snapshot now holds the whole set of Persons, previous operations must not be replayed on top of it
+        _store_snapshot(persons_file_name, json.dumps(persons, cls=PersonEncoder))
+
+
+def read_persons() -> list[Person]:
+    """
+    Persons are read from the files only if they changed since the last read.
+    :return: a new list, but the Persons are shared with the cache (see clear_cache())
+    """
+    global _persons_cache
+    _recover()
+    # the key is computed before reading: should the files change meanwhile, the next read will read them again
+    key = _store_key(persons_file_name)
+    if _persons_cache is None or _persons_cache[0] != key:
+        _persons_cache = key, [to_person(s) for s in _replay_persons()]
+    return list(_persons_cache[1])
+
+
+def add_person(person: Person) -> None:
+    apply_changes([(ADD_PERSON, person)])
+
+
 class RelationshipEncoder(json.JSONEncoder):
     def default(self, o: any) -> any:
         if isinstance(o, Relationship):
@@ -103,61 +451,249 @@ class RelationshipEncoder(json.JSONEncoder):
         return super().default(o)
 
 
-def _to_relationship(o: dict, persons: list[Person]) -> Relationship | None:
+def to_relationships(records: list[dict], persons: list[Person]) -> list[Relationship]:
+    """
+    Resolve the serialized Relationships against the specified Persons and the known RelationshipDefinitions, in a
+    single pass over the records.
+    Records referencing a Person or a RelationshipDefinition which does not exist are ignored and reported once, all
+    together.
+    """
     field_names = ("left", "right", "definition")
-    if not all(field_name in o for field_name in field_names):
-        raise ValueError(f"Missing at least one field of {field_names}")
-
-    left_id = int(o["left"])
-    right_id = int(o["right"])
-    definition_name = o["definition"]
-
     person_index = {person.person_id: person for person in persons}
-    if left_id not in person_index or right_id not in person_index:
-        print(f"Either person {left_id} or person {right_id} does not exist")
-        return None
-
     definition_index = {definition.name: definition for definition in relationship_definitions}
-    if definition_name not in definition_index:
-        print(f"definition {definition_name} does not exist")
-        return None
 
-    return Relationship(
-        person_left=person_index[left_id],
-        person_right=person_index[right_id],
-        definition=definition_index[definition_name],
-    )
+    res = []
+    missing_person_ids = set()
+    missing_definition_names = set()
+    for o in records:
+        if not all(field_name in o for field_name in field_names):
+            raise ValueError(f"Missing at least one field of {field_names}")
+
+        left = person_index.get(int(o["left"]))
+        right = person_index.get(int(o["right"]))
+        definition = definition_index.get(o["definition"])
+        if left is None:
+            missing_person_ids.add(int(o["left"]))
+        if right is None:
+            missing_person_ids.add(int(o["right"]))
+        if definition is None:
+            missing_definition_names.add(o["definition"])
+        if left is None or right is None or definition is None:
+            continue
+
+        res.append(Relationship(person_left=left, person_right=right, definition=definition))
+
+    if missing_person_ids:
+        print(f"Relationships ignored, persons do not exist: {sorted(missing_person_ids)}")
+    if missing_definition_names:
+        print(f"Relationships ignored, definitions do not exist: {sorted(missing_definition_names)}")
+
+    return res
 
 
 def store_relationships(relationships: list[Relationship]) -> None:
     if not relationships:
         raise ValueError("Can't store an empty list of Relationships.")
 
-    with open(relationships_file_name, "w") as f:
-        f.write(json.dumps(relationships, cls=RelationshipEncoder))
+    with _locked():
+        _recover()
+        # the snapshot now holds the whole set of Relationships, previous operations must not be replayed on top of it
+        _store_snapshot(relationships_file_name, json.dumps(relationships, cls=RelationshipEncoder))
+
+
+def _merge_person_records(records: list[dict], person_id: int, into_id: int) -> list[dict]:
+    """
+    :return: the records with the Person person_id replaced by the Person into_id, but those which would link the latter
+             to itself or duplicate another record
+    """
+    definition_index = {definition.name: definition for definition in relationship_definitions}
+    res = []
+    keys = set()
+    for o in records:
+        left_id, right_id = int(o["left"]), int(o["right"])
+        if person_id not in (left_id, right_id) and into_id not in (left_id, right_id):
+            res.append(o)
+            continue
+
+        left_id = into_id if left_id == person_id else left_id
+        right_id = into_id if right_id == person_id else right_id
+        if left_id == right_id:
+            continue
+        definition = definition_index.get(o["definition"])
+        key = (
+            (o["definition"], left_id, right_id)
+            if definition is None
+            else relationship_key(left_id, right_id, definition)
+        )
+        if key in keys:
+            continue
+        keys.add(key)
+        res.append({**o, "left": left_id, "right": right_id})
+    return res
+
+
+def _replay_relationships() -> list[dict]:
+    records = _read_snapshot(relationships_file_name)
+    for entry in _read_journal(relationships_file_name):
+        op = entry["op"]
+        if op == _OP_ADD:
+            records.append(entry["relationship"])
+        elif op == _OP_DELETE_PERSON:
+            person_id = int(entry["id"])
+            records = [o for o in records if int(o["left"]) != person_id and int(o["right"]) != person_id]
+        elif op == _OP_MERGE_PERSON:
+            records = _merge_person_records(records, int(entry["id"]), int(entry["into"]))
+        else:
+            raise ValueError(f"Unsupported operation {op} in relationships journal")
+    return records
 
 
 def read_relationships(persons: list[Person]) -> list[Relationship]:
     if not persons:
         raise ValueError("Persons can't be empty")
 
-    file = Path(relationships_file_name)
-    if file.exists():
-        with file.open("r") as f:
-            content = f.read()
-            if content:
-                res = [_to_relationship(s, persons) for s in json.loads(content)]
-                return list(filter(lambda t: t is not None, res))
+    global _relationships_cache
+    _recover()
+    key = _store_key(relationships_file_name), id(relationship_definitions)
+    if (
+        _relationships_cache is None
+        or _relationships_cache[0] != key
+        or not _same_persons(_relationships_cache[1], persons)
+    ):
+        _relationships_cache = key, list(persons), to_relationships(_replay_relationships(), persons)
+    return list(_relationships_cache[2])
+
+
+def _same_persons(persons: list[Person], other_persons: list[Person]) -> bool:
+    """
+    :return: whether both lists hold the very same Person objects, which cached Relationships reference
+    """
+    return len(persons) == len(other_persons) and all(p is o for p, o in zip(persons, other_persons))
+
+
+def apply_changes(changes: list[tuple[str, Person | Relationship | tuple[Person, Person]]]) -> None:
+    """
+    Append the specified changes, in order, to the journals with a single write per journal, in a transaction (see
+    _run_transaction()): either all or none of the changes are applied.
+    :param changes: kind of change (eg. ADD_PERSON) and the Person, Relationship or pair of Persons it applies to
+    """
+    persons_entries = []
+    relationships_entries = []
+    for kind, o in changes:
+        if kind == ADD_PERSON:
+            persons_entries.append({"op": _OP_ADD, "person": o})
+        elif kind == UPDATE_PERSON:
+            persons_entries.append({"op": _OP_UPDATE, "person": o})
+        elif kind == DELETE_PERSON:
+            persons_entries.append({"op": _OP_DELETE, "id": o.person_id})
+            relationships_entries.append({"op": _OP_DELETE_PERSON, "id": o.person_id})
+        elif kind == ADD_RELATIONSHIP:
+            relationships_entries.append({"op": _OP_ADD, "relationship": o})
+        elif kind == MERGE_PERSON:
+            merged_person, person = o
+            persons_entries.append({"op": _OP_DELETE, "id": merged_person.person_id})
+            relationships_entries.append(
+                {"op": _OP_MERGE_PERSON, "id": merged_person.person_id, "into": person.person_id}
+            )
+        else:
+            raise ValueError(f"Unsupported change {kind}")
+
+    stores = [
+        (relationships_file_name, relationships_entries, RelationshipEncoder, _replay_relationships),
+        (persons_file_name, persons_entries, PersonEncoder, _replay_persons),
+    ]
+    stores = [store for store in stores if store[1]]
+    if not stores:
+        return
+
+    # the journals are appended to from their current size, which must not change until they are
+    with _locked():
+        _recover()
+        _run_transaction(
+            [
+                {
+                    "journal": str(_journal_file_name(file_name)),
+                    "size": _journal_size(_journal_file_name(file_name)),
+                    "lines": "".join(json.dumps(entry, cls=cls) + "\n" for entry in entries),
+                }
+                for file_name, entries, cls, _ in stores
+            ]
+        )
 
-    return []
+        for file_name, _, _, replay in stores:
+            _compact_if_needed(file_name, replay)
+
+
+def _relationships_snapshot_key() -> list:
+    return json.loads(json.dumps(_file_key(relationships_file_name)))
+
+
+def read_ancestors() -> AncestorClosure | None:
+    """
+    :return: the closure last written by store_ancestors(), with the operations appended to the relationships journal
+             since replayed on top of it, None if there is none or if the relationships snapshot was written since (eg.
+             by a compaction)
+    """
+    _recover()
+    file = Path(ancestors_file_name)
+    if not file.exists():
+        return None
+    with file.open("r") as f:
+        o = json.loads(f.read())
+    if "snapshot" not in o or o["snapshot"] != _relationships_snapshot_key():
+        return None
+    res = AncestorClosure((ancestor_id, descendant_id, depth) for ancestor_id, descendant_id, depth in o["rows"])
+    for entry in _read_journal(relationships_file_name, o["journal_size"]):
+        op = entry["op"]
+        if op == _OP_ADD:
+            relationship = entry["relationship"]
+            if relationship["definition"] == parent_enfant.name:
+                try:
+                    res.add(int(relationship["left"]), int(relationship["right"]))
+                except ValueError:
+                    # ignored, as by pylms.core.build_ancestor_closure()
+                    pass
+        elif op == _OP_DELETE_PERSON:
+            res.remove_person(int(entry["id"]))
+        elif op == _OP_MERGE_PERSON:
+            res.merge_person(int(entry["id"]), int(entry["into"]))
+    return res
+
+
+def store_ancestors(rows: list[tuple[int, int, int]]) -> None:
+    """
+    Write the (ancestor id, descendant id, depth) rows of the closure of the Relationships currently written, along with
+    the position in the relationships journal it is up to date with.
+    Later changes to the Relationships are not written to the closure: they are replayed from the journal.
+    """
+    with _locked():
+        _recover()
+        _atomic_write(
+            ancestors_file_name,
+            json.dumps(
+                {
+                    "snapshot": _relationships_snapshot_key(),
+                    "journal_size": _journal_size(_journal_file_name(relationships_file_name)),
+                    "rows": rows,
+                }
+            ),
+        )
+
+
+def add_relationship(relationship: Relationship) -> None:
+    apply_changes([(ADD_RELATIONSHIP, relationship)])
 
 
 def update_person(person_to_update: Person) -> None:
-    persons = read_persons()
-    for p in persons[:]:
-        if p.person_id == person_to_update.person_id:
-            persons.remove(p)
-            persons.append(person_to_update)
-            store_persons(persons)
-            return
-    raise ValueError(f"Can't find person with id {person_to_update.person_id}")
+    """
+    Persons are not read: an update of a Person which does not exist is appended to the journal, but ignored when it is
+    replayed (see _replay_persons()).
+    """
+    apply_changes([(UPDATE_PERSON, person_to_update)])
+
+
+def delete_person(person_to_delete: Person) -> None:
+    """
+    Delete the specified Person and any Relationship it is part of.
+    """
+    apply_changes([(DELETE_PERSON, person_to_delete)])
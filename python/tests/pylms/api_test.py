@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+import threading
+import pylms.pylms
+from http import HTTPStatus
+from pylms import api, storage
+from pylms.api import ApiIOs, execute
+from pylms.core import Person, parent_enfant
+from pylms.pylms import list_persons, search_persons, store_person, update_person, link_persons
+from pytest import fixture
+from typing import Callable
+from unittest.mock import patch
+
+
+@fixture(autouse=True)
+def storage_files(tmpdir):
+    with (
+        patch("pylms.storage.persons_file_name", str(tmpdir + "persons.db")),
+        patch("pylms.storage.relationships_file_name", str(tmpdir + "relationships.db")),
+        patch("pylms.storage.ancestors_file_name", str(tmpdir + "ancestors.db")),
+        patch("pylms.storage.transaction_file_name", str(tmpdir + "transaction.db")),
+        patch("pylms.pylms.storage", storage),
+        patch("pylms.pylms._resident_repository", None),
+    ):
+        storage.clear_cache()
+        yield
+        storage.clear_cache()
+
+
+def test_non_interactive_selection():
+    api_ios = ApiIOs()
+    persons = [Person(1, "John", "Doe"), Person(2, "Tony", "Doe")]
+
+    assert api_ios.select_person(persons) is None
+    assert api_ios.select_person([Person(3, "Paul")]) is None
+
+    assert api_ios.candidates == persons
+
+
+def test_update_person():
+    person = Person(1, "John", "Doe")
+
+    assert ApiIOs({"lastname": "Wick", "tags": ["famille"]}).update_person(person) is person
+
+    assert (person.firstname, person.lastname, person.tags) == ("John", "Wick", ["famille"])
+
+
+def test_execute(caplog):
+    caplog.set_level(logging.INFO, logger="pylms.pylms")
+    status, body = execute(lambda: store_person("John", "Doe"))
+    assert status == HTTPStatus.OK
+    assert body["result"] is None
+    assert [(event["event"], event["person"]["firstname"]) for event in body["events"]] == [("creating_person", "John")]
+    execute(lambda: store_person("Tony", "Doe"))
+
+    status, body = execute(lambda: link_persons("john père de tony"))
+    assert status == HTTPStatus.OK
+    assert body["events"][-1] == {
+        "event": "creating_link",
+        "relationship": {"left": 0, "right": 1, "definition": parent_enfant.name},
+    }
+
+    status, body = execute(lambda: search_persons("tony"))
+    assert [(p["id"], p["relationships"]) for p in body["result"]] == [
+        (1, [{"left": 0, "right": 1, "definition": parent_enfant.name}])
+    ]
+
+    status, body = execute(lambda: search_persons("nobody"))
+    assert (status, body["result"], body["messages"]) == (HTTPStatus.OK, None, ['No match for "nobody".'])
+
+    status, body = execute(lambda: link_persons("tony père de john"))
+    assert status == HTTPStatus.BAD_REQUEST
+    assert body == {"errors": ["Unsupported link request: John Doe is Tony Doe or one of their ancestors"]}
+
+    status, body = execute(lambda: update_person("doe"), {"tags": ["famille"]})
+    assert status == HTTPStatus.CONFLICT
+    assert [p["id"] for p in body["candidates"]] == [0, 1]
+
+    # written to the storage
+    assert [person.firstname for person in storage.read_persons()] == ["John", "Tony"]
+    assert len(storage.read_relationships(storage.read_persons())) == 1
+
+
+async def _request(port: int, method: str, target: str, body: bytes = b"") -> tuple[int, dict]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {target} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode())
+    writer.write(body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, data = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ")[1]), json.loads(data)
+
+
+async def _serve_requests(requests: list[tuple[str, str, bytes]]) -> list[tuple[int, dict]]:
+    with api.CommandScheduler() as scheduler:
+        server = await asyncio.start_server(lambda r, w: api._handle_connection(scheduler, r, w), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await asyncio.gather(*[_request(port, *request) for request in requests])
+
+
+def test_concurrent_requests():
+    asyncio.run(_serve_requests([("POST", "/persons", json.dumps({"firstname": "John", "lastname": "Doe"}).encode())]))
+
+    responses = asyncio.run(
+        _serve_requests(
+            [("GET", "/persons?q=doe", b"")] * 200
+            + [("POST", "/persons", json.dumps({"firstname": f"Tony{i}"}).encode()) for i in range(10)]
+        )
+    )
+
+    assert [status for status, _ in responses] == [200] * 210
+    assert [[p["firstname"] for p in body["result"]] for _, body in responses[:200]] == [["John"]] * 200
+    # writes were executed one at a time, each Person getting its own id
+    assert sorted(body["events"][0]["person"]["id"] for _, body in responses[200:]) == list(range(1, 11))
+
+
+def test_invalid_requests():
+    responses = asyncio.run(
+        _serve_requests(
+            [
+                ("GET", "/nope", b""),
+                ("PUT", "/persons", b""),
+                ("POST", "/persons", b"{"),
+                ("POST", "/persons", b'{"lastname": "Doe"}'),
+                ("PATCH", "/persons", b"[]"),
+                ("POST", "/persons", b'{"firstname": 123}'),
+                ("POST", "/persons", b'{"firstname": "John", "lastname": ["Doe"]}'),
+                ("PATCH", "/persons", b'{"pattern": "John", "tags": "abc"}'),
+                ("PATCH", "/persons", b'{"pattern": "John", "tags": ["abc", 1]}'),
+                ("PATCH", "/persons", b'{"pattern": "John", "firstname": null}'),
+            ]
+        )
+    )
+
+    assert responses == [
+        (404, {"errors": ["No such resource /nope"]}),
+        (405, {"errors": ["Unsupported method PUT for /persons"]}),
+        (400, {"errors": ["Invalid JSON body"]}),
+        (400, {"errors": ["Missing firstname"]}),
+        (400, {"errors": ["JSON body must be an object"]}),
+        (400, {"errors": ["firstname must be a string"]}),
+        (400, {"errors": ["lastname must be a string"]}),
+        (400, {"errors": ["tags must be a list of strings"]}),
+        (400, {"errors": ["tags must be a list of strings"]}),
+        (400, {"errors": ["Missing firstname"]}),
+    ]
+
+
+@patch("builtins.print")
+@patch("pylms.api.serve")
+def test_main_invalid_port(mock_serve, mock_print):
+    for port in ("abc", "70000"):
+        with patch("sys.argv", ["pylmsapi", port]):
+            api.main()
+
+        mock_print.assert_called_with(f"Invalid port {port}, usage: pylmsapi [port [host]]")
+    mock_serve.assert_not_called()
+
+
+@patch("pylms.api.execute")
+def test_get_routes(mock_execute):
+    mock_execute.return_value = HTTPStatus.OK, {}
+
+    asyncio.run(_serve_requests([("GET", "/persons", b"")]))
+
+    mock_execute.assert_called_once_with(list_persons)
+
+
+def test_reads_are_concurrent_and_writes_exclusive():
+    # each read waits for the other one: they can only complete if executed concurrently
+    reads_barrier = threading.Barrier(2, timeout=5)
+    executed = []
+
+    def read(name: str) -> Callable[[], None]:
+        def command() -> None:
+            executed.append((name, threading.current_thread() is threading.main_thread()))
+            if name in ("read_1", "read_2"):
+                reads_barrier.wait()
+
+        return command
+
+    def write() -> None:
+        # the reads received before are done
+        assert sorted(name for name, _ in executed) == ["read_1", "read_2"]
+        executed.append(("write", threading.current_thread() is threading.main_thread()))
+
+    async def run() -> list[tuple[HTTPStatus, dict]]:
+        with api.CommandScheduler() as scheduler:
+            return await asyncio.gather(
+                scheduler.read(read("read_1")),
+                scheduler.read(read("read_2")),
+                scheduler.write(write),
+                scheduler.read(read("read_3")),
+            )
+
+    responses = asyncio.run(run())
+
+    assert [status for status, _ in responses] == [HTTPStatus.OK] * 4
+    assert sorted(name for name, _ in executed[:2]) == ["read_1", "read_2"]
+    # the read received after the write waits for it, none is executed by the event loop
+    assert executed[2:] == [("write", False), ("read_3", False)]
+    assert not any(on_event_loop for _, on_event_loop in executed)
+
+
+def test_messages_of_concurrent_commands_are_kept_apart(caplog):
+    caplog.set_level(logging.INFO, logger="pylms.pylms")
+    barrier = threading.Barrier(2, timeout=5)
+
+    def command(name: str) -> Callable[[], None]:
+        def log() -> None:
+            barrier.wait()
+            pylms.pylms.logger.info(name)
+            barrier.wait()
+
+        return log
+
+    async def run() -> list[tuple[HTTPStatus, dict]]:
+        with api.CommandScheduler() as scheduler:
+            return await asyncio.gather(scheduler.read(command("John")), scheduler.read(command("Tony")))
+
+    responses = asyncio.run(run())
+
+    assert [body["messages"] for _, body in responses] == [["John"], ["Tony"]]
@@ -1,5 +1,5 @@
-from pylms.cli import CLI
-from pylms.pylms import Person, RelationshipDefinition, Relationship
+from pylms.cli import CLI, BatchCLI
+from pylms.pylms import Person, RelationshipDefinition, Relationship, Stats
 from pytest import raises, mark
 from unittest.mock import patch, call
 
@@ -273,3 +273,157 @@ class TestDeletingRelationship:
         )
         assert mock_print.call_count == 3
         mock_hit_enter.assert_called_once_with()
+
+
+class TestBulkConfirmations:
+    @patch("builtins.print")
+    @patch.object(under_test, "show_person")
+    @patch.object(under_test, "_interactive_hit_enter")
+    def test_deleting_persons(self, mock_hit_enter, mock_show_person, mock_print):
+        person1 = Person(1, "Seb", "King")
+        person2 = Person(2, "Mario", "Bros")
+
+        under_test.deleting_persons([person2, person1], [Relationship(person1, person2, RelationshipDefinition("rld"))])
+
+        mock_print.assert_has_calls([call("Hit ENTER to delete 2 persons and 1 relationships:"), call(CTRL_C_TO_EXIT)])
+        mock_show_person.assert_has_calls([call(person1), call(person2)])
+        mock_hit_enter.assert_called_once_with()
+
+    @patch("builtins.print")
+    @patch.object(under_test, "show_person")
+    @patch.object(under_test, "_interactive_hit_enter")
+    def test_tagging_persons(self, mock_hit_enter, mock_show_person, mock_print):
+        person = Person(1, "Seb", "King")
+
+        under_test.tagging_persons([person], "famille")
+        under_test.untagging_persons([person], "boulot")
+
+        mock_print.assert_has_calls(
+            [
+                call('Hit ENTER to add tag "famille" to 1 persons:'),
+                call(CTRL_C_TO_EXIT),
+                call('Hit ENTER to remove tag "boulot" from 1 persons:'),
+                call(CTRL_C_TO_EXIT),
+            ]
+        )
+        assert mock_hit_enter.call_count == 2
+
+
+class TestMergingPerson:
+    @patch("builtins.print")
+    @patch.object(under_test, "show_person")
+    @patch.object(under_test, "_interactive_hit_enter")
+    def test_merging_person(self, mock_hit_enter, mock_show_person, mock_print):
+        person1 = Person(1, "Jean", "Dupont")
+        person2 = Person(2, "Jean", "Dupond")
+
+        under_test.merging_person(person2, person1)
+
+        mock_print.assert_has_calls([call("Hit ENTER to merge:"), call("into:"), call(CTRL_C_TO_EXIT)])
+        mock_show_person.assert_has_calls([call(person2), call(person1)])
+        mock_hit_enter.assert_called_once_with()
+
+
+class TestShowRelationshipPath:
+
+    @patch("builtins.print")
+    def test_path(self, mock_print):
+        definition = RelationshipDefinition(
+            name="foo", person_left_default_repr="left", person_right_default_repr="right"
+        )
+        john = Person(1, "John", "Doe")
+        jane = Person(2, "Jane")
+        bob = Person(3, "Bob")
+
+        under_test.show_relationship_path(
+            john,
+            [
+                Relationship(person_left=john, person_right=jane, definition=definition),
+                Relationship(bob, jane, definition),
+            ],
+        )
+
+        mock_print.assert_called_once_with("John Doe — left — Jane — right — Bob")
+
+
+class TestClusters:
+
+    @patch("builtins.print")
+    @patch.object(under_test, "show_person")
+    def test_list_clusters(self, mock_show_person, mock_print):
+        persons = [Person(3, "Bob"), Person(1, "Seb"), Person(2, "Tom")]
+
+        under_test.list_clusters([[(persons[0], []), (persons[1], [])], [(persons[2], [])]])
+
+        assert mock_print.call_args_list == [call("Cluster 1 (2 persons):"), call("Cluster 2 (1 persons):")]
+        assert mock_show_person.call_args_list == [call(persons[1]), call(persons[0]), call(persons[2])]
+
+    @patch("builtins.print")
+    def test_list_no_clusters(self, mock_print):
+        under_test.list_clusters([])
+
+        mock_print.assert_called_once_with("No Person registered yet.")
+
+    @patch("builtins.print")
+    def test_show_stats(self, mock_print):
+        under_test.show_stats(
+            Stats(
+                persons_count=6,
+                relationships_count=3,
+                cluster_sizes=[3, 1, 1, 1],
+                largest_cluster=[Person(1, "John", "Doe"), Person(2, "Bob"), Person(4, "Tom")],
+            )
+        )
+
+        assert mock_print.call_args_list == [
+            call("Persons: 6"),
+            call("Relationships: 3"),
+            call("Clusters: 4 (3 isolated persons)"),
+            call("Cluster sizes: 3"),
+            call("Largest cluster: 3 persons, including John Doe"),
+        ]
+
+
+class TestListDuplicates:
+
+    @patch("builtins.print")
+    def test_duplicates(self, mock_print):
+        under_test.list_duplicates([(Person(1, "Jean", "Dupont"), Person(7, "Jean", "Dupond"), 0.916)])
+
+        mock_print.assert_called_once_with("(1) Jean Dupont ~ (7) Jean Dupond: 92%")
+
+    @patch("builtins.print")
+    def test_no_duplicate(self, mock_print):
+        under_test.list_duplicates([])
+
+        mock_print.assert_called_once_with("No duplicate found.")
+
+
+class TestBatchCLI:
+    batch_cli = BatchCLI()
+
+    @patch("builtins.print")
+    @patch("builtins.input")
+    def test_no_input(self, mock_input, mock_print):
+        with raises(ValueError, match="Interactive input is not supported in batch mode"):
+            self.batch_cli.update_person(Person(1, "Seb", "King"))
+
+        assert mock_input.call_count == 0
+
+    def test_no_selection(self):
+        with raises(ValueError, match="2 persons match, a more specific pattern is required"):
+            self.batch_cli.select_person([Person(1, "Seb", "King"), Person(2, "Mario", "Bros")])
+
+    @patch("builtins.print")
+    @patch("builtins.input")
+    def test_confirmations_are_implied(self, mock_input, mock_print):
+        person1 = Person(1, "Seb", "King")
+        person2 = Person(2, "Mario", "Bros")
+
+        self.batch_cli.deleting_person(person1)
+        self.batch_cli.merging_person(person2, person1)
+        self.batch_cli.deleting_persons([person1, person2], [])
+        self.batch_cli.tagging_persons([person1], "famille")
+
+        assert mock_input.call_count == 0
+        assert mock_print.call_count == 0
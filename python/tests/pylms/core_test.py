@@ -2,8 +2,13 @@ from datetime import datetime
 from pylms.pylms import Person
 from pylms.pylms import PersonIdGenerator
 from unittest.mock import patch
-from pylms.core import RelationshipDefinition, Relationship, RelationshipAlias
+from pylms.core import RelationshipDefinition, Relationship, RelationshipAlias, PersonGraph, resolve_persons
 from pylms.core import Sex, MALE, FEMALE
+from pylms.core import parent_enfant, copain_copine, relationship_path, relationship_path_repr
+from pylms.core import AncestorClosure, build_ancestor_closure
+from pylms.core import KinshipView, frere_soeur, grand_parent_petit_enfant, oncle_tante_neveu_niece, cousin_cousine
+from pylms.core import TagIndex, parse_tag_query, is_tag_query, TrigramIndex, search_key, search_match
+from pylms.core import merge_persons, relationship_key
 from pytest import raises, mark
 
 
@@ -39,6 +44,44 @@ def test_eq():
     assert under_test != (1, "f", "n")
 
 
+def test_hash_consistent_with_eq():
+    under_test = Person(person_id=1, firstname="f", lastname="n")
+
+    assert hash(under_test) == hash(Person(1, "f", "n"))
+    assert {under_test, Person(1, "f", "n"), Person(2, "f", "n")} == {Person(1, "f", "n"), Person(2, "f", "n")}
+    # hash does not change with the names, which can be updated
+    under_test.firstname = "g"
+    assert under_test in {Person(1, "g", "n")}
+
+
+def test_no_attribute_besides_slots():
+    with raises(AttributeError):
+        Person(1, "f").foo = "bar"
+
+
+@mark.parametrize(
+    ("s", "expected"),
+    [("Élodie", "elodie"), ("Cârine", "carine"), ("MÜLLER", "muller"), ("Straße", "strasse"), ("ﬁlou", "filou")],
+)
+def test_search_key(s, expected):
+    assert search_key(s) == expected
+
+
+def test_search_keys_follow_changes():
+    under_test = Person(person_id=1, firstname="Élodie", lastname="Dupré")
+    assert (under_test.firstname_key, under_test.lastname_key, under_test.tag_keys) == ("elodie", "dupre", ())
+
+    under_test.firstname = "Hélène"
+    under_test.lastname = None
+    under_test.tags = ["Cours d'Escalade", "Collègues"]
+
+    assert (under_test.firstname_key, under_test.lastname_key) == ("helene", None)
+    assert under_test.tag_keys == ("cours d'escalade", "collegues")
+    assert search_match("HELENE", under_test)
+    assert search_match("collègue", under_test)
+    assert not search_match("dupre", under_test)
+
+
 def test_created_not_in_eq():
     t1 = datetime(2023, 4, 16, 11, 52, 56)
     t2 = datetime(2023, 4, 16, 11, 53, 15)
@@ -71,6 +114,19 @@ class TestRelationship:
     )
     relationship = Relationship(person_left=person1, person_right=person2, definition=definition)
 
+    def test_eq_and_hash(self):
+        same = Relationship(person_left=Person(1, "John", "Doe"), person_right=self.person2, definition=self.definition)
+        reversed_ = Relationship(person_left=self.person2, person_right=self.person1, definition=self.definition)
+        other_definition = Relationship(
+            person_left=self.person1, person_right=self.person2, definition=RelationshipDefinition(name="FooDef")
+        )
+
+        assert self.relationship == same
+        assert hash(self.relationship) == hash(same)
+        assert self.relationship != reversed_
+        assert self.relationship != other_definition
+        assert len({self.relationship, same, reversed_}) == 2
+
     def test_repr_for_fails_if_neither_left_nor_right(self):
         expected_message = f"{self.person3} is neither the left nor right person of this FooDef relationship"
         with raises(ValueError, match=expected_message):
@@ -83,6 +139,247 @@ class TestRelationship:
         assert self.relationship.repr_for(self.person2) == "RightFoo"
 
 
+class TestPersonGraph:
+    person1 = Person(1, "John", "Doe")
+    person2 = Person(2, "Jane", "Doe")
+    person3 = Person(3, "Diana", "King")
+    definition = RelationshipDefinition(name="FooDef")
+    rl1 = Relationship(person_left=person1, person_right=person2, definition=definition)
+    rl2 = Relationship(person_left=person3, person_right=person1, definition=definition)
+    rl3 = Relationship(person_left=person2, person_right=person2, definition=definition)
+
+    def test_adjacency(self):
+        graph = PersonGraph([self.rl1, self.rl2, self.rl3])
+
+        assert graph.outgoing(1) == [self.rl1]
+        assert graph.incoming(1) == [self.rl2]
+        assert graph.relationships_of(1) == [self.rl1, self.rl2]
+        # a Relationship of a Person with itself is listed once
+        assert graph.relationships_of(2) == [self.rl1, self.rl3]
+        assert graph.relationships_of(4) == []
+
+    def test_add(self):
+        graph = PersonGraph([self.rl1])
+
+        graph.add(self.rl2)
+
+        assert graph.relationships_of(3) == [self.rl2]
+        assert graph.relationships_of(1) == [self.rl1, self.rl2]
+
+    def test_resolve_persons(self):
+        persons = [self.person3, self.person1, self.person2]
+
+        assert resolve_persons(persons, [self.rl1, self.rl2, self.rl3]) == [
+            (self.person3, [self.rl2]),
+            (self.person1, [self.rl1, self.rl2]),
+            (self.person2, [self.rl1, self.rl3]),
+        ]
+        assert resolve_persons(
+            persons,
+            [self.rl1, self.rl2, self.rl3],
+            person_filter=lambda p: p.person_id != 3,
+            relationship_filter=lambda p, r: r.left == p,
+        ) == [(self.person1, [self.rl1]), (self.person2, [self.rl3])]
+
+
+class TestRelationshipPath:
+    paul = Person(1, "Paul", sex=MALE)
+    jacques = Person(2, "Jacques", sex=MALE)
+    tony = Person(3, "Tony")
+    lisa = Person(4, "Lisa", sex=FEMALE)
+    marc = Person(5, "Marc")
+    eve = Person(6, "Eve")
+    jacques_paul = Relationship(person_left=jacques, person_right=paul, definition=parent_enfant)
+    jacques_tony = Relationship(person_left=jacques, person_right=tony, definition=parent_enfant)
+    lisa_paul = Relationship(person_left=lisa, person_right=paul, definition=copain_copine)
+    lisa_marc = Relationship(person_left=lisa, person_right=marc, definition=copain_copine)
+    marc_tony = Relationship(person_left=marc, person_right=tony, definition=copain_copine)
+    graph = PersonGraph([lisa_paul, lisa_marc, marc_tony, jacques_paul, jacques_tony])
+
+    def test_shortest_path(self):
+        assert relationship_path(self.graph, 1, 3) == [self.jacques_paul, self.jacques_tony]
+        assert relationship_path(self.graph, 3, 1) == [self.jacques_tony, self.jacques_paul]
+        assert relationship_path(self.graph, 5, 1) == [self.lisa_marc, self.lisa_paul]
+        assert relationship_path(self.graph, 2, 5) in (
+            [self.jacques_paul, self.lisa_paul, self.lisa_marc],
+            [self.jacques_tony, self.marc_tony],
+        )
+        assert len(relationship_path(self.graph, 2, 5)) == 2
+
+    def test_same_person(self):
+        assert relationship_path(self.graph, 1, 1) == []
+
+    def test_not_related(self):
+        assert relationship_path(self.graph, 1, 6) is None
+        assert relationship_path(self.graph, 6, 7) is None
+
+    def test_repr(self):
+        path = relationship_path(self.graph, 1, 3)
+
+        assert relationship_path_repr(self.paul, path) == "Paul — fils de — Jacques — père de — Tony"
+        assert relationship_path_repr(self.paul, []) == "Paul"
+
+
+class TestKinshipView:
+    # grandpa is the father of dad and uncle, dad is the father of paul and lisa, uncle is the father of cousin
+    grandpa = Person(1, "Grandpa", sex=MALE)
+    dad = Person(2, "Dad", sex=MALE)
+    uncle = Person(3, "Uncle", sex=MALE)
+    paul = Person(4, "Paul", sex=MALE)
+    lisa = Person(5, "Lisa", sex=FEMALE)
+    cousin = Person(6, "Cousin")
+    relationships = [
+        Relationship(person_left=grandpa, person_right=dad, definition=parent_enfant),
+        Relationship(person_left=grandpa, person_right=uncle, definition=parent_enfant),
+        Relationship(person_left=dad, person_right=paul, definition=parent_enfant),
+        Relationship(person_left=dad, person_right=lisa, definition=parent_enfant),
+        Relationship(person_left=uncle, person_right=cousin, definition=parent_enfant),
+        Relationship(person_left=paul, person_right=lisa, definition=copain_copine),
+    ]
+
+    @staticmethod
+    def _derived(view: KinshipView) -> set[tuple[int, int, str]]:
+        return {
+            (rl.left.person_id, rl.right.person_id, rl.definition.name)
+            for person_id in range(1, 8)
+            for rl in view.graph.incoming(person_id)
+        }
+
+    def test_derived_relationships(self):
+        view = KinshipView(self.relationships)
+
+        assert self._derived(view) == {
+            (2, 3, frere_soeur.name),
+            (3, 2, frere_soeur.name),
+            (4, 5, frere_soeur.name),
+            (5, 4, frere_soeur.name),
+            (1, 4, grand_parent_petit_enfant.name),
+            (1, 5, grand_parent_petit_enfant.name),
+            (1, 6, grand_parent_petit_enfant.name),
+            (3, 4, oncle_tante_neveu_niece.name),
+            (3, 5, oncle_tante_neveu_niece.name),
+            (2, 6, oncle_tante_neveu_niece.name),
+            (4, 6, cousin_cousine.name),
+            (5, 6, cousin_cousine.name),
+            (6, 4, cousin_cousine.name),
+            (6, 5, cousin_cousine.name),
+        }
+
+    @mark.parametrize("index", range(6))
+    def test_add_same_as_build(self, index):
+        view = KinshipView(self.relationships[:index] + self.relationships[index + 1 :])
+
+        view.add(self.relationships[index])
+
+        assert self._derived(view) == self._derived(KinshipView(self.relationships))
+
+    @mark.parametrize("person_id", range(1, 7))
+    def test_remove_person_same_as_build(self, person_id):
+        view = KinshipView(self.relationships)
+
+        view.remove_person(person_id)
+
+        assert self._derived(view) == self._derived(
+            KinshipView([rl for rl in self.relationships if person_id not in (rl.left.person_id, rl.right.person_id)])
+        )
+
+    def test_update_person(self):
+        view = KinshipView(self.relationships)
+        updated_uncle = Person(3, "Aunt", sex=FEMALE)
+
+        view.update_person(updated_uncle)
+
+        assert [rl.left for rl in view.graph.incoming(4)] == [self.lisa, self.grandpa, updated_uncle, self.cousin]
+        assert [(rl.left, rl.right) for rl in view.graph.incoming(3)] == [(self.dad, updated_uncle)]
+        assert all(rl.left is updated_uncle for rl in view.graph.outgoing(3))
+
+
+class TestAncestorClosure:
+    # 1 is the parent of 2 and 3, both parents of 4, 4 is the parent of 5, 6 is the parent of 3
+    edges = [(1, 2), (1, 3), (2, 4), (3, 4), (4, 5), (6, 3)]
+
+    @staticmethod
+    def _closure(edges: list[tuple[int, int]]) -> AncestorClosure:
+        res = AncestorClosure()
+        for parent_id, child_id in edges:
+            res.add(parent_id, child_id)
+        return res
+
+    def test_depths(self):
+        closure = self._closure(self.edges)
+
+        assert closure.ancestors(5) == {4: 1, 2: 2, 3: 2, 1: 3, 6: 3}
+        assert closure.descendants(1) == {2: 1, 3: 1, 4: 2, 5: 3}
+        assert closure.ancestors(1) == {}
+        assert closure.is_ancestor(6, 5)
+        assert not closure.is_ancestor(5, 6)
+        assert not closure.is_ancestor(2, 3)
+
+    @mark.parametrize("order", [[0, 1, 2, 3, 4, 5], [4, 2, 3, 5, 1, 0], [5, 4, 3, 2, 1, 0]])
+    def test_insertion_order_does_not_matter(self, order):
+        closure = self._closure([self.edges[i] for i in order])
+
+        assert sorted(closure.rows()) == sorted(self._closure(self.edges).rows())
+
+    @mark.parametrize("edge", [(5, 1), (4, 4), (4, 2)])
+    def test_cycle(self, edge):
+        closure = self._closure(self.edges)
+
+        with raises(ValueError, match="can't be a child of"):
+            closure.add(*edge)
+
+        assert sorted(closure.rows()) == sorted(self._closure(self.edges).rows())
+
+    @mark.parametrize("person_id", range(1, 7))
+    def test_remove_person_same_as_build(self, person_id):
+        closure = self._closure(self.edges)
+
+        closure.remove_person(person_id)
+
+        assert sorted(closure.rows()) == sorted(self._closure([e for e in self.edges if person_id not in e]).rows())
+
+    # a merge of an ancestor and a descendant is refused (see pylms.pylms.merge_person)
+    @mark.parametrize(("merged_person_id", "person_id"), [(2, 3), (2, 6), (7, 1), (6, 1)])
+    def test_merge_person_same_as_build(self, merged_person_id, person_id):
+        closure = self._closure(self.edges)
+
+        closure.merge_person(merged_person_id, person_id)
+
+        merged_edges = {tuple(person_id if i == merged_person_id else i for i in edge) for edge in self.edges}
+        assert sorted(closure.rows()) == sorted(self._closure(sorted(merged_edges)).rows())
+
+    def test_rows(self):
+        closure = AncestorClosure(self._closure(self.edges).rows())
+
+        closure.remove_person(2)
+        closure.add(5, 7)
+
+        assert sorted(closure.rows()) == sorted(self._closure([(1, 3), (3, 4), (4, 5), (6, 3), (5, 7)]).rows())
+
+    def test_closest_common_ancestors(self):
+        closure = self._closure(self.edges + [(7, 8), (8, 9)])
+
+        assert closure.closest_common_ancestors(2, 3) == [1]
+        assert closure.closest_common_ancestors(5, 2) == [1]
+        assert closure.closest_common_ancestors(5, 6) == []
+        assert closure.closest_common_ancestors(5, 9) == []
+
+    @patch("pylms.core.logger")
+    def test_build_ignores_cycles(self, mock_logger):
+        persons = [Person(i, f"P{i}") for i in range(3)]
+        closure = build_ancestor_closure(
+            [
+                Relationship(persons[0], persons[1], parent_enfant),
+                Relationship(persons[1], persons[2], parent_enfant),
+                Relationship(persons[2], persons[0], parent_enfant),
+                Relationship(persons[2], persons[0], copain_copine),
+            ]
+        )
+
+        assert sorted(closure.rows()) == [(0, 1, 1), (0, 2, 2), (1, 2, 1)]
+        mock_logger.warning.assert_called_once()
+
+
 class TestPersonSex:
     @mark.parametrize("constant_sex", [MALE, FEMALE])
     def test_init_accepts_constant_as_parameter(self, constant_sex):
@@ -117,16 +414,18 @@ class TestRelationshipReprFor:
         with raises(ValueError, match="other unknown is neither the left nor right person of this rl relationship"):
             self.rl1.repr_for(other_person)
 
-    @patch.object(rl_def, "left_repr")
-    @patch.object(rl_def, "right_repr")
+    # RelationshipDefinition has __slots__: methods can only be patched on the class
+    @patch.object(RelationshipDefinition, "left_repr")
+    @patch.object(RelationshipDefinition, "right_repr")
     def test_calls_left_repr_for_left_person(self, mock_right_repr, mock_left_repr):
         self.rl1.repr_for(self.person1)
 
         mock_left_repr.assert_called_once_with(self.person1)
         assert mock_right_repr.call_count == 0
 
-    @patch.object(rl_def, "left_repr")
-    @patch.object(rl_def, "right_repr")
+    # RelationshipDefinition has __slots__: methods can only be patched on the class
+    @patch.object(RelationshipDefinition, "left_repr")
+    @patch.object(RelationshipDefinition, "right_repr")
     def test_calls_right_repr_for_right_person(self, mock_right_repr, mock_left_repr):
         self.rl1.repr_for(self.person2)
 
@@ -134,6 +433,25 @@ class TestRelationshipReprFor:
         mock_right_repr.assert_called_once_with(self.person2)
 
 
+class TestRelationshipDefinitionAliasTable:
+    @patch("pylms.core.logger")
+    def test_ambiguity_is_reported_once_at_construction(self, mock_logger):
+        under_test = RelationshipDefinition(
+            name="foo",
+            aliases=[
+                RelationshipAlias("first", left_person_sex=MALE),
+                RelationshipAlias("second", left_person_sex=MALE),
+            ],
+        )
+
+        mock_logger.warning.assert_called_once_with(
+            "More than one alias found for reverse=False and sex=MALE in foo, first is used rather than second"
+        )
+        for _ in range(3):
+            assert under_test.left_repr(Person(1, "John", sex=MALE)) == "first"
+        assert mock_logger.warning.call_count == 1
+
+
 class TestRelationshipDefinitionRepr:
     person_no_sex = Person(1, "Camilla")
     person_male = Person(1, "Camille", sex=MALE)
@@ -192,3 +510,138 @@ class TestRelationshipDefinitionRepr:
 
     def test_right_repr_return_alias_reverse_female(self):
         assert self.rld_defaults_all_aliases_variants.right_repr(self.person_female) == "left_female_reverse"
+
+
+class TestTagIndex:
+    john = Person(1, "John")
+    john.tags = ["Cours d'escalade", "boulot"]
+    peter = Person(2, "Peter")
+    peter.tags = ["escalade"]
+    tom = Person(3, "Tom")
+
+    def test_matching_is_partial_and_case_insensitive(self):
+        index = TagIndex([self.john, self.peter, self.tom])
+
+        assert index.matching("ESCALADE") == {1, 2}
+        assert index.matching("cours") == {1}
+        assert index.matching("foo") == set()
+        assert index.matching("ul") == {1}
+        assert index.matching("s d'esc") == {1}
+        assert index.person_ids == {1, 2, 3}
+
+    def test_update_and_remove(self):
+        index = TagIndex([self.john, self.peter, self.tom])
+        updated_john = Person(1, "John")
+        updated_john.tags = ["collègues"]
+
+        index.update(updated_john)
+        index.remove(2)
+
+        assert index.matching("escalade") == set()
+        assert index.matching("collègues") == {1}
+        assert index.matching("lèg") == {1}
+        assert index.person_ids == {1, 3}
+        # trigrams of the tags no Person has any more are dropped
+        assert index._tag_keys_by_trigram.keys() == {"col", "oll", "lle", "leg", "egu", "gue", "ues"}
+
+
+class TestTrigramIndex:
+    john = Person(1, "John", "Doe")
+    joanna = Person(2, "Joanna")
+    tom = Person(3, "Tom", "Johnson")
+
+    def test_candidates(self):
+        index = TrigramIndex([self.john, self.joanna, self.tom])
+
+        assert index.candidates("JOH") == {1, 3}
+        assert index.candidates("john") == {1, 3}
+        assert index.candidates("joanna") == {2}
+        assert index.candidates("xyz") == set()
+        # pattern across first name and last name can't match
+        assert index.candidates("john doe") == set()
+
+    def test_pattern_too_short(self):
+        index = TrigramIndex([self.john])
+
+        assert index.candidates("jo") is None
+        assert index.candidates("") is None
+
+    def test_update_and_remove(self):
+        index = TrigramIndex([self.john, self.joanna, self.tom])
+
+        index.update(Person(1, "Jim", "Doe"))
+        index.remove(3)
+
+        assert index.candidates("joh") == set()
+        assert index.candidates("jim") == {1}
+
+
+class TestTagQuery:
+    @mark.parametrize(
+        ("text", "expected"),
+        [
+            ("escalade & !boulot", "(escalade & !boulot)"),
+            ("a | b & c", "(a | (b & c))"),
+            ("(a | b) & c", "((a | b) & c)"),
+            ("!!a", "!!a"),
+            ("cours d'escalade|a b", "(cours d'escalade | a b)"),
+        ],
+    )
+    def test_parse(self, text, expected):
+        assert repr(parse_tag_query(text)) == expected
+
+    @mark.parametrize(
+        ("text", "message"),
+        [
+            ("a &", "Unexpected end"),
+            ("a & (b", "Unexpected end"),
+            ("a b)", "Unexpected \\)"),
+            ("& a", "Unexpected &"),
+            ("(a))", "Unexpected \\)"),
+        ],
+    )
+    def test_parse_invalid(self, text, message):
+        with raises(ValueError, match=message):
+            parse_tag_query(text)
+
+    @mark.parametrize(
+        ("text", "expected"),
+        [
+            ("escalade & !boulot", {2}),
+            ("escalade & boulot", {1}),
+            ("escalade | foo", {1, 2}),
+            ("!escalade", {3}),
+            ("!(escalade & boulot) & !foo", {2, 3}),
+        ],
+    )
+    def test_evaluate(self, text, expected):
+        index = TagIndex([TestTagIndex.john, TestTagIndex.peter, TestTagIndex.tom])
+
+        assert parse_tag_query(text).evaluate(index) == expected
+
+    def test_is_tag_query(self):
+        assert is_tag_query("a & b")
+        assert is_tag_query("!a")
+        assert is_tag_query("a|b")
+        assert not is_tag_query("cours d'escalade")
+
+
+def test_merge_persons():
+    person = Person(1, "Jean", "Dupont", created=datetime(2024, 4, 16, 12, 0, 0))
+    person.tags = ["escalade", "Boulot"]
+    other_person = Person(2, "Jean", "Dupond", created=datetime(2023, 1, 1, 8, 0, 0), sex=MALE)
+    other_person.tags = ["boulot", "vélo"]
+
+    res = merge_persons(person, other_person)
+
+    assert res == person and res is not person
+    assert res.created == datetime(2023, 1, 1, 8, 0, 0)
+    assert res.sex == MALE
+    assert res.tags == ["escalade", "Boulot", "vélo"]
+    # the merged Persons are left untouched
+    assert person.tags == ["escalade", "Boulot"] and person.sex is None
+
+
+def test_relationship_key():
+    assert relationship_key(2, 1, copain_copine) == relationship_key(1, 2, copain_copine)
+    assert relationship_key(2, 1, parent_enfant) != relationship_key(1, 2, parent_enfant)
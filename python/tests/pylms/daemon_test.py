@@ -0,0 +1,173 @@
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from pylms import daemon
+from pylms.pylms import ExitPyLMS
+from pylms.daemon import DaemonCLI, send_frame, receive_frame, run_client, serve, OUTPUT, COMMAND, LOG, INPUT, END
+from pytest import fixture, mark, raises
+from unittest.mock import patch
+
+daemon_cli = DaemonCLI()
+
+
+def execute_command(args: list[str]) -> None:
+    print(f"Command {args}")
+    logging.getLogger("pylms.test").warning("Careful")
+    try:
+        print(f"Input {daemon_cli._input_or_exit_pylms()}")
+    except ExitPyLMS:
+        pass
+
+
+@fixture
+def socket_file(tmpdir):
+    socket_file_name = str(tmpdir.join(".pylmsd.sock"))
+    with patch("pylms.daemon.socket_file_name", socket_file_name):
+        yield socket_file_name
+
+
+@fixture
+def running_daemon(socket_file):
+    process = multiprocessing.get_context("fork").Process(target=serve, args=(daemon_cli, execute_command))
+    process.start()
+    while not os.path.exists(socket_file):
+        time.sleep(0.01)
+    yield process
+    process.terminate()
+    process.join()
+
+
+def test_frames():
+    left, right = socket.socketpair()
+    with left, right:
+        payload = "Élodie " * 1000
+        send_frame(left, OUTPUT, payload)
+        send_frame(left, COMMAND)
+
+        assert receive_frame(right) == (OUTPUT, payload)
+        assert receive_frame(right) == (COMMAND, "")
+
+        left.close()
+        with raises(EOFError):
+            receive_frame(right)
+
+
+def test_no_daemon(socket_file):
+    assert run_client(["john"]) is False
+
+    # left by a daemon which did not stop cleanly
+    with open(socket_file, "w"):
+        pass
+    assert run_client(["john"]) is False
+
+
+@patch("builtins.input")
+def test_command_is_executed_by_daemon(mock_input, running_daemon, capsys):
+    mock_input.return_value = "yes"
+
+    assert run_client(["create", "John"]) is True
+
+    captured = capsys.readouterr()
+    assert captured.out == "Command ['create', 'John']\nInput yes\n"
+    assert captured.err == "WARNING:pylms.test:Careful\n"
+
+
+@patch("builtins.print")
+@patch("builtins.input")
+def test_interrupted_client_cancels_command(mock_input, mock_print, running_daemon, capsys):
+    mock_input.side_effect = KeyboardInterrupt()
+
+    assert run_client(["update", "John"]) is True
+    mock_input.side_effect = None
+    mock_input.return_value = "again"
+    assert run_client(["update", "John"]) is True
+
+    assert capsys.readouterr().out == "Command ['update', 'John']\nCommand ['update', 'John']\nInput again\n"
+
+
+@patch("builtins.print")
+def test_serve_once(mock_print, running_daemon):
+    serve(daemon_cli, execute_command)
+
+    mock_print.assert_called_once_with(f"pylmsd is already running ({daemon.socket_file_name})")
+    assert running_daemon.is_alive()
+
+
+def _send_raw(data: bytes) -> None:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(daemon.socket_file_name)
+        connection.sendall(data)
+        connection.shutdown(socket.SHUT_WR)
+        connection.recv(1)
+
+
+@mark.parametrize(
+    "frame",
+    [
+        COMMAND + b"\x00\x00\x00\x01{",
+        COMMAND + b"\x00\x00\x00\x02\xff\xfe",
+        COMMAND + b"\x00\x00\x00\x04[42]",
+        COMMAND + b"\x00\x00\x00\x02{}",
+        OUTPUT + b"\x00\x00\x00\x02[]",
+        COMMAND + b"\x00\x00\x10\x00[",
+    ],
+)
+@patch("builtins.input")
+def test_invalid_frame_is_skipped(mock_input, frame, running_daemon, capsys):
+    mock_input.return_value = "yes"
+
+    _send_raw(frame)
+
+    assert running_daemon.is_alive()
+    assert run_client(["create", "John"]) is True
+    assert capsys.readouterr().out == "Command ['create', 'John']\nInput yes\n"
+
+
+def test_failing_command_does_not_stop_daemon(socket_file, capsys):
+    def fail(args: list[str]) -> None:
+        raise KeyError(args[0])
+
+    process = multiprocessing.get_context("fork").Process(target=serve, args=(daemon_cli, fail))
+    process.start()
+    while not os.path.exists(socket_file):
+        time.sleep(0.01)
+    try:
+        assert run_client(["create", "John"]) is True
+        assert run_client(["create", "John"]) is True
+        assert process.is_alive()
+    finally:
+        process.terminate()
+        process.join()
+
+
+@patch("pylms.daemon.input_timeout", 0.2)
+def test_client_not_answering_is_cancelled(socket_file, capsys):
+    process = multiprocessing.get_context("fork").Process(target=serve, args=(daemon_cli, execute_command))
+    process.start()
+    while not os.path.exists(socket_file):
+        time.sleep(0.01)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as waiting_client:
+            waiting_client.connect(socket_file)
+            send_frame(waiting_client, COMMAND, '["update", "John"]')
+            assert receive_frame(waiting_client) == (OUTPUT, "Command ['update', 'John']\n")
+            assert receive_frame(waiting_client)[0] == LOG
+            assert receive_frame(waiting_client)[0] == INPUT
+
+            # the next client is served once the waiting one is timed out
+            with patch("builtins.input", return_value="yes"):
+                assert run_client(["create", "John"]) is True
+
+            kind, payload = receive_frame(waiting_client)
+            assert (kind, payload) == (
+                LOG,
+                "ERROR:pylms.daemon:No input within 0.2 seconds, the command is cancelled.\n",
+            )
+            assert receive_frame(waiting_client) == (END, "")
+    finally:
+        process.terminate()
+        process.join()
+
+    assert capsys.readouterr().out == "Command ['create', 'John']\nInput yes\n"
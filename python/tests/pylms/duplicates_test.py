@@ -0,0 +1,69 @@
+from pylms.core import Person, Relationship, parent_enfant, copain_copine
+from pylms.duplicates import soundex, blocking_keys, candidate_pairs, find_duplicates
+from pytest import mark
+from unittest.mock import patch
+
+
+@mark.parametrize(
+    ("s", "expected"),
+    [("robert", "r163"), ("rupert", "r163"), ("ashcraft", "a261"), ("tymczak", "t522"), ("lee", "l000"), ("42", "")],
+)
+def test_soundex(s, expected):
+    assert soundex(s) == expected
+
+
+def test_blocking_keys():
+    assert blocking_keys(Person(1, "Jean", "Dupont")) == {"lastname:dup", "lastname-soundex:d153"}
+    assert blocking_keys(Person(2, "Élodie")) == {"firstname:elo", "firstname-soundex:e430"}
+
+
+def test_candidate_pairs():
+    persons = [
+        Person(1, "Jean", "Dupont"),
+        Person(2, "Jean", "Dupond"),
+        Person(3, "Jean", "Martin"),
+        Person(4, "Jeanne", "Dupuis"),
+        Person(5, "Jean", "Dupont"),
+    ]
+
+    assert candidate_pairs(persons) == {(1, 2), (1, 4), (1, 5), (2, 4), (2, 5), (4, 5)}
+    assert candidate_pairs(persons, max_block_size=2) == set()
+
+
+class TestFindDuplicates:
+    jean = Person(1, "Jean", "Dupont")
+    jean_bis = Person(2, "Jean", "Dupond")
+    jeanne = Person(3, "Jeanne", "Dupuis")
+    paul = Person(4, "Paul", "Dupont")
+    marie = Person(5, "Marie", "Curie")
+    persons = [jean, jean_bis, jeanne, paul, marie]
+
+    def test_similar_names(self):
+        assert [(p.person_id, o.person_id) for p, o, _ in find_duplicates(self.persons, [])] == [(1, 2)]
+
+    def test_tags_and_relationships_count(self):
+        jean = Person(1, "Jean", "Dupont")
+        jean.tags = ["escalade"]
+        jean_bis = Person(2, "Jean", "Dupond")
+        jean_bis.tags = ["Escalade"]
+        persons = [jean, jean_bis, self.marie]
+        (_, _, name_score), *_ = find_duplicates([self.jean, self.jean_bis], [], threshold=0.0)
+
+        (_, _, same_tags_score), *_ = find_duplicates(persons, [], threshold=0.0)
+        (_, _, other_relationships_score), *_ = find_duplicates(
+            persons, [Relationship(self.marie, jean, parent_enfant)], threshold=0.0
+        )
+
+        assert same_tags_score > name_score
+        assert other_relationships_score < same_tags_score
+
+    def test_related_persons_are_not_duplicates(self):
+        relationships = [Relationship(self.jean, self.jean_bis, copain_copine)]
+
+        assert find_duplicates(self.persons, relationships) == []
+
+    @patch("pylms.duplicates.PARALLEL_MIN_PAIRS", 1)
+    def test_parallel_scoring(self):
+        assert find_duplicates(self.persons, [], threshold=0.0, max_workers=2) == find_duplicates(
+            self.persons, [], threshold=0.0
+        )
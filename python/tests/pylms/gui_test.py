@@ -140,6 +140,15 @@ class TestEventListener(unittest.TestCase):
         with pytest.raises(RuntimeError, match="creating_link should not have been called"):
             self._under_test.creating_link(None, None, None)
 
+    @parameterized.expand(["deleting_persons", "tagging_persons", "untagging_persons"])
+    def test_bulk_events_not_supported(self, method):
+        with pytest.raises(RuntimeError, match=f"{method} should not have been called"):
+            getattr(self._under_test, method)(None, None)
+
+    def test_merging_person_not_supported(self):
+        with pytest.raises(RuntimeError, match="merging_person should not have been called"):
+            self._under_test.merging_person(None, None)
+
     def test_configured_from_alias_not_supported(self):
         with pytest.raises(RuntimeError, match="configured_from_alias should not have been called"):
             self._under_test.configured_from_alias(None, None)
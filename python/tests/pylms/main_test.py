@@ -1,6 +1,7 @@
 from unittest.mock import patch, call
 from pylms import __main__
-from pytest import fixture
+from pylms.pylms import ExitPyLMS
+from pytest import fixture, mark
 from random import randint
 from typing import ContextManager
 
@@ -215,3 +216,316 @@ def test_link_two_arguments(mock_link_persons, mock_print, two_arguments):
 
         mock_link_persons.assert_called_once_with(two_arguments[0] + " " + two_arguments[1])
         assert mock_print.call_count == 0
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.sqlite_storage.migrate_from_json", return_value=(3, 2))
+def test_migrate(mock_migrate, mock_print):
+    with mock_argv(["migrate"]):
+        __main__.main()
+
+        mock_migrate.assert_called_once_with()
+        mock_print.assert_called_once_with("Migrated 3 Persons and 2 Relationships to pylms.sqlite")
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.sqlite_storage.migrate_from_json")
+def test_migrate_too_many_arguments(mock_migrate, mock_print, one_argument):
+    with mock_argv(["migrate"] + one_argument):
+        __main__.main()
+
+        assert mock_migrate.call_count == 0
+        mock_print.assert_called_once_with("Too many arguments (1)")
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.find_relationship_path")
+def test_path_one_argument(mock_find_relationship_path, mock_print, one_argument):
+    with mock_argv(["path"] + one_argument):
+        __main__.main()
+
+        assert mock_find_relationship_path.call_count == 0
+        mock_print.assert_called_once_with("Too few arguments (1)")
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.find_relationship_path")
+def test_path_two_arguments(mock_find_relationship_path, mock_print, two_arguments):
+    with mock_argv(["path"] + two_arguments):
+        __main__.main()
+
+        mock_find_relationship_path.assert_called_once_with(
+            left_person_pattern=two_arguments[0], right_person_pattern=two_arguments[1]
+        )
+        assert mock_print.call_count == 0
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.find_relationship_path")
+def test_path_more_than_two_arguments(mock_find_relationship_path, mock_print, more_than_two_arguments):
+    with mock_argv(["path"] + more_than_two_arguments):
+        __main__.main()
+
+        assert mock_find_relationship_path.call_count == 0
+        mock_print.assert_called_once_with(f"Too many arguments ({len(more_than_two_arguments)})")
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.find_common_ancestors")
+def test_ancestors_two_arguments(mock_find_common_ancestors, mock_print, two_arguments):
+    with mock_argv(["ancestors"] + two_arguments):
+        __main__.main()
+
+        mock_find_common_ancestors.assert_called_once_with(
+            left_person_pattern=two_arguments[0], right_person_pattern=two_arguments[1]
+        )
+        assert mock_print.call_count == 0
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.find_common_ancestors")
+def test_ancestors_one_argument(mock_find_common_ancestors, mock_print, one_argument):
+    with mock_argv(["ancestors"] + one_argument):
+        __main__.main()
+
+        assert mock_find_common_ancestors.call_count == 0
+        mock_print.assert_called_once_with("Too few arguments (1)")
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.show_stats")
+def test_stats(mock_show_stats, mock_print):
+    with mock_argv(["stats"]):
+        __main__.main()
+
+        mock_show_stats.assert_called_once_with()
+        assert mock_print.call_count == 0
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.list_clusters")
+def test_clusters(mock_list_clusters, mock_print):
+    with mock_argv(["clusters"]):
+        __main__.main()
+
+        mock_list_clusters.assert_called_once_with()
+        assert mock_print.call_count == 0
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.list_clusters")
+def test_clusters_too_many_arguments(mock_list_clusters, mock_print, one_argument):
+    with mock_argv(["clusters"] + one_argument):
+        __main__.main()
+
+        assert mock_list_clusters.call_count == 0
+        mock_print.assert_called_once_with("Too many arguments (1)")
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.find_duplicates")
+def test_duplicates(mock_find_duplicates, mock_print):
+    with mock_argv(["duplicates"]):
+        __main__.main()
+
+        mock_find_duplicates.assert_called_once_with()
+        assert mock_print.call_count == 0
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.merge_person")
+def test_merge_two_arguments(mock_merge_person, mock_print, two_arguments):
+    with mock_argv(["merge"] + two_arguments):
+        __main__.main()
+
+        mock_merge_person.assert_called_once_with(pattern=two_arguments[0], merged_person_pattern=two_arguments[1])
+        assert mock_print.call_count == 0
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.merge_person")
+def test_merge_too_many_arguments(mock_merge_person, mock_print, more_than_two_arguments):
+    with mock_argv(["merge"] + more_than_two_arguments):
+        __main__.main()
+
+        assert mock_merge_person.call_count == 0
+        mock_print.assert_called_once_with(f"Too many arguments ({len(more_than_two_arguments)})")
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.delete_persons")
+def test_delete_all(mock_delete_persons, mock_print, two_arguments):
+    with mock_argv(["delete-all"] + two_arguments):
+        __main__.main()
+
+        mock_delete_persons.assert_called_once_with(" ".join(two_arguments))
+        assert mock_print.call_count == 0
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.delete_persons")
+def test_delete_all_no_argument(mock_delete_persons, mock_print):
+    with mock_argv(["delete-all"]):
+        __main__.main()
+
+        assert mock_delete_persons.call_count == 0
+        mock_print.assert_called_once_with("Too few arguments (0)")
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.untag_persons")
+@patch("pylms.__main__.tag_persons")
+@mark.parametrize("command", ["tag", "untag"])
+def test_tag(mock_tag_persons, mock_untag_persons, mock_print, command):
+    with mock_argv([command, "famille", "fils", "de", "John"]):
+        __main__.main()
+
+        mock_tag_command = mock_tag_persons if command == "tag" else mock_untag_persons
+        mock_tag_command.assert_called_once_with("famille", "fils de John")
+        assert mock_print.call_count == 0
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.tag_persons")
+def test_tag_one_argument(mock_tag_persons, mock_print, one_argument):
+    with mock_argv(["tag"] + one_argument):
+        __main__.main()
+
+        assert mock_tag_persons.call_count == 0
+        mock_print.assert_called_once_with("Too few arguments (1)")
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.link_persons")
+@patch("pylms.__main__.store_person")
+def test_batch(mock_store_person, mock_link_persons, mock_print, tmpdir):
+    script = tmpdir.join("script.txt")
+    script.write("# family\n" "\n" "create John Doe\n" "pylms create 'Tony Doe'  # quoted\n" "link John père de Tony\n")
+    with mock_argv(["--batch", str(script)]), patch("pylms.__main__.unit_of_work") as mock_unit_of_work:
+        __main__.main()
+
+        mock_unit_of_work.assert_called_once_with()
+        mock_store_person.assert_has_calls([call(firstname="John", lastname="Doe"), call(firstname="Tony Doe")])
+        mock_link_persons.assert_called_once_with("John père de Tony")
+        assert mock_print.call_count == 0
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.store_person")
+def test_batch_reports_failing_lines_and_goes_on(mock_store_person, mock_print, tmpdir):
+    script = tmpdir.join("script.txt")
+    script.write("create John\n--batch other.txt\ncreate Tony\n")
+    mock_store_person.side_effect = [ValueError("boom"), None]
+    with mock_argv(["--batch", str(script)]), patch("pylms.__main__.unit_of_work") as mock_unit_of_work:
+        __main__.main()
+
+        mock_store_person.assert_has_calls([call(firstname="John"), call(firstname="Tony")])
+        # the changes of the failing lines are discarded
+        repository = mock_unit_of_work.return_value.__enter__.return_value
+        assert repository.savepoint.call_count == 3
+        assert repository.rollback.call_count == 2
+        mock_print.assert_has_calls(
+            [call("Line 1: boom"), call("Line 2: Batches can't be nested"), call("2 commands failed")]
+        )
+        assert mock_print.call_count == 3
+
+
+@patch("builtins.print")
+def test_batch_no_such_file(mock_print, tmpdir):
+    with mock_argv(["--batch", str(tmpdir.join("missing.txt"))]):
+        __main__.main()
+
+        mock_print.assert_called_once_with(f"No such file: {tmpdir.join('missing.txt')}")
+
+
+@patch("builtins.print")
+@patch("pylms.__main__._execute_batch")
+def test_batch_too_many_arguments(mock_execute_batch, mock_print, two_arguments):
+    with mock_argv(["--batch"] + two_arguments):
+        __main__.main()
+
+        assert mock_execute_batch.call_count == 0
+        mock_print.assert_called_once_with("Too many arguments (2)")
+
+
+@patch("pylms.__main__.readline", None)
+@patch("builtins.print")
+@patch("pylms.__main__.resident_unit_of_work")
+@patch("pylms.__main__.search_persons")
+@patch("pylms.__main__.store_person")
+def test_shell(mock_store_person, mock_search_persons, mock_resident_unit_of_work, mock_print):
+    lines = ["create John Doe", "", "# comment", "pylms john", "migrate", "create Tony", "exit", "create Paul"]
+    mock_store_person.side_effect = [None, ValueError("boom")]
+    with mock_argv(["shell"]), patch("builtins.input", side_effect=lines):
+        __main__.main()
+
+        mock_store_person.assert_has_calls([call(firstname="John", lastname="Doe"), call(firstname="Tony")])
+        assert mock_store_person.call_count == 2
+        mock_search_persons.assert_called_once_with("john")
+        # a resident unit of work per command
+        assert mock_resident_unit_of_work.call_count == 3
+        assert [str(c.args[0]) for c in mock_print.call_args_list[1:]] == [
+            "migrate can't be run from the shell",
+            "boom",
+        ]
+
+
+@patch("pylms.__main__.readline", None)
+@patch("builtins.print")
+@patch("pylms.__main__.resident_unit_of_work")
+@patch("pylms.__main__.store_person")
+def test_shell_ctrl_c_and_ctrl_d(mock_store_person, mock_resident_unit_of_work, mock_print):
+    lines = [KeyboardInterrupt(), "create John", "create Tony", EOFError()]
+    mock_store_person.side_effect = [ExitPyLMS(), None]
+    with mock_argv(["shell"]), patch("builtins.input", side_effect=lines):
+        __main__.main()
+
+        mock_store_person.assert_has_calls([call(firstname="John"), call(firstname="Tony")])
+        mock_print.assert_any_call("Canceled")
+
+
+@patch("builtins.print")
+@patch("pylms.__main__._execute_shell")
+def test_shell_too_many_arguments(mock_execute_shell, mock_print, one_argument):
+    with mock_argv(["shell"] + one_argument):
+        __main__.main()
+
+        assert mock_execute_shell.call_count == 0
+        mock_print.assert_called_once_with("Too many arguments (1)")
+
+
+@patch("pylms.__main__.resident_unit_of_work")
+@patch("pylms.__main__.complete_person_name")
+def test_complete(mock_complete_person_name, mock_resident_unit_of_work):
+    mock_complete_person_name.return_value = ["Jean", "Jeanne"]
+
+    assert [__main__._complete("je", state) for state in range(3)] == ["Jean", "Jeanne", None]
+
+    mock_complete_person_name.assert_called_once_with("je")
+
+
+@patch("pylms.__main__.list_persons")
+@patch("pylms.__main__.daemon.run_client")
+def test_main_through_daemon(mock_run_client, mock_list_persons, two_arguments):
+    mock_run_client.return_value = True
+    with mock_argv(two_arguments):
+        __main__.main()
+
+        mock_run_client.assert_called_once_with(two_arguments)
+        assert mock_list_persons.call_count == 0
+
+
+@patch("builtins.print")
+@patch("pylms.__main__.resident_unit_of_work")
+@patch("pylms.__main__.store_person")
+def test_daemon_command(mock_store_person, mock_resident_unit_of_work, mock_print):
+    mock_store_person.side_effect = [None, ExitPyLMS(), ValueError("boom")]
+
+    __main__._execute_daemon_command(["create", "John"])
+    __main__._execute_daemon_command(["create", "Tony"])
+    __main__._execute_daemon_command(["create", "Paul"])
+    __main__._execute_daemon_command(["shell"])
+
+    assert mock_store_person.call_count == 3
+    assert mock_resident_unit_of_work.call_count == 3
+    assert [str(c.args[0]) for c in mock_print.call_args_list] == ["boom", "shell can't be run while pylmsd is running"]
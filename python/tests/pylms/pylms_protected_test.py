@@ -1,25 +1,28 @@
 from pylms.core import Person
 from pylms.core import RelationshipDefinition, RelationshipAlias
-from pylms.pylms import _search_persons, _select_person
-from pylms.pylms import _parse_nl_link_request
+from pylms.pylms import _search_persons, _select_person, unit_of_work
+from pylms.pylms import _parse_nl_link_request, _parse_search_request
 from pytest import mark
 from unittest.mock import patch, call
 
 
-@patch("pylms.pylms.storage")
-def test_search_persons(mock_storage):
+@patch("pylms.storage.read_persons")
+def test_search_persons(mock_read_persons):
     persons = [
         Person(3, "Bob"),
         Person(1, "Seb"),
         Person(2, "MarioEb"),
     ]
-    mock_storage.read_persons.return_value = persons
+    mock_read_persons.return_value = persons
 
-    assert _search_persons("bob") == [persons[0]]
-    assert _search_persons("BOB") == [persons[0]]
-    assert _search_persons("eb") == [persons[1], persons[2]]
-    assert _search_persons("bob") == [persons[0]]
-    assert _search_persons("foo") == []
+    with unit_of_work():
+        assert _search_persons("bob") == [persons[0]]
+        assert _search_persons("BOB") == [persons[0]]
+        assert _search_persons("eb") == [persons[1], persons[2]]
+        assert _search_persons("bob") == [persons[0]]
+        assert _search_persons("foo") == []
+
+    mock_read_persons.assert_called_once_with()
 
 
 class Test_select_person:
@@ -141,3 +144,61 @@ class Test_parse_nl_link_request:
     @mark.parametrize("nl_request", ["aaa acme", "aaa", " aaa ", "fooaaa", "foo aaa"])
     def test_return_none_if_missing_person_patterns(self, nl_request):
         assert _parse_nl_link_request(nl_request) is None
+
+
+@patch("pylms.pylms.logger")
+def test_parse_nl_link_request_rejects_derived_relationship(mock_logger):
+    assert _parse_nl_link_request("Paul frère de Tony") is None
+
+    mock_logger.error.assert_called_once_with(
+        "Unsupported link request: frère de is derived from parent/enfant de links"
+    )
+
+
+class Test_find_relationship_pattern:
+    parent = RelationshipDefinition(
+        name="parent", aliases=[RelationshipAlias("parent de"), RelationshipAlias("grand parent de")]
+    )
+    ami = RelationshipDefinition(name="ami", aliases=[RelationshipAlias("ami de")])
+
+    @patch("pylms.pylms.relationship_definitions", [parent, ami])
+    def test_longest_alias_wins(self):
+        link_request = _parse_nl_link_request("Paul grand parent de Tom")
+
+        assert link_request.alias == self.parent.aliases[1]
+        assert link_request.left_person_pattern == "paul"
+        assert link_request.right_person_pattern == "tom"
+
+    @patch("pylms.pylms.relationship_definitions", [parent, ami])
+    def test_leftmost_alias_wins(self):
+        link_request = _parse_nl_link_request("Paul ami de Tom parent de Jim")
+
+        assert link_request.alias == self.ami.aliases[0]
+        assert link_request.left_person_pattern == "paul"
+        assert link_request.right_person_pattern == "tom parent de jim"
+
+
+class Test_parse_search_request:
+    parent = Test_find_relationship_pattern.parent
+    ami = Test_find_relationship_pattern.ami
+
+    @patch("pylms.pylms.relationship_definitions", [parent, ami])
+    def test_chained_aliases(self):
+        search_request = _parse_search_request("ami de grand parent de Tom")
+
+        assert search_request.relationships == [(self.ami, self.ami.aliases[0]), (self.parent, self.parent.aliases[1])]
+        assert search_request.pattern == "tom"
+
+    @patch("pylms.pylms.relationship_definitions", [parent, ami])
+    def test_chain_stops_at_prefix(self):
+        search_request = _parse_search_request("ami de Tom parent de Jim")
+
+        assert search_request.relationships == [(self.ami, self.ami.aliases[0])]
+        assert search_request.pattern == "tom parent de jim"
+
+    @patch("pylms.pylms.logger")
+    @patch("pylms.pylms.relationship_definitions", [parent, ami])
+    def test_prefix_before_first_alias(self, mock_logger):
+        assert _parse_search_request("Tom ami de parent de Jim") is None
+
+        mock_logger.error.assert_called_once_with("Unsupported relationship search request has prefix: tom ")
@@ -1,18 +1,26 @@
+import multiprocessing
 import pylms.core
+import pylms.pylms
+import pylms.python_utils
+from pylms import storage, sqlite_storage
 from pylms.core import Person
 from pylms.pylms import list_persons, store_person, update_person, search_persons, delete_person, link_persons
+from pylms.pylms import unit_of_work, find_relationship_path, find_common_ancestors, list_clusters, show_stats
+from pylms.pylms import find_duplicates, merge_person, delete_persons, tag_persons, untag_persons
+from pylms.pylms import resident_unit_of_work, complete_person_name
 from pylms.pylms import LinkRequest, Relationship, RelationshipDefinition, RelationshipAlias
 from pylms.core import parent_enfant, copain_copine, MALE, FEMALE
+from pylms.storage import ADD_PERSON, UPDATE_PERSON, DELETE_PERSON, ADD_RELATIONSHIP, MERGE_PERSON
 from unittest.mock import patch, call
-from pytest import mark
+from pytest import mark, raises
 
 
 class TestStorePerson:
 
     @patch("builtins.print")
-    @patch("pylms.pylms.storage.read_persons")
-    @patch("pylms.pylms.storage.store_persons")
-    def test_no_existing_person(self, mock_store_persons, mock_read_persons, mock_print):
+    @patch("pylms.storage.read_persons")
+    @patch("pylms.pylms.storage.apply_changes")
+    def test_no_existing_person(self, mock_apply_changes, mock_read_persons, mock_print):
         firstname = "John"
         lastname = "Doe"
         mock_read_persons.return_value = []
@@ -21,15 +29,14 @@ class TestStorePerson:
 
         mock_read_persons.assert_called_with()
         assert mock_read_persons.call_count == 1
-        mock_store_persons.assert_called_with([Person(0, firstname=firstname, lastname=lastname)])
-        assert mock_store_persons.call_count == 1
+        mock_apply_changes.assert_called_once_with([(ADD_PERSON, Person(0, firstname=firstname, lastname=lastname))])
         mock_print.assert_called_with(f"Create Person {firstname} {lastname}.")
         assert mock_print.call_count == 1
 
     @patch("builtins.print")
-    @patch("pylms.pylms.storage.read_persons")
-    @patch("pylms.pylms.storage.store_persons")
-    def test_only_firstname_and_add_to_existing_persons(self, mock_store_persons, mock_read_persons, mock_print):
+    @patch("pylms.storage.read_persons")
+    @patch("pylms.pylms.storage.apply_changes")
+    def test_only_firstname_and_add_to_existing_persons(self, mock_apply_changes, mock_read_persons, mock_print):
         firstname = "Mike"
         lastname = "Jagger"
         persons = [Person(7, "Richard", "Brownsome")]
@@ -40,15 +47,14 @@ class TestStorePerson:
 
         mock_read_persons.assert_called_with()
         assert mock_read_persons.call_count == 1
-        mock_store_persons.assert_called_with([Person(8, firstname=firstname, lastname=lastname)] + persons)
-        assert mock_store_persons.call_count == 1
+        mock_apply_changes.assert_called_once_with([(ADD_PERSON, Person(8, firstname=firstname, lastname=lastname))])
         mock_print.assert_called_with(f"Create Person {firstname} {lastname}.")
         assert mock_print.call_count == 1
 
     @patch("builtins.print")
-    @patch("pylms.pylms.storage.read_persons")
-    @patch("pylms.pylms.storage.store_persons")
-    def test_only_firstname_no_existing_person(self, mock_store_persons, mock_read_persons, mock_print):
+    @patch("pylms.storage.read_persons")
+    @patch("pylms.pylms.storage.apply_changes")
+    def test_only_firstname_no_existing_person(self, mock_apply_changes, mock_read_persons, mock_print):
         firstname = "John"
         mock_read_persons.return_value = []
 
@@ -56,15 +62,14 @@ class TestStorePerson:
 
         mock_read_persons.assert_called_with()
         assert mock_read_persons.call_count == 1
-        mock_store_persons.assert_called_with([Person(person_id=0, firstname=firstname)])
-        assert mock_store_persons.call_count == 1
+        mock_apply_changes.assert_called_once_with([(ADD_PERSON, Person(person_id=0, firstname=firstname))])
         mock_print.assert_called_with(f"Create Person {firstname}.")
         assert mock_print.call_count == 1
 
     @patch("builtins.print")
-    @patch("pylms.pylms.storage.read_persons")
-    @patch("pylms.pylms.storage.store_persons")
-    def test_only_firstname_and_add_to_existing_persons(self, mock_store_persons, mock_read_persons, mock_print):
+    @patch("pylms.storage.read_persons")
+    @patch("pylms.pylms.storage.apply_changes")
+    def test_only_firstname_and_add_to_existing_persons(self, mock_apply_changes, mock_read_persons, mock_print):
         firstname = "John"
         persons = [Person(2, "Paul", "Valérie")]
 
@@ -74,8 +79,7 @@ class TestStorePerson:
 
         mock_read_persons.assert_called_with()
         assert mock_read_persons.call_count == 1
-        mock_store_persons.assert_called_with([Person(3, firstname=firstname)] + persons)
-        assert mock_store_persons.call_count == 1
+        mock_apply_changes.assert_called_once_with([(ADD_PERSON, Person(3, firstname=firstname))])
         mock_print.assert_called_with(f"Create Person {firstname}.")
         assert mock_print.call_count == 1
 
@@ -128,6 +132,7 @@ class TestUpdatePerson:
 
         mock_select.assert_called_once_with("p")
         assert mock_storage.call_count == 0
+        assert mock_storage.apply_changes.call_count == 0
 
     @patch("pylms.pylms.storage")
     @patch("pylms.pylms.ios.update_person")
@@ -142,7 +147,7 @@ class TestUpdatePerson:
 
         mock_select.assert_called_once_with("p")
         mock_update_person.assert_called_once_with(person)
-        mock_storage.update_person.assert_called_once_with(updated_person)
+        mock_storage.apply_changes.assert_called_once_with([(UPDATE_PERSON, updated_person)])
 
     @patch("pylms.pylms.storage")
     @patch("pylms.pylms.ios.update_person")
@@ -157,7 +162,7 @@ class TestUpdatePerson:
 
         mock_select.assert_called_once_with("p")
         mock_update_person.assert_called_once_with(person2)
-        mock_storage.update_person.assert_called_once_with(updated_person)
+        mock_storage.apply_changes.assert_called_once_with([(UPDATE_PERSON, updated_person)])
 
 
 class TestDeletePerson:
@@ -170,7 +175,7 @@ class TestDeletePerson:
         person2 = Person(2, "foo", "bar")
         person3 = Person(3, "foo", "bar")
         mock_select.return_value = person3
-        mock_storage.read_persons.return_value = [person3, person2, person1]
+        mock_storage.read_persons.return_value = [person1, person2, person3]
         mock_storage.read_relationships.return_value = []
 
         delete_person("p")
@@ -178,10 +183,10 @@ class TestDeletePerson:
         mock_select.assert_called_once_with("p")
         mock_events.deleting_person.assert_called_once_with(person3)
         assert mock_events.deleting_relationship.call_count == 0
-        mock_storage.read_persons.assert_called_once_with()
-        mock_storage.read_relationships.assert_called_once_with([person3, person2, person1])
-        mock_storage.store_persons.assert_called_once_with([person2, person1])
-        mock_storage.store_relationships.assert_called_once_with([])
+        mock_storage.read_relationships.assert_called_once_with([person1, person2, person3])
+        mock_storage.apply_changes.assert_called_once_with([(DELETE_PERSON, person3)])
+        assert mock_storage.store_persons.call_count == 0
+        assert mock_storage.store_relationships.call_count == 0
 
     @patch("pylms.pylms.storage")
     @patch("pylms.pylms.events")
@@ -197,18 +202,17 @@ class TestDeletePerson:
         rl3 = Relationship(person2, person3, rld1)
         rl4 = Relationship(person3, person2, rld2)
         mock_select.return_value = person3
-        mock_storage.read_persons.return_value = [person3, person2, person1]
-        mock_storage.read_relationships.return_value = [rl4, rl2, rl3, rl1]
+        mock_storage.read_persons.return_value = [person1, person2, person3]
+        mock_storage.read_relationships.return_value = [rl1, rl2, rl4, rl3]
 
         delete_person("p")
 
         mock_select.assert_called_once_with("p")
         mock_events.deleting_person.assert_called_once_with(person3)
-        mock_events.deleting_relationship.has_calls([call(rl4, person3), call(rl3, person3)])
-        mock_storage.read_persons.assert_called_once_with()
-        mock_storage.read_relationships.assert_called_once_with([person3, person2, person1])
-        mock_storage.store_persons.assert_called_once_with([person2, person1])
-        mock_storage.store_relationships.assert_called_once_with([rl2, rl1])
+        mock_events.deleting_relationship.assert_has_calls([call(rl4, person3), call(rl3, person3)])
+        assert mock_events.deleting_relationship.call_count == 2
+        mock_storage.read_relationships.assert_called_once_with([person1, person2, person3])
+        mock_storage.apply_changes.assert_called_once_with([(DELETE_PERSON, person3)])
 
     @patch("builtins.print")
     @patch("pylms.pylms.storage")
@@ -225,9 +229,77 @@ class TestDeletePerson:
         assert mock_events.deleting_person.call_count == 0
         assert mock_events.deleting_relationship.call_count == 0
         assert mock_storage.call_count == 0
+        assert mock_storage.apply_changes.call_count == 0
         assert mock_print.call_count == 0
 
 
+@patch("pylms.pylms.storage")
+@patch("pylms.pylms.events")
+@patch("pylms.pylms.logger")
+class TestBulkChanges:
+    rld = RelationshipDefinition("rld")
+
+    @staticmethod
+    def _persons() -> list[Person]:
+        person1 = Person(1, "Jean", "Dupont")
+        person1.tags = ["Famille"]
+        person2 = Person(2, "Paul", "Dupont")
+        person3 = Person(3, "Marie", "Curie")
+        return [person1, person2, person3]
+
+    def test_delete_persons(self, mock_logger, mock_events, mock_storage):
+        person1, person2, person3 = persons = self._persons()
+        rl1 = Relationship(person1, person2, self.rld)
+        rl2 = Relationship(person2, person3, self.rld)
+        mock_storage.read_persons.return_value = persons
+        mock_storage.read_relationships.return_value = [rl1, rl2]
+
+        delete_persons("dupont")
+
+        mock_events.deleting_persons.assert_called_once_with([person1, person2], [rl1, rl2])
+        assert mock_events.deleting_person.call_count == 0
+        mock_storage.apply_changes.assert_called_once_with([(DELETE_PERSON, person1), (DELETE_PERSON, person2)])
+
+    def test_delete_persons_no_match(self, mock_logger, mock_events, mock_storage):
+        mock_storage.read_persons.return_value = self._persons()
+
+        delete_persons("foo")
+
+        mock_logger.info.assert_called_once_with('No match for "foo".')
+        assert mock_events.deleting_persons.call_count == 0
+        assert mock_storage.apply_changes.call_count == 0
+
+    def test_tag_persons(self, mock_logger, mock_events, mock_storage):
+        person1, person2, person3 = self._persons()
+        mock_storage.read_persons.return_value = [person1, person2, person3]
+
+        tag_persons("famille", "dupont")
+
+        # Jean Dupont already has the tag
+        mock_events.tagging_persons.assert_called_once_with([person2], "famille")
+        assert person2.tags == ["famille"]
+        mock_storage.apply_changes.assert_called_once_with([(UPDATE_PERSON, person2)])
+
+    def test_untag_persons(self, mock_logger, mock_events, mock_storage):
+        person1, person2, person3 = self._persons()
+        mock_storage.read_persons.return_value = [person1, person2, person3]
+
+        untag_persons("FAMILLE", "dupont")
+
+        mock_events.untagging_persons.assert_called_once_with([person1], "FAMILLE")
+        assert person1.tags == []
+        mock_storage.apply_changes.assert_called_once_with([(UPDATE_PERSON, person1)])
+
+    def test_untag_persons_without_tag(self, mock_logger, mock_events, mock_storage):
+        mock_storage.read_persons.return_value = self._persons()
+
+        untag_persons("famille", "curie")
+
+        mock_logger.info.assert_called_once_with('No Person matching "curie" has tag "famille".')
+        assert mock_events.untagging_persons.call_count == 0
+        assert mock_storage.apply_changes.call_count == 0
+
+
 relationship_definition_1 = RelationshipDefinition("22", aliases=[RelationshipAlias("22a")])
 person_1 = Person(person_id=1, firstname="Jane")
 person_2 = Person(person_id=2, firstname="Tarzan")
@@ -252,11 +324,10 @@ class TestLinkPerson:
 
     @patch("pylms.pylms.storage")
     @patch("pylms.pylms.events")
-    @patch.object(
-        relationship_definition_1.aliases[0], "to_relationship_definition_direction", return_value=(person_5, person_6)
-    )
-    @patch.object(relationship_definition_1.aliases[0], "configure_right_person", return_value=person_4)
-    @patch.object(relationship_definition_1.aliases[0], "configure_left_person", return_value=person_3)
+    # RelationshipAlias has __slots__: methods can only be patched on the class
+    @patch.object(RelationshipAlias, "to_relationship_definition_direction", return_value=(person_5, person_6))
+    @patch.object(RelationshipAlias, "configure_right_person", return_value=person_4)
+    @patch.object(RelationshipAlias, "configure_left_person", return_value=person_3)
     @patch("pylms.pylms._select_person", side_effect=[person_1, person_2])
     @patch(
         "pylms.pylms._parse_nl_link_request",
@@ -277,8 +348,6 @@ class TestLinkPerson:
         mock_events,
         mock_storage,
     ):
-        mock_storage.read_persons.return_value = []
-
         request = "p"
 
         assert link_persons(request) is None
@@ -290,8 +359,9 @@ class TestLinkPerson:
         mock_events.configured_from_alias.has_calls([call(person_3), call(person_4)])
         mock_to_rld_direction.assert_called_once_with(left_person=person_3, right_person=person_4)
         mock_events.creating_link.assert_called_once_with(relationship_definition_1, person_5, person_6)
-        mock_storage.read_persons.assert_called_once_with()
-        mock_storage.read_relationships.assert_called_once_with([])
+        assert mock_storage.read_persons.call_count == 0
+        assert mock_storage.read_relationships.call_count == 0
+        assert mock_storage.store_relationships.call_count == 0
 
         class ExpectedRelationship:
             def __eq__(self, other: Relationship):
@@ -299,11 +369,15 @@ class TestLinkPerson:
                     other.left == person_5 and other.right == person_6 and other.definition == relationship_definition_1
                 )
 
-        mock_storage.store_relationships([ExpectedRelationship()])
+        # updated persons and the relationship are written at once
+        mock_storage.apply_changes.assert_called_once_with(
+            [(UPDATE_PERSON, person_3), (UPDATE_PERSON, person_4), (ADD_RELATIONSHIP, ExpectedRelationship())]
+        )
 
 
 @patch("pylms.pylms.ios")
-@patch("pylms.pylms.storage")
+@patch("pylms.storage.read_relationships")
+@patch("pylms.storage.read_persons")
 @patch("pylms.pylms.logger")
 class TestSearchPersonByFirstNameLastName:
     john = Person(person_id=1, firstname="John", lastname="Doe")
@@ -327,9 +401,11 @@ class TestSearchPersonByFirstNameLastName:
             ("dOe", [(john, [])]),
         ],
     )
-    def test_search_is_case_insensitive(self, mock_logger, mock_storage, mock_ios, search_request, expected):
-        mock_storage.read_persons.return_value = self.persons
-        mock_storage.read_relationships.return_value = self.relationships
+    def test_search_is_case_insensitive(
+        self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios, search_request, expected
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
 
         search_persons(search_request)
 
@@ -347,9 +423,11 @@ class TestSearchPersonByFirstNameLastName:
             ),
         ],
     )
-    def test_search_is_partial(self, mock_logger, mock_storage, mock_ios, search_request, expected):
-        mock_storage.read_persons.return_value = self.persons
-        mock_storage.read_relationships.return_value = self.relationships
+    def test_search_is_partial(
+        self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios, search_request, expected
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
 
         search_persons(search_request)
 
@@ -360,14 +438,18 @@ class TestSearchPersonByFirstNameLastName:
         ("search_request", "expected"),
         [
             ("Cârine", [(carine, [])]),
-            ("Carine", []),
+            ("Carine", [(carine, [])]),
             ("Beurè", [(bill, [])]),
-            ("Beure", []),
+            ("Beure", [(bill, [])]),
+            ("BEURÉ", [(bill, [])]),
+            ("Beurre", []),
         ],
     )
-    def test_is_accent_sensitive(self, mock_logger, mock_storage, mock_ios, search_request, expected):
-        mock_storage.read_persons.return_value = self.persons
-        mock_storage.read_relationships.return_value = self.relationships
+    def test_is_accent_insensitive(
+        self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios, search_request, expected
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
 
         search_persons(search_request)
 
@@ -380,7 +462,59 @@ class TestSearchPersonByFirstNameLastName:
 
 
 @patch("pylms.pylms.ios")
-@patch("pylms.pylms.storage")
+@patch("pylms.storage.read_relationships")
+@patch("pylms.storage.read_persons")
+@patch("pylms.pylms.logger")
+class TestSearchPersonByTagQuery:
+    john = Person(person_id=1, firstname="John", lastname="Doe")
+    john.tags = ["cours d'escalade", "Boulot"]
+    peter = Person(person_id=2, firstname="Peter")
+    peter.tags = ["escalade"]
+    emma = Person(person_id=3, firstname="Emma")
+    emma.tags = ["collègues"]
+    tom = Person(person_id=4, firstname="Tom")
+    persons = [john, peter, emma, tom]
+
+    @mark.parametrize(
+        ("search_request", "expected"),
+        [
+            ("escalade & !boulot", [(peter, [])]),
+            ("Escalade&Boulot", [(john, [])]),
+            ("escalade | collègues", [(john, []), (peter, []), (emma, [])]),
+            ("!escalade", [(emma, []), (tom, [])]),
+            ("!(escalade | collègues) | boulot", [(john, []), (tom, [])]),
+        ],
+    )
+    def test_search_tag_query(
+        self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios, search_request, expected
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = []
+
+        search_persons(search_request)
+
+        assert mock_logger.info.call_count == 0
+        mock_ios.list_persons.assert_called_once_with(expected)
+
+    def test_no_match(self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios):
+        mock_read_persons.return_value = self.persons
+
+        search_persons("escalade & collègues")
+
+        mock_logger.info.assert_called_once_with('No match for "escalade & collègues".')
+        assert mock_ios.list_persons.call_count == 0
+
+    def test_invalid_tag_query(self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios):
+        search_persons("escalade & (boulot")
+
+        mock_logger.error.assert_called_once_with("Unsupported tag search request: Unexpected end of tag query")
+        assert mock_read_persons.call_count == 0
+        assert mock_ios.list_persons.call_count == 0
+
+
+@patch("pylms.pylms.ios")
+@patch("pylms.storage.read_relationships")
+@patch("pylms.storage.read_persons")
 @patch("pylms.pylms.logger")
 class TestSearchPersonByRelationship:
     john = Person(person_id=1, firstname="John", lastname="Doe")
@@ -419,11 +553,19 @@ class TestSearchPersonByRelationship:
                 "parent de bill",
                 [(dona, [relationships[4]]), (elmer, [relationships[5]]), (princess, [relationships[6]])],
             ),
+            ("fille de parent de peter", [(emma, [relationships[1], relationships[2]])]),
+            (
+                "enfant de parent de emma",
+                [(peter, [relationships[0]]), (emma, [relationships[1], relationships[2]]), (tom, [relationships[3]])],
+            ),
+            ("parent de fils de John", [(john, [relationships[0], relationships[1], relationships[3]])]),
         ],
     )
-    def test_search_by_relationship_successful(self, mock_logger, mock_storage, mock_ios, search_request, expected):
-        mock_storage.read_persons.return_value = self.persons
-        mock_storage.read_relationships.return_value = self.relationships
+    def test_search_by_relationship_successful(
+        self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios, search_request, expected
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
 
         search_persons(search_request)
 
@@ -432,11 +574,23 @@ class TestSearchPersonByRelationship:
 
     @mark.parametrize(
         "search_request",
-        ["père de emma", "mère de peter", "parent de carine", "fils de Elmer", "fils de Dona", "fils de princess"],
+        [
+            "père de emma",
+            "mère de peter",
+            "parent de carine",
+            "fils de Elmer",
+            "fils de Dona",
+            "fils de princess",
+            "fils de parent de bill",
+            "père de fils de John",
+            "parent de parent de carine",
+        ],
     )
-    def test_no_matching_relationship(self, mock_logger, mock_storage, mock_ios, search_request):
-        mock_storage.read_persons.return_value = self.persons
-        mock_storage.read_relationships.return_value = self.relationships
+    def test_no_matching_relationship(
+        self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios, search_request
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
 
         search_persons(search_request)
 
@@ -450,9 +604,11 @@ class TestSearchPersonByRelationship:
             "mere de bill",  # alias is not yet matched regardless of accentuated chars
         ],
     )
-    def test_no_relationship_found_in_request(self, mock_logger, mock_storage, mock_ios, search_request):
-        mock_storage.read_persons.return_value = self.persons
-        mock_storage.read_relationships.return_value = self.relationships
+    def test_no_relationship_found_in_request(
+        self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios, search_request
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
 
         search_persons(search_request)
 
@@ -461,7 +617,58 @@ class TestSearchPersonByRelationship:
 
 
 @patch("pylms.pylms.ios")
-@patch("pylms.pylms.storage")
+@patch("pylms.storage.read_relationships")
+@patch("pylms.storage.read_persons")
+@patch("pylms.pylms.logger")
+class TestSearchPersonByDerivedRelationship:
+    jacques = Person(person_id=1, firstname="Jacques", sex=MALE)
+    paul = Person(person_id=2, firstname="Paul", sex=MALE)
+    lisa = Person(person_id=3, firstname="Lisa", sex=FEMALE)
+    tony = Person(person_id=4, firstname="Tony", sex=MALE)
+    persons = [jacques, paul, lisa, tony]
+    relationships = [
+        Relationship(person_left=jacques, person_right=paul, definition=parent_enfant),
+        Relationship(person_left=jacques, person_right=lisa, definition=parent_enfant),
+        Relationship(person_left=paul, person_right=tony, definition=parent_enfant),
+    ]
+
+    @mark.parametrize(
+        ("search_request", "expected"),
+        [
+            ("frère de lisa", [(paul, [relationships[0], relationships[2]])]),
+            ("sœur de paul", [(lisa, [relationships[1]])]),
+            ("grand-père de tony", [(jacques, [relationships[0], relationships[1]])]),
+            ("petit-fils de jacques", [(tony, [relationships[2]])]),
+            ("tante de tony", [(lisa, [relationships[1]])]),
+            ("neveu de lisa", [(tony, [relationships[2]])]),
+            ("fils de frère de lisa", [(tony, [relationships[2]])]),
+        ],
+    )
+    def test_search_successful(
+        self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios, search_request, expected
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
+
+        search_persons(search_request)
+
+        assert mock_logger.info.call_count == 0
+        mock_ios.list_persons.assert_called_once_with(expected)
+
+    @mark.parametrize("search_request", ["frère de paul", "oncle de tony", "cousin de tony", "grand-mère de tony"])
+    def test_no_match(self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios, search_request):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
+
+        search_persons(search_request)
+
+        mock_logger.info.assert_called_once_with(f'No match for "{search_request}".')
+        assert mock_ios.list_persons.call_count == 0
+
+
+@patch("pylms.pylms.ios")
+@patch("pylms.storage.read_relationships")
+@patch("pylms.storage.read_persons")
 @patch("pylms.pylms.logger")
 class TestSearchPersonByTags:
     john = Person(person_id=1, firstname="John")
@@ -482,9 +689,11 @@ class TestSearchPersonByTags:
             ("toto", [(john, []), (peter, [])]),
         ],
     )
-    def test_search_is_case_insensitive(self, mock_logger, mock_storage, mock_ios, search_request, expected):
-        mock_storage.read_persons.return_value = self.persons
-        mock_storage.read_relationships.return_value = self.relationships
+    def test_search_is_case_insensitive(
+        self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios, search_request, expected
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
 
         search_persons(search_request)
 
@@ -495,12 +704,16 @@ class TestSearchPersonByTags:
         ("search_request", "expected"),
         [
             ("Avé", [(emma, [])]),
-            ("Ave", []),
+            ("Ave", [(emma, [])]),
+            ("AVÊ", [(emma, [])]),
+            ("Avée", []),
         ],
     )
-    def test_search_is_accent_sensitive(self, mock_logger, mock_storage, mock_ios, search_request, expected):
-        mock_storage.read_persons.return_value = self.persons
-        mock_storage.read_relationships.return_value = self.relationships
+    def test_search_is_accent_insensitive(
+        self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios, search_request, expected
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
 
         search_persons(search_request)
 
@@ -510,3 +723,467 @@ class TestSearchPersonByTags:
         else:
             assert mock_logger.info.call_count == 0
             mock_ios.list_persons.assert_called_once_with(expected)
+
+
+@patch("pylms.pylms.ios")
+@patch("pylms.storage.read_relationships")
+@patch("pylms.storage.read_persons")
+@patch("pylms.pylms.logger")
+class TestFindRelationshipPath:
+    paul = Person(person_id=1, firstname="Paul", sex=MALE)
+    jacques = Person(person_id=2, firstname="Jacques", sex=MALE)
+    tony = Person(person_id=3, firstname="Tony")
+    eve = Person(person_id=4, firstname="Eve")
+    persons = [paul, jacques, tony, eve]
+    relationships = [
+        Relationship(person_left=jacques, person_right=paul, definition=parent_enfant),
+        Relationship(person_left=jacques, person_right=tony, definition=parent_enfant),
+    ]
+
+    def test_related(self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
+
+        find_relationship_path("paul", "tony")
+
+        assert mock_logger.info.call_count == 0
+        mock_ios.show_relationship_path.assert_called_once_with(self.paul, self.relationships)
+
+    def test_not_related(self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
+
+        find_relationship_path("paul", "eve")
+
+        mock_logger.info.assert_called_once_with("Paul and Eve are not related.")
+        assert mock_ios.show_relationship_path.call_count == 0
+
+    def test_no_match(self, mock_logger, mock_read_persons, mock_read_relationships, mock_ios):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
+
+        find_relationship_path("foo", "tony")
+
+        mock_logger.info.assert_called_once_with('No match for "foo".')
+        assert mock_ios.show_relationship_path.call_count == 0
+
+
+@patch("pylms.pylms.ios")
+@patch("pylms.pylms.events")
+@patch("pylms.storage.store_ancestors")
+@patch("pylms.storage.read_ancestors", return_value=None)
+@patch("pylms.storage.apply_changes")
+@patch("pylms.storage.read_relationships")
+@patch("pylms.storage.read_persons")
+@patch("pylms.pylms.logger")
+class TestAncestors:
+    jacques = Person(person_id=1, firstname="Jacques", sex=MALE)
+    paul = Person(person_id=2, firstname="Paul", sex=MALE)
+    tony = Person(person_id=3, firstname="Tony", sex=MALE)
+    lisa = Person(person_id=4, firstname="Lisa", sex=FEMALE)
+    persons = [jacques, paul, tony, lisa]
+    relationships = [
+        Relationship(person_left=jacques, person_right=paul, definition=parent_enfant),
+        Relationship(person_left=paul, person_right=tony, definition=parent_enfant),
+        Relationship(person_left=jacques, person_right=lisa, definition=parent_enfant),
+    ]
+
+    @mark.parametrize("link_request", ["Tony père de Jacques", "Jacques fils de Tony", "Paul père de Paul"])
+    def test_link_rejects_cycle(
+        self,
+        mock_logger,
+        mock_read_persons,
+        mock_read_relationships,
+        mock_apply_changes,
+        mock_read_ancestors,
+        mock_store_ancestors,
+        mock_events,
+        mock_ios,
+        link_request,
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = list(self.relationships)
+
+        link_persons(link_request)
+
+        mock_logger.error.assert_called_once()
+        assert mock_events.creating_link.call_count == 0
+        assert mock_apply_changes.call_count == 0
+
+    def test_link_stores_ancestors(
+        self,
+        mock_logger,
+        mock_read_persons,
+        mock_read_relationships,
+        mock_apply_changes,
+        mock_read_ancestors,
+        mock_store_ancestors,
+        mock_events,
+        mock_ios,
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = list(self.relationships)
+
+        link_persons("Tony père de Lisa")
+
+        assert mock_logger.error.call_count == 0
+        mock_apply_changes.assert_called_once()
+        (rows,) = mock_store_ancestors.call_args.args
+        assert sorted(rows) == [(1, 2, 1), (1, 3, 2), (1, 4, 1), (2, 3, 1), (2, 4, 2), (3, 4, 1)]
+
+    def test_search_descendants(
+        self,
+        mock_logger,
+        mock_read_persons,
+        mock_read_relationships,
+        mock_apply_changes,
+        mock_read_ancestors,
+        mock_store_ancestors,
+        mock_events,
+        mock_ios,
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = list(self.relationships)
+
+        search_persons("descendant de jacques")
+
+        assert [person for person, _ in mock_ios.list_persons.call_args.args[0]] == [self.paul, self.tony, self.lisa]
+
+    def test_common_ancestors(
+        self,
+        mock_logger,
+        mock_read_persons,
+        mock_read_relationships,
+        mock_apply_changes,
+        mock_read_ancestors,
+        mock_store_ancestors,
+        mock_events,
+        mock_ios,
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = list(self.relationships)
+
+        find_common_ancestors("tony", "lisa")
+
+        assert mock_logger.info.call_count == 0
+        mock_ios.list_persons.assert_called_once_with([(self.jacques, [self.relationships[0], self.relationships[2]])])
+
+    def test_no_common_ancestor(
+        self,
+        mock_logger,
+        mock_read_persons,
+        mock_read_relationships,
+        mock_apply_changes,
+        mock_read_ancestors,
+        mock_store_ancestors,
+        mock_events,
+        mock_ios,
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = list(self.relationships)
+
+        find_common_ancestors("tony", "jacques")
+
+        mock_logger.info.assert_called_once_with("Tony and Jacques have no common ancestor.")
+
+
+@patch("pylms.pylms.ios")
+@patch("pylms.storage.read_relationships")
+@patch("pylms.storage.read_persons")
+class TestClusters:
+    john = Person(person_id=1, firstname="John")
+    peter = Person(person_id=2, firstname="Peter")
+    emma = Person(person_id=3, firstname="Emma")
+    tom = Person(person_id=4, firstname="Tom")
+    bill = Person(person_id=5, firstname="Bill")
+    persons = [john, peter, emma, tom, bill]
+    relationships = [
+        Relationship(person_left=john, person_right=tom, definition=parent_enfant),
+        Relationship(person_left=emma, person_right=bill, definition=copain_copine),
+        Relationship(person_left=bill, person_right=john, definition=parent_enfant),
+    ]
+
+    def test_list_clusters(self, mock_read_persons, mock_read_relationships, mock_ios):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
+
+        list_clusters()
+
+        mock_ios.list_clusters.assert_called_once_with(
+            [
+                [
+                    (self.john, [self.relationships[0], self.relationships[2]]),
+                    (self.emma, [self.relationships[1]]),
+                    (self.tom, [self.relationships[0]]),
+                    (self.bill, [self.relationships[1], self.relationships[2]]),
+                ],
+                [(self.peter, [])],
+            ]
+        )
+
+    @patch("pylms.pylms._resident_repository", None)
+    @patch("pylms.repository.UnionFind", wraps=pylms.python_utils.UnionFind)
+    def test_clusters_are_kept_by_resident_repository(
+        self, mock_union_find, mock_read_persons, mock_read_relationships, mock_ios
+    ):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
+
+        with resident_unit_of_work():
+            list_persons(by_cluster=True)
+        with resident_unit_of_work():
+            show_stats()
+            list_persons()
+
+        mock_union_find.assert_called_once_with()
+        assert mock_ios.list_clusters.call_args.args[0][1] == [(self.peter, [])]
+        assert [person for person, _ in mock_ios.list_persons.call_args.args[0]] == self.persons
+
+    def test_show_stats(self, mock_read_persons, mock_read_relationships, mock_ios):
+        mock_read_persons.return_value = self.persons
+        mock_read_relationships.return_value = self.relationships
+
+        show_stats()
+
+        (stats,) = mock_ios.show_stats.call_args.args
+        assert stats.persons_count == 5
+        assert stats.relationships_count == 3
+        assert stats.cluster_sizes == [4, 1]
+        assert stats.isolated_persons_count == 1
+        assert stats.largest_cluster == [self.john, self.emma, self.tom, self.bill]
+
+    def test_no_persons(self, mock_read_persons, mock_read_relationships, mock_ios):
+        mock_read_persons.return_value = []
+
+        show_stats()
+        list_clusters()
+
+        (stats,) = mock_ios.show_stats.call_args.args
+        assert stats.persons_count == 0
+        assert stats.cluster_sizes == []
+        assert stats.largest_cluster == []
+        mock_ios.list_clusters.assert_called_once_with([])
+
+
+@patch("pylms.pylms.ios")
+@patch("pylms.storage.read_relationships", return_value=[])
+@patch("pylms.storage.read_persons")
+def test_find_duplicates(mock_read_persons, mock_read_relationships, mock_ios):
+    jean = Person(person_id=1, firstname="Jean", lastname="Dupont")
+    jean_bis = Person(person_id=2, firstname="Jean", lastname="Dupond")
+    mock_read_persons.return_value = [jean, Person(person_id=3, firstname="Marie", lastname="Curie"), jean_bis]
+
+    find_duplicates()
+
+    [(person, other_person, _)] = mock_ios.list_duplicates.call_args.args[0]
+    assert (person, other_person) == (jean, jean_bis)
+
+
+@patch("pylms.pylms.events")
+@patch("pylms.storage.store_ancestors")
+@patch("pylms.storage.read_ancestors", return_value=None)
+@patch("pylms.storage.apply_changes")
+@patch("pylms.storage.read_relationships")
+@patch("pylms.storage.read_persons")
+@patch("pylms.pylms.logger")
+class TestMergePerson:
+    jean = Person(person_id=1, firstname="Jean", lastname="Dupont", sex=MALE)
+    paul = Person(person_id=2, firstname="Paul")
+    jean_bis = Person(person_id=3, firstname="Jean", lastname="Dupond")
+    marie = Person(person_id=4, firstname="Marie", sex=FEMALE)
+
+    def test_merge_person(
+        self,
+        mock_logger,
+        mock_read_persons,
+        mock_read_relationships,
+        mock_apply_changes,
+        mock_read_ancestors,
+        mock_store_ancestors,
+        mock_events,
+    ):
+        mock_read_persons.return_value = [self.jean, self.paul, self.jean_bis]
+        mock_read_relationships.return_value = [
+            Relationship(person_left=self.jean_bis, person_right=self.paul, definition=parent_enfant)
+        ]
+
+        merge_person("dupont", "dupond")
+
+        assert mock_logger.error.call_count == 0
+        mock_events.merging_person.assert_called_once_with(self.jean_bis, self.jean)
+        (changes,) = mock_apply_changes.call_args.args
+        assert changes == [(UPDATE_PERSON, self.jean), (MERGE_PERSON, (self.jean_bis, self.jean))]
+
+    @mark.parametrize(
+        "patterns, message",
+        [
+            (("dupont", "dupont"), "Unsupported merge request: Jean Dupont can't be merged into itself"),
+            (("marie", "dupont"), "Unsupported merge request: Jean Dupont and Marie have different sexes"),
+            (("paul", "dupond"), "Unsupported merge request: Jean Dupond is an ancestor or a descendant of Paul"),
+        ],
+    )
+    def test_merge_rejected(
+        self,
+        mock_logger,
+        mock_read_persons,
+        mock_read_relationships,
+        mock_apply_changes,
+        mock_read_ancestors,
+        mock_store_ancestors,
+        mock_events,
+        patterns,
+        message,
+    ):
+        mock_read_persons.return_value = [self.jean, self.paul, self.jean_bis, self.marie]
+        mock_read_relationships.return_value = [
+            Relationship(person_left=self.jean_bis, person_right=self.paul, definition=parent_enfant)
+        ]
+
+        merge_person(*patterns)
+
+        mock_logger.error.assert_called_once_with(message)
+        assert mock_events.merging_person.call_count == 0
+        assert mock_apply_changes.call_count == 0
+
+
+class TestUnitOfWork:
+    @patch("pylms.pylms.storage")
+    @patch("pylms.pylms.events")
+    def test_nested_units_of_work_write_once(self, mock_events, mock_storage):
+        mock_storage.read_persons.return_value = []
+
+        with unit_of_work() as repository:
+            with unit_of_work() as nested_repository:
+                assert nested_repository is repository
+                store_person(firstname="John")
+            store_person(firstname="Paul")
+            assert mock_storage.apply_changes.call_count == 0
+
+        mock_storage.read_persons.assert_called_once_with()
+        mock_storage.apply_changes.assert_called_once_with(
+            [(ADD_PERSON, Person(0, firstname="John")), (ADD_PERSON, Person(1, firstname="Paul"))]
+        )
+
+    @patch("pylms.pylms.storage")
+    @patch("pylms.pylms.events")
+    def test_nothing_is_written_on_error(self, mock_events, mock_storage):
+        mock_storage.read_persons.return_value = []
+
+        with raises(ValueError):
+            with unit_of_work():
+                store_person(firstname="John")
+                raise ValueError("foo")
+
+        assert mock_storage.apply_changes.call_count == 0
+        mock_storage.clear_cache.assert_called_once_with()
+        assert pylms.pylms.repository is None
+
+    @patch("pylms.pylms._resident_repository", None)
+    @patch("pylms.pylms.storage")
+    @patch("pylms.pylms.events")
+    def test_resident_units_of_work_read_once_and_write_each(self, mock_events, mock_storage):
+        mock_storage.read_persons.return_value = [Person(0, "Mike", "Jagger")]
+
+        with resident_unit_of_work() as repository:
+            store_person(firstname="John")
+        assert pylms.pylms.repository is None
+        with resident_unit_of_work() as next_repository:
+            assert next_repository is repository
+            store_person(firstname="Paul")
+            search_persons("john")
+
+        mock_storage.read_persons.assert_called_once_with()
+        mock_storage.apply_changes.assert_has_calls(
+            [call([(ADD_PERSON, Person(1, firstname="John"))]), call([(ADD_PERSON, Person(2, firstname="Paul"))])]
+        )
+
+    @patch("pylms.pylms._resident_repository", None)
+    @patch("pylms.pylms.storage")
+    @patch("pylms.pylms.events")
+    def test_resident_repository_is_dropped_on_error(self, mock_events, mock_storage):
+        mock_storage.read_persons.side_effect = lambda: []
+
+        with raises(ValueError):
+            with resident_unit_of_work() as repository:
+                store_person(firstname="John")
+                raise ValueError("foo")
+        with resident_unit_of_work() as next_repository:
+            assert next_repository is not repository
+            assert next_repository.read_persons() == []
+
+        assert mock_storage.apply_changes.call_count == 0
+        mock_storage.clear_cache.assert_called_once_with()
+        assert mock_storage.read_persons.call_count == 2
+
+
+@mark.parametrize("backend", [storage, sqlite_storage], ids=["json", "sqlite"])
+def test_resident_repository_is_dropped_once_written_by_another_process(backend, tmpdir):
+    with (
+        patch("pylms.storage.persons_file_name", str(tmpdir + "persons.db")),
+        patch("pylms.storage.relationships_file_name", str(tmpdir + "relationships.db")),
+        patch("pylms.storage.ancestors_file_name", str(tmpdir + "ancestors.db")),
+        patch("pylms.storage.transaction_file_name", str(tmpdir + "transaction.db")),
+        patch("pylms.sqlite_storage.database_file_name", str(tmpdir + "pylms.sqlite")),
+        patch("pylms.pylms.storage", backend),
+        patch("pylms.pylms.events"),
+        patch("pylms.pylms._resident_repository", None),
+    ):
+        storage.clear_cache()
+        if backend is sqlite_storage:
+            sqlite_storage.create_database().close()
+        with resident_unit_of_work():
+            store_person(firstname="Alice")
+
+        other_process = multiprocessing.get_context("fork").Process(target=backend.add_person, args=(Person(1, "Bob"),))
+        other_process.start()
+        other_process.join()
+        with resident_unit_of_work():
+            store_person(firstname="Carol")
+
+        assert [(p.person_id, p.firstname) for p in backend.read_persons()] == [(0, "Alice"), (1, "Bob"), (2, "Carol")]
+        storage.clear_cache()
+
+
+def test_resident_repository_keeps_kinships_until_written_by_another_process(tmpdir):
+    john, paul, tony = Person(0, "John"), Person(1, "Paul"), Person(2, "Tony", sex=MALE)
+    with (
+        patch("pylms.storage.persons_file_name", str(tmpdir + "persons.db")),
+        patch("pylms.storage.relationships_file_name", str(tmpdir + "relationships.db")),
+        patch("pylms.storage.ancestors_file_name", str(tmpdir + "ancestors.db")),
+        patch("pylms.storage.transaction_file_name", str(tmpdir + "transaction.db")),
+        patch("pylms.pylms.storage", storage),
+        patch("pylms.pylms.ios") as mock_ios,
+        patch("pylms.pylms._resident_repository", None),
+        patch("pylms.repository.KinshipView", wraps=pylms.core.KinshipView) as mock_kinship_view,
+    ):
+        storage.clear_cache()
+        storage.store_persons([john, paul, tony])
+        storage.store_relationships([Relationship(john, paul, parent_enfant), Relationship(john, tony, parent_enfant)])
+
+        for _ in range(2):
+            with resident_unit_of_work():
+                search_persons("frère de paul")
+        other_process = multiprocessing.get_context("fork").Process(target=storage.add_person, args=(Person(3, "Bob"),))
+        other_process.start()
+        other_process.join()
+        with resident_unit_of_work():
+            search_persons("frère de paul")
+
+        assert mock_kinship_view.call_count == 2
+        assert [c.args[0][0][0].firstname for c in mock_ios.list_persons.call_args_list] == ["Tony"] * 3
+        storage.clear_cache()
+
+
+@patch("pylms.storage.read_persons")
+def test_complete_person_name(mock_read_persons):
+    mock_read_persons.return_value = [
+        Person(0, "Élodie", "Martin"),
+        Person(1, "Eloïse", "Dupont"),
+        Person(2, "Paul", "Eluard"),
+        Person(3, "Jean"),
+    ]
+
+    assert complete_person_name("el") == ["Eloïse", "Eluard", "Élodie"]
+    assert complete_person_name("ELO") == ["Eloïse", "Élodie"]
+    assert complete_person_name("j") == ["Jean"]
+    assert complete_person_name("x") == []
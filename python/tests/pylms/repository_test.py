@@ -0,0 +1,407 @@
+from contextlib import closing
+from pylms import storage, sqlite_storage
+from pylms.core import Person, Relationship, RelationshipDefinition, RelationshipAlias, MALE, parse_tag_query
+from pylms.core import parent_enfant, frere_soeur, grand_parent_petit_enfant, ancetre_descendant
+from pylms.core import search_match
+from pylms.repository import Repository
+from pytest import fixture, mark
+import sqlite3
+from unittest.mock import patch
+
+person_1 = Person(1, "Jim", "Morisson")
+person_2 = Person(2, "Paul", "John", sex=MALE)
+person_3 = Person(3, "Tony", "Parker")
+person_3.tags = ["Escalade", "boulot"]
+definition = RelationshipDefinition(name="rs1_name", aliases=[RelationshipAlias("rs1 de")])
+relationships = [
+    Relationship(person_1, person_2, definition),
+    Relationship(person_2, person_3, definition),
+]
+
+
+@fixture(autouse=True)
+def storage_files(tmpdir):
+    with (
+        patch("pylms.storage.persons_file_name", str(tmpdir + "persons.db")),
+        patch("pylms.storage.relationships_file_name", str(tmpdir + "relationships.db")),
+        patch("pylms.storage.ancestors_file_name", str(tmpdir + "ancestors.db")),
+        patch("pylms.storage.transaction_file_name", str(tmpdir + "transaction.db")),
+        patch("pylms.sqlite_storage.database_file_name", str(tmpdir + "pylms.sqlite")),
+        patch("pylms.storage.relationship_definitions", new=[definition, parent_enfant]),
+    ):
+        yield
+        # changes staged by a Repository left without flush()
+        sqlite_storage.clear_cache()
+
+
+@fixture(params=[storage, sqlite_storage], ids=["json", "sqlite"])
+def backend(request):
+    if request.param is sqlite_storage:
+        sqlite_storage.create_database().close()
+    return request.param
+
+
+def test_empty_storage(backend):
+    repository = Repository(backend)
+
+    assert repository.next_person_id() == 0
+    assert repository.read_persons() == []
+    assert repository.read_relationships() == []
+    assert repository.search_persons("jim") == []
+    assert repository.search_related_persons(definition, definition.aliases[0], "jim") == []
+    assert repository.related_persons_of([person_1], definition, definition.aliases[0]) == []
+    assert repository.read_relationships_of([person_1]) == []
+
+
+def test_queries(backend):
+    backend.store_persons([person_1, person_2, person_3])
+    backend.store_relationships(relationships)
+    repository = Repository(backend)
+
+    assert repository.next_person_id() == 4
+    assert repository.search_persons("JOHN") == [person_2]
+    assert repository.search_related_persons(definition, definition.aliases[0], "parker") == [person_2]
+    assert repository.related_persons_of([person_2, person_3], definition, definition.aliases[0]) == [
+        person_1,
+        person_2,
+    ]
+    assert repository.related_persons_of([person_1], definition, definition.aliases[0]) == []
+    assert [(rl.left, rl.right) for rl in repository.read_relationships_of([person_3])] == [(person_2, person_3)]
+    # a Relationship between two of the Persons is returned once
+    assert len(repository.read_relationships_of([person_1, person_2, person_3])) == 2
+
+
+def test_json_storage_is_read_once():
+    storage.store_persons([person_1, person_2, person_3])
+    storage.store_relationships(relationships)
+    repository = Repository(storage)
+
+    with (
+        patch("pylms.storage.read_persons", wraps=storage.read_persons) as mock_read_persons,
+        patch("pylms.storage.read_relationships", wraps=storage.read_relationships) as mock_read_relationships,
+    ):
+        repository.next_person_id()
+        repository.search_persons("jim")
+        repository.search_related_persons(definition, definition.aliases[0], "parker")
+        repository.read_relationships_of([person_3])
+        repository.read_persons()
+        repository.read_relationships()
+
+    mock_read_persons.assert_called_once_with()
+    mock_read_relationships.assert_called_once_with([person_1, person_2, person_3])
+
+
+@mark.parametrize("load", [True, False], ids=["loaded", "not_loaded"])
+def test_changes_are_visible_before_and_written_by_flush(backend, load):
+    backend.store_persons([person_1, person_2, person_3])
+    backend.store_relationships(relationships)
+    repository = Repository(backend)
+    if load:
+        repository.read_relationships()
+    person_4 = Person(4, "Max", "Payne")
+    updated_person_2 = Person(2, "Paul", "Johnson", sex=MALE)
+
+    with patch.object(backend, "apply_changes", wraps=backend.apply_changes) as mock_apply_changes:
+        repository.add_person(person_4)
+        repository.update_person(updated_person_2)
+        repository.delete_person(person_3)
+        repository.add_relationship(Relationship(person_4, person_1, definition))
+        mock_apply_changes.assert_not_called()
+
+        assert repository.search_persons("johnson") == [updated_person_2]
+        assert [(rl.left, rl.right) for rl in repository.read_relationships_of([person_1])] == [
+            (person_1, updated_person_2),
+            (person_4, person_1),
+        ]
+
+        if backend.QUERY_PUSHDOWN:
+            # staged in the open transaction of the backend, not written yet
+            with closing(sqlite3.connect(sqlite_storage.database_file_name)) as connection:
+                assert connection.execute("SELECT count(*) FROM persons").fetchone() == (3,)
+
+        repository.flush()
+        repository.flush()
+
+    # changes were written at once
+    mock_apply_changes.assert_called_once()
+    assert backend.read_persons() == [person_1, updated_person_2, person_4]
+    assert [(rl.left.lastname, rl.right.lastname) for rl in backend.read_relationships(backend.read_persons())] == [
+        ("Morisson", "Johnson"),
+        ("Payne", "Morisson"),
+    ]
+
+
+def test_search_tags(backend):
+    person_4 = Person(4, "Max", "Payne")
+    person_4.tags = ["cours d'escalade"]
+    backend.store_persons([person_1, person_2, person_3, person_4])
+    repository = Repository(backend)
+
+    assert repository.search_tags(parse_tag_query("escalade & !boulot")) == [person_4]
+    assert repository.search_tags(parse_tag_query("!escalade")) == [person_1, person_2]
+
+    updated_person_3 = Person(3, "Tony", "Parker")
+    updated_person_3.tags = ["Escalade"]
+    repository.update_person(updated_person_3)
+    repository.delete_person(person_4)
+    repository.add_person(Person(5, "Jim"))
+
+    assert repository.search_tags(parse_tag_query("escalade & !boulot")) == [updated_person_3]
+    assert repository.search_tags(parse_tag_query("!escalade | boulot")) == [person_1, person_2, Person(5, "Jim")]
+
+
+@mark.parametrize("pattern", ["o", "jo", "joh", "JOHN", "son", "hns", "n d", "escalade", "ESC", "cal", "x", "é"])
+def test_search_persons_same_as_scan(pattern):
+    persons = [
+        Person(1, "John", "Doe"),
+        Person(2, "Joanna", "Johnson"),
+        Person(3, "Éric", "Hanson"),
+        Person(4, "Lisa"),
+    ]
+    persons[3].tags = ["cours d'escalade", "Johnny"]
+    storage.store_persons(persons)
+    repository = Repository(storage)
+    expected = [person for person in persons if search_match(pattern, person)]
+
+    # the first search scans the Persons, the next ones use the indexes
+    assert repository.search_persons(pattern) == expected
+    assert repository._name_index is None
+    assert repository.search_persons(pattern) == expected
+    assert repository._name_index is not None
+
+
+def test_derived_relationships_follow_changes(backend):
+    backend.store_persons([person_1, person_2, person_3])
+    backend.store_relationships([Relationship(person_1, person_2, parent_enfant)])
+    repository = Repository(backend)
+    brother, sister = frere_soeur.aliases
+
+    assert repository.search_related_persons(frere_soeur, brother, "tony") == []
+
+    repository.add_relationship(Relationship(person_1, person_3, parent_enfant))
+
+    assert repository.search_related_persons(frere_soeur, brother, "tony") == [person_2]
+    assert repository.related_persons_of([person_2], frere_soeur, sister) == []
+    assert (
+        repository.related_persons_of([person_1], grand_parent_petit_enfant, grand_parent_petit_enfant.aliases[5]) == []
+    )
+
+    repository.delete_person(person_2)
+
+    assert repository.search_related_persons(frere_soeur, brother, "tony") == []
+
+
+def test_ancestors_follow_changes(backend):
+    person_4 = Person(4, "Max", "Payne")
+    backend.store_persons([person_1, person_2, person_3, person_4])
+    backend.store_relationships([Relationship(person_1, person_2, parent_enfant)])
+    repository = Repository(backend)
+    ancestor, descendant = ancetre_descendant.aliases
+
+    assert repository.is_ancestor(person_1, person_2)
+    assert repository.closest_common_ancestors(person_2, person_3) == []
+
+    repository.add_relationship(Relationship(person_2, person_3, parent_enfant))
+    repository.add_relationship(Relationship(person_1, person_4, parent_enfant))
+
+    assert repository.is_ancestor(person_1, person_3)
+    assert repository.related_persons_of([person_3], ancetre_descendant, ancestor) == [person_1, person_2]
+    assert repository.search_related_persons(ancetre_descendant, descendant, "jim") == [person_2, person_3, person_4]
+    assert repository.closest_common_ancestors(person_3, person_4) == [person_1]
+
+    repository.delete_person(person_2)
+
+    assert not repository.is_ancestor(person_1, person_3)
+    assert repository.closest_common_ancestors(person_3, person_4) == []
+
+
+def test_json_ancestors_are_written_and_read_back():
+    storage.store_persons([person_1, person_2, person_3])
+    storage.store_relationships([Relationship(person_1, person_2, parent_enfant)])
+    repository = Repository(storage)
+    repository.is_ancestor(person_1, person_2)
+    repository.add_relationship(Relationship(person_2, person_3, parent_enfant))
+    repository.flush()
+
+    person_4 = Person(4, "Max", "Payne")
+    with (
+        patch("pylms.repository.build_ancestor_closure") as mock_build_ancestor_closure,
+        patch.object(storage, "store_ancestors") as mock_store_ancestors,
+    ):
+        repository = Repository(storage)
+        assert repository.is_ancestor(person_1, person_3)
+        repository.add_person(person_4)
+        repository.add_relationship(Relationship(person_3, person_4, parent_enfant))
+        repository.flush()
+
+    mock_build_ancestor_closure.assert_not_called()
+    # the link is replayed from the relationships journal rather than written to the closure
+    mock_store_ancestors.assert_not_called()
+    assert sorted(storage.read_ancestors().rows()) == [(1, 2, 1), (1, 3, 2), (1, 4, 3), (2, 3, 1), (2, 4, 2), (3, 4, 1)]
+
+
+def test_json_pending_changes_are_replayed_rather_than_written():
+    storage.store_persons([person_1, person_2, person_3])
+    storage.store_relationships([Relationship(person_1, person_2, parent_enfant)])
+    repository = Repository(storage)
+    repository.is_ancestor(person_1, person_2)
+    repository.flush()
+    person_4 = Person(4, "Max", "Payne")
+    updated_person_1 = Person(1, "Jimmy", "Morisson")
+
+    with (
+        patch.object(storage, "apply_changes", wraps=storage.apply_changes) as mock_apply_changes,
+        patch.object(storage, "store_ancestors", wraps=storage.store_ancestors) as mock_store_ancestors,
+    ):
+        repository = Repository(storage)
+        repository.add_person(person_4)
+        repository.update_person(updated_person_1)
+        repository.add_relationship(Relationship(person_2, person_4, parent_enfant))
+        repository.merge_person(person_3, person_4)
+
+        # read from the storage as written, with the pending changes replayed on top
+        assert repository.is_ancestor(updated_person_1, person_4)
+        assert repository.read_persons() == [updated_person_1, person_2, person_4]
+        assert [(rl.left, rl.right) for rl in repository.read_relationships()] == [
+            (updated_person_1, person_2),
+            (person_2, person_4),
+        ]
+        assert repository.read_relationships()[0].left is updated_person_1
+        mock_apply_changes.assert_not_called()
+
+        repository.flush()
+
+    mock_apply_changes.assert_called_once()
+    mock_store_ancestors.assert_not_called()
+    assert sorted(storage.read_ancestors().rows()) == [(1, 2, 1), (1, 4, 2), (2, 4, 1)]
+
+
+@mark.parametrize("load", [True, False], ids=["loaded", "not_loaded"])
+def test_rollback_to_savepoint(backend, load):
+    backend.store_persons([person_1, person_2])
+    backend.store_relationships([Relationship(person_1, person_2, parent_enfant)])
+    repository = Repository(backend)
+    if load:
+        repository.read_relationships()
+        repository.search_persons("jim")
+        repository.is_ancestor(person_1, person_2)
+    person_4 = Person(4, "Max", "Payne")
+    repository.add_person(person_3)
+    repository.add_relationship(Relationship(person_2, person_3, parent_enfant))
+
+    repository.savepoint()
+    repository.add_person(person_4)
+    repository.add_relationship(Relationship(person_3, person_4, parent_enfant))
+    repository.delete_person(person_1)
+    repository.rollback()
+
+    assert repository.read_persons() == [person_1, person_2, person_3]
+    assert repository.search_persons("max") == []
+    assert repository.is_ancestor(person_1, person_3)
+    assert not repository.is_ancestor(person_3, person_4)
+    assert repository.next_person_id() == 4
+    repository.flush()
+    assert backend.read_persons() == [person_1, person_2, person_3]
+    assert len(backend.read_relationships(backend.read_persons())) == 2
+
+
+def test_person_clusters_follow_changes(backend):
+    person_4 = Person(4, "Max", "Payne")
+    backend.store_persons([person_1, person_2, person_3])
+    backend.store_relationships([relationships[0]])
+    repository = Repository(backend)
+
+    assert repository.person_clusters() == [[1, 2], [3]]
+
+    repository.add_person(person_4)
+    repository.add_relationship(Relationship(person_4, person_3, definition))
+
+    assert repository.person_clusters() == [[1, 2], [3, 4]]
+
+    repository.add_relationship(Relationship(person_2, person_4, definition))
+
+    assert repository.person_clusters() == [[1, 2, 3, 4]]
+
+    repository.delete_person(person_4)
+
+    assert repository.person_clusters() == [[1, 2], [3]]
+
+
+@mark.parametrize("load", [True, False], ids=["loaded", "not_loaded"])
+def test_merge_person(backend, load):
+    person_4 = Person(4, "Tony", "Parker", created=person_3.created, sex=MALE)
+    backend.store_persons([person_1, person_2, person_3, person_4])
+    backend.store_relationships(
+        [
+            Relationship(person_1, person_3, parent_enfant),
+            Relationship(person_4, person_2, parent_enfant),
+            Relationship(person_1, person_4, parent_enfant),
+            Relationship(person_4, person_1, definition),
+        ]
+    )
+    repository = Repository(backend)
+    if load:
+        repository.read_relationships()
+        repository.search_persons("tony")
+        repository.is_ancestor(person_1, person_2)
+    brother = frere_soeur.aliases[0]
+    assert repository.search_related_persons(frere_soeur, brother, "parker") == [person_4]
+
+    repository.merge_person(person_4, person_3)
+
+    assert repository.search_persons("tony") == [person_3]
+    assert [(rl.left, rl.right) for rl in repository.read_relationships_of([person_3])] == [
+        (person_1, person_3),
+        (person_3, person_2),
+        (person_3, person_1),
+    ]
+    assert repository.is_ancestor(person_1, person_2)
+    assert repository.related_persons_of([person_2], ancetre_descendant, ancetre_descendant.aliases[0]) == [
+        person_1,
+        person_3,
+    ]
+    assert repository.search_related_persons(frere_soeur, brother, "parker") == []
+    repository.flush()
+    assert backend.read_persons() == [person_1, person_2, person_3]
+    assert len(backend.read_relationships(backend.read_persons())) == 3
+
+
+@mark.parametrize("load", [True, False], ids=["loaded", "not_loaded"])
+def test_bulk_changes_are_written_at_once(backend, load):
+    backend.store_persons([person_1, person_2, person_3])
+    backend.store_relationships(relationships)
+    repository = Repository(backend)
+    if load:
+        repository.read_relationships()
+        repository.search_persons("tony")
+    updated_person_1 = Person(1, "Jim", "Morisson")
+    updated_person_1.tags = ["famille"]
+    updated_person_3 = Person(3, "Tony", "Parker")
+    updated_person_3.tags = ["famille"]
+
+    with patch.object(backend, "apply_changes", wraps=backend.apply_changes) as mock_apply_changes:
+        repository.update_persons([updated_person_1, updated_person_3])
+        repository.delete_persons([person_2, updated_person_3])
+
+        assert repository.search_tags(parse_tag_query("famille")) == [updated_person_1]
+        assert repository.read_relationships_of([updated_person_1]) == []
+        repository.flush()
+
+    mock_apply_changes.assert_called_once()
+    assert backend.read_persons() == [updated_person_1]
+    assert backend.read_persons()[0].tags == ["famille"]
+
+
+def test_next_person_id_follows_added_persons(backend):
+    backend.store_persons([person_1, person_2, person_3])
+    repository = Repository(backend)
+
+    with patch.object(backend, "read_persons", wraps=backend.read_persons) as mock_read_persons:
+        assert repository.next_person_id() == 4
+        repository.add_person(Person(repository.next_person_id(), "Max", "Payne"))
+        assert repository.next_person_id() == 5
+        repository.add_person(Person(9, "Bob", "Marley"))
+        assert repository.next_person_id() == 10
+
+        # computed once, whatever the number of Persons added
+        assert mock_read_persons.call_count <= 1
@@ -0,0 +1,317 @@
+from contextlib import closing
+from datetime import datetime
+from pylms import storage as json_storage
+from pylms.core import Person, Relationship, parent_enfant, copain_copine, ancetre_descendant, MALE, FEMALE
+from pylms.sqlite_storage import read_persons, store_persons, add_person, update_person, delete_person
+from pylms.sqlite_storage import read_relationships, store_relationships, add_relationship, read_relationships_of
+from pylms.sqlite_storage import search_persons, search_related_persons, next_person_id, migrate_from_json
+from pylms.sqlite_storage import database_exists, is_ancestor, closest_common_ancestors, related_persons_of
+from pylms.sqlite_storage import apply_changes, create_database, stage_changes, clear_cache
+from pylms.storage import UPDATE_PERSON, MERGE_PERSON, DELETE_PERSON
+from pytest import fixture, mark, raises
+import sqlite3
+from unittest.mock import patch
+
+john = Person(1, "John", "Doe", created=datetime(2024, 4, 16, 12, 40, 30), sex=MALE)
+john.tags = ["Escalade", "toto"]
+peter = Person(2, "Peter", created=datetime(2024, 4, 16, 12, 40, 31))
+emma = Person(3, "Emma", created=datetime(2024, 4, 16, 12, 40, 32), sex=FEMALE)
+emma.tags = ["Avé l'Accent!"]
+carine = Person(4, "Cârine", "Dupond", created=datetime(2024, 4, 16, 12, 40, 33))
+persons = [john, peter, emma, carine]
+relationships = [
+    Relationship(person_left=john, person_right=peter, definition=parent_enfant),
+    Relationship(person_left=john, person_right=emma, definition=parent_enfant),
+    Relationship(person_left=emma, person_right=carine, definition=copain_copine),
+]
+
+
+@fixture(autouse=True)
+def database(tmpdir):
+    with patch("pylms.sqlite_storage.database_file_name", str(tmpdir + "pylms.sqlite")):
+        create_database().close()
+        yield
+
+
+@fixture
+def populated_database():
+    store_persons(persons)
+    store_relationships(relationships)
+
+
+def _ids(persons_: list[Person]) -> list[int]:
+    return [p.person_id for p in persons_]
+
+
+def test_database_is_only_created_by_migration(tmpdir):
+    with (
+        patch("pylms.sqlite_storage.database_file_name", str(tmpdir + "other.sqlite")),
+        patch("pylms.storage.persons_file_name", str(tmpdir + "persons.db")),
+        patch("pylms.storage.relationships_file_name", str(tmpdir + "relationships.db")),
+    ):
+        assert not database_exists()
+
+        with raises(sqlite3.OperationalError):
+            read_persons()
+        with raises(ValueError, match="No Persons to migrate"):
+            migrate_from_json()
+
+        assert not database_exists()
+        json_storage.store_persons([john])
+        migrate_from_json()
+
+        assert database_exists()
+        assert read_persons() == [john]
+
+
+def test_read_persons_empty_database():
+    assert read_persons() == []
+    assert next_person_id() == 0
+
+
+def test_store_empty_list_of_persons():
+    with raises(ValueError, match="Can't store an empty list of Persons."):
+        store_persons([])
+
+
+def test_store_and_read_persons(populated_database):
+    res = read_persons()
+
+    assert res == persons
+    assert res[0].created == john.created
+    assert res[0].sex == MALE
+    assert res[0].tags == ["Escalade", "toto"]
+    assert res[1].sex is None
+    assert res[1].tags == []
+    assert next_person_id() == 5
+
+
+def test_add_update_delete_person(populated_database):
+    tony = Person(5, "Tony", "Parker")
+    add_person(tony)
+    updated_peter = Person(2, "Peter", "Pan", sex=MALE)
+    updated_peter.tags = ["neverland"]
+    update_person(updated_peter)
+    delete_person(emma)
+
+    res = read_persons()
+
+    assert res == [john, updated_peter, carine, tony]
+    assert res[1].sex == MALE
+    assert res[1].tags == ["neverland"]
+    # relationships of the deleted Person are deleted too
+    assert [(rl.left, rl.right) for rl in read_relationships(res)] == [(john, updated_peter)]
+
+
+def test_read_relationships_empty_list_of_persons():
+    with raises(ValueError, match="Persons can't be empty"):
+        read_relationships([])
+
+
+def test_store_and_read_relationships(populated_database):
+    add_relationship(Relationship(person_left=carine, person_right=peter, definition=parent_enfant))
+
+    res = read_relationships(persons)
+
+    assert [(rl.left, rl.right, rl.definition) for rl in res] == [
+        (john, peter, parent_enfant),
+        (john, emma, parent_enfant),
+        (emma, carine, copain_copine),
+        (carine, peter, parent_enfant),
+    ]
+
+
+def test_read_relationships_of(populated_database):
+    res = read_relationships_of([emma])
+
+    assert [(rl.left, rl.right) for rl in res] == [(john, emma), (emma, carine)]
+    assert read_relationships_of([carine, peter])[0].left == john
+
+
+@mark.parametrize(
+    ("pattern", "expected"),
+    [
+        ("john", [1]),
+        ("DOE", [1]),
+        ("e", [1, 2, 3, 4]),
+        ("escalade", [1]),
+        ("avé", [3]),
+        ("ave", [3]),
+        ("cârine", [4]),
+        ("CARINE", [4]),
+        ("%", []),
+        ("ohn", [1]),
+        ('"ca', []),
+        ("l'accent!", [3]),
+    ],
+)
+def test_search_persons(populated_database, pattern, expected):
+    assert _ids(search_persons(pattern)) == expected
+
+
+def test_names_index_follows_changes(populated_database):
+    updated_john = Person(1, "Johnny", "Doe", created=john.created, sex=MALE)
+    updated_john.tags = ["Alpinisme"]
+
+    apply_changes([(UPDATE_PERSON, updated_john), (MERGE_PERSON, (carine, emma))])
+    delete_person(peter)
+
+    assert _ids(search_persons("johnny")) == [1]
+    assert _ids(search_persons("escalade")) == []
+    assert _ids(search_persons("alpi")) == [1]
+    assert _ids(search_persons("dupond")) == []
+    assert _ids(search_persons("peter")) == []
+    assert _ids(search_persons("emma")) == [3]
+
+
+def test_name_search_uses_names_index(populated_database, tmpdir):
+    with closing(sqlite3.connect(str(tmpdir + "pylms.sqlite"))) as connection:
+        plan = connection.execute(
+            "EXPLAIN QUERY PLAN SELECT person_id FROM persons p"
+            " WHERE p.person_id IN (SELECT rowid FROM names WHERE names MATCH '\"doe\"') AND instr(p.lastname_lower, 'doe')"
+        ).fetchall()
+
+    assert any("VIRTUAL TABLE INDEX" in row[-1] for row in plan)
+    assert any("INTEGER PRIMARY KEY" in row[-1] for row in plan)
+
+
+@mark.parametrize(
+    ("alias_name", "pattern", "expected"),
+    [
+        ("parent de", "emma", [1]),
+        ("père de", "emma", [1]),
+        ("mère de", "emma", []),
+        ("enfant de", "john", [2, 3]),
+        ("fille de", "john", [3]),
+        ("fils de", "john", []),
+        ("copine de", "dupond", [3]),
+        ("copain de", "dupond", []),
+    ],
+)
+def test_search_related_persons(populated_database, alias_name, pattern, expected):
+    definition, alias = next((d, a) for d in [parent_enfant, copain_copine] for a in d.aliases if a.name == alias_name)
+
+    assert _ids(search_related_persons(definition, alias, pattern)) == expected
+
+
+def _ancestor_rows(database_file: str) -> list[tuple[int, int, int]]:
+    with closing(sqlite3.connect(database_file)) as connection:
+        return connection.execute("SELECT ancestor_id, descendant_id, depth FROM ancestors ORDER BY 1, 2").fetchall()
+
+
+def test_ancestors_follow_changes(populated_database, tmpdir):
+    ancestor, descendant = ancetre_descendant.aliases
+    grandson = Person(5, "Tom")
+    add_person(grandson)
+    add_relationship(Relationship(person_left=peter, person_right=grandson, definition=parent_enfant))
+
+    assert _ancestor_rows(str(tmpdir + "pylms.sqlite")) == [(1, 2, 1), (1, 3, 1), (1, 5, 2), (2, 5, 1)]
+    assert is_ancestor(john, grandson)
+    assert not is_ancestor(grandson, john)
+    assert _ids(closest_common_ancestors(grandson, emma)) == [1]
+    assert _ids(related_persons_of([grandson], ancetre_descendant, ancestor)) == [1, 2]
+    assert _ids(search_related_persons(ancetre_descendant, descendant, "john")) == [2, 3, 5]
+
+    delete_person(peter)
+
+    assert _ancestor_rows(str(tmpdir + "pylms.sqlite")) == [(1, 3, 1)]
+    assert _ids(closest_common_ancestors(grandson, emma)) == []
+
+
+def test_merge_person(populated_database, tmpdir):
+    tom = Person(5, "Tom", created=datetime(2020, 1, 1))
+    tom.tags = ["vélo"]
+    grandson = Person(6, "Max")
+    add_person(tom)
+    add_person(grandson)
+    add_relationship(Relationship(person_left=john, person_right=tom, definition=parent_enfant))
+    add_relationship(Relationship(person_left=carine, person_right=tom, definition=copain_copine))
+    add_relationship(Relationship(person_left=tom, person_right=grandson, definition=parent_enfant))
+    merged_peter = Person(2, "Peter", created=datetime(2020, 1, 1))
+    merged_peter.tags = ["vélo"]
+
+    apply_changes([(UPDATE_PERSON, merged_peter), (MERGE_PERSON, (tom, merged_peter))])
+
+    assert _ids(read_persons()) == [1, 2, 3, 4, 6]
+    assert read_persons()[1].created == datetime(2020, 1, 1)
+    assert read_persons()[1].tags == ["vélo"]
+    assert sorted(
+        (rl.left.person_id, rl.right.person_id, rl.definition.name) for rl in read_relationships(read_persons())
+    ) == [
+        (1, 2, parent_enfant.name),
+        (1, 3, parent_enfant.name),
+        (2, 6, parent_enfant.name),
+        (3, 4, copain_copine.name),
+        (4, 2, copain_copine.name),
+    ]
+    assert _ancestor_rows(str(tmpdir + "pylms.sqlite")) == [(1, 2, 1), (1, 3, 1), (1, 6, 2), (2, 6, 1)]
+
+
+def test_ancestors_of_previous_version_are_computed(tmp_path):
+    database_file = str(tmp_path / "pylms.sqlite")
+    with patch("pylms.sqlite_storage.database_file_name", database_file):
+        create_database().close()
+        store_persons(persons)
+        store_relationships(relationships)
+        connection = sqlite3.connect(database_file)
+        # version 1 had no ancestors
+        connection.execute("DELETE FROM ancestors")
+        connection.execute("DROP TABLE names")
+        connection.execute("PRAGMA user_version = 1")
+        connection.commit()
+        connection.close()
+
+        assert is_ancestor(john, emma)
+        assert _ancestor_rows(database_file) == [(1, 2, 1), (1, 3, 1)]
+
+
+def test_search_keys_of_previous_version_are_migrated(tmp_path):
+    database_file = str(tmp_path / "pylms.sqlite")
+    with patch("pylms.sqlite_storage.database_file_name", database_file):
+        create_database().close()
+        store_persons([carine])
+        connection = sqlite3.connect(database_file)
+        # version 0 held lower case values, and had no names index
+        connection.execute("UPDATE persons SET firstname_lower = lower(firstname)")
+        connection.execute("DROP TABLE names")
+        connection.execute("PRAGMA user_version = 0")
+        connection.commit()
+        connection.close()
+
+        assert _ids(search_persons("carine")) == [4]
+
+
+def test_migrate_from_json(tmpdir):
+    with (
+        patch("pylms.storage.persons_file_name", str(tmpdir + "persons.db")),
+        patch("pylms.storage.relationships_file_name", str(tmpdir + "relationships.db")),
+    ):
+        json_storage.store_persons(persons)
+        json_storage.store_relationships(relationships)
+
+        assert migrate_from_json() == (4, 3)
+
+        with raises(ValueError, match="is not empty"):
+            migrate_from_json()
+
+    assert read_persons() == persons
+    assert len(read_relationships(persons)) == 3
+
+
+def test_staged_changes_are_seen_until_written_or_rolled_back(populated_database, tmpdir):
+    def committed_ids() -> list[int]:
+        with closing(sqlite3.connect(str(tmpdir + "pylms.sqlite"))) as connection:
+            return [row[0] for row in connection.execute("SELECT person_id FROM persons ORDER BY 1")]
+
+    stage_changes([(DELETE_PERSON, peter)])
+
+    assert _ids(read_persons()) == [1, 3, 4]
+    assert committed_ids() == [1, 2, 3, 4]
+
+    clear_cache()
+
+    assert _ids(read_persons()) == [1, 2, 3, 4]
+    stage_changes([(DELETE_PERSON, peter)])
+    apply_changes([(DELETE_PERSON, emma)])
+
+    assert committed_ids() == [1, 4]
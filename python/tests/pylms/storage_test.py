@@ -1,10 +1,17 @@
 from datetime import datetime
+import json
+import os
+import subprocess
+import sys
 from pathlib import Path
-from pylms.core import Person, Relationship, RelationshipDefinition, MALE, FEMALE
-from pylms.storage import read_persons, store_persons, update_person
-from pylms.storage import read_relationships, store_relationships
-from pytest import raises, mark
-from unittest.mock import patch
+from pylms.core import Person, Relationship, RelationshipDefinition, RelationshipAlias, MALE, FEMALE, parent_enfant
+from pylms.storage import read_persons, store_persons, update_person, add_person, delete_person
+from pylms.storage import read_relationships, store_relationships, add_relationship, compact, clear_cache
+from pylms.storage import apply_changes, ADD_PERSON, UPDATE_PERSON, DELETE_PERSON, ADD_RELATIONSHIP, MERGE_PERSON
+from pylms.storage import read_ancestors, store_ancestors
+from pylms import storage
+from pytest import raises, mark, fixture
+from unittest.mock import patch, call
 
 
 def test_read_persons_no_file(tmpdir):
@@ -289,6 +296,37 @@ def test_read_relationship_ignore_entry_if_person_or_definition_does_not_exist(s
         assert not read_relationships(persons)
 
 
+@patch("builtins.print")
+def test_read_relationships_reports_dangling_references_once(mock_print, tmpdir):
+    file_name = tmpdir + "foo.db"
+    persons = [
+        Person(2, "Foo", "Bar"),
+        Person(3, "Acme", "Donut"),
+    ]
+    relationship = RelationshipDefinition(name="rs1_name")
+    Path(file_name).write_text(
+        "["
+        '{"left": 4, "right": 2, "definition": "rs1_name"}, '
+        '{"left": 3, "right": 2, "definition": "rs1_name"}, '
+        '{"left": 3, "right": 1, "definition": "does_not_exist"}, '
+        '{"left": 1, "right": 4, "definition": "rs1_name"}, '
+        '{"left": 2, "right": 3, "definition": "does_not_exist"}'
+        "]"
+    )
+
+    with (
+        patch("pylms.storage.relationships_file_name", file_name),
+        patch("pylms.storage.relationship_definitions", new=[relationship]),
+    ):
+        relationships = read_relationships(persons)
+
+    assert len(relationships) == 1
+    assert mock_print.call_args_list == [
+        call("Relationships ignored, persons do not exist: [1, 4]"),
+        call("Relationships ignored, definitions do not exist: ['does_not_exist']"),
+    ]
+
+
 def test_read_relationships(tmpdir):
     file_name = tmpdir + "foo.db"
     persons = [
@@ -342,39 +380,492 @@ def test_read_relationships(tmpdir):
         assert relationships[4].definition is relationship1
 
 
-@patch("pylms.storage.read_persons", return_value=[])
-def test_update_fails_if_no_existing_persons(mock_read_persons):
+def test_update_of_unknown_person_is_ignored(tmpdir):
     person = Person(person_id=12, firstname="John")
 
-    with raises(ValueError, match="Can't find person with id 12"):
-        update_person(person)
+    with patch("pylms.storage.persons_file_name", tmpdir + "persons.db"):
+        store_persons([person])
+
+        with patch("pylms.storage.read_persons") as mock_read_persons:
+            update_person(Person(person_id=21, firstname="Tina"))
+        mock_read_persons.assert_not_called()
 
-    mock_read_persons.assert_called_once_with()
+        assert read_persons() == [person]
 
 
-@patch("pylms.storage.store_persons")
-@patch("pylms.storage.read_persons")
-def test_update_single_person(mock_read_persons, mock_store_persons):
+def test_update_single_person(tmpdir):
     person = Person(person_id=12, firstname="John")
     person_to_update = Person(person_id=12, firstname="John", lastname="Doe")
-    mock_read_persons.return_value = [person]
 
-    update_person(person_to_update)
+    with patch("pylms.storage.persons_file_name", tmpdir + "persons.db"):
+        store_persons([person])
+
+        update_person(person_to_update)
 
-    mock_read_persons.assert_called_once_with()
-    mock_store_persons.assert_called_once_with([person_to_update])
+        assert read_persons() == [person_to_update]
 
 
-@patch("pylms.storage.store_persons")
-@patch("pylms.storage.read_persons")
-def test_update_several_person(mock_read_persons, mock_store_persons):
+def test_update_several_person(tmpdir):
     person_1 = Person(person_id=12, firstname="John")
     person_2 = Person(person_id=21, firstname="Tina")
     person_3 = Person(person_id=35, firstname="Peter")
     person_to_update = Person(person_id=12, firstname="John", lastname="Doe")
-    mock_read_persons.return_value = [person_3, person_1, person_2]
 
-    update_person(person_to_update)
+    with patch("pylms.storage.persons_file_name", tmpdir + "persons.db"):
+        store_persons([person_3, person_1, person_2])
+
+        update_person(person_to_update)
+
+        assert read_persons() == [person_3, person_to_update, person_2]
+
+
+class TestJournal:
+    @fixture(autouse=True)
+    def storage_files(self, tmpdir):
+        self.persons_file = Path(tmpdir + "persons.db")
+        self.relationships_file = Path(tmpdir + "relationships.db")
+        self.transaction_file = Path(tmpdir + "transaction.db")
+        with (
+            patch("pylms.storage.persons_file_name", str(self.persons_file)),
+            patch("pylms.storage.relationships_file_name", str(self.relationships_file)),
+            patch("pylms.storage.transaction_file_name", str(self.transaction_file)),
+        ):
+            yield
+
+    def test_add_person_appends_to_journal_only(self):
+        person = Person(2, "Jim", created=datetime(2024, 4, 5, 12, 41, 58), sex=MALE)
+
+        add_person(person)
+
+        assert not self.persons_file.exists()
+        assert Path(str(self.persons_file) + ".journal").read_text() == (
+            '{"op": "add", "person": '
+            '{"id": 2, "firstname": "Jim", "created": "2024-04-05 12:41:58", "sex": "M", "tags": []}}\n'
+        )
+        assert read_persons() == [person]
+
+    def test_journal_is_replayed_on_top_of_snapshot(self):
+        person_1 = Person(1, "Jim", "Morisson")
+        person_2 = Person(2, "Paul", "John")
+        person_3 = Person(3, "Tony", "Parker")
+        store_persons([person_1, person_2])
+
+        add_person(person_3)
+        update_person(Person(1, "Jimmy", "Morisson"))
+        delete_person(person_2)
+
+        assert read_persons() == [Person(1, "Jimmy", "Morisson"), person_3]
+        # the snapshot is left untouched
+        assert len(json.loads(self.persons_file.read_text())) == 2
+
+    def test_add_and_delete_relationships(self):
+        person_1 = Person(1, "Jim", "Morisson")
+        person_2 = Person(2, "Paul", "John")
+        person_3 = Person(3, "Tony", "Parker")
+        definition = RelationshipDefinition(name="rs1_name")
+        store_persons([person_1, person_2, person_3])
+        store_relationships([Relationship(person_1, person_2, definition)])
+
+        with patch("pylms.storage.relationship_definitions", new=[definition]):
+            add_relationship(Relationship(person_2, person_3, definition))
+            add_relationship(Relationship(person_3, person_1, definition))
+            delete_person(person_2)
+
+            persons = read_persons()
+            relationships = read_relationships(persons)
+
+        assert persons == [person_1, person_3]
+        assert len(relationships) == 1
+        assert relationships[0].left == person_3
+        assert relationships[0].right == person_1
+
+    def test_apply_changes_appends_once_per_journal(self):
+        person_1 = Person(1, "Jim", "Morisson")
+        person_2 = Person(2, "Paul", "John")
+        person_3 = Person(3, "Tony", "Parker")
+        definition = RelationshipDefinition(name="rs1_name")
+
+        with (
+            patch("pylms.storage.relationship_definitions", new=[definition]),
+            patch("pylms.storage._append_journal", wraps=storage._append_journal) as mock_append_journal,
+        ):
+            apply_changes(
+                [
+                    (ADD_PERSON, person_1),
+                    (ADD_PERSON, person_2),
+                    (ADD_PERSON, person_3),
+                    (UPDATE_PERSON, Person(1, "Jimmy", "Morisson")),
+                    (ADD_RELATIONSHIP, Relationship(person_1, person_2, definition)),
+                    (ADD_RELATIONSHIP, Relationship(person_2, person_3, definition)),
+                    (DELETE_PERSON, person_3),
+                ]
+            )
+
+            assert mock_append_journal.call_count == 2
+            persons = read_persons()
+            relationships = read_relationships(persons)
+
+        assert persons == [Person(1, "Jimmy", "Morisson"), person_2]
+        assert [(rl.left.person_id, rl.right.person_id) for rl in relationships] == [(1, 2)]
+
+    def test_merge_person(self):
+        person_1 = Person(1, "Jim", "Morisson")
+        person_2 = Person(2, "Paul", "John")
+        person_3 = Person(3, "Tony", "Parker")
+        person_4 = Person(4, "Paul", "Johnson")
+        undirected = RelationshipDefinition(name="rs1_name")
+        directed = RelationshipDefinition(name="rs2_name", directional=True)
+        store_persons([person_1, person_2, person_3, person_4])
+        store_relationships(
+            [
+                Relationship(person_1, person_2, undirected),
+                Relationship(person_4, person_1, undirected),
+                Relationship(person_3, person_4, directed),
+                Relationship(person_2, person_3, directed),
+                Relationship(person_2, person_4, undirected),
+            ]
+        )
+
+        with patch("pylms.storage.relationship_definitions", new=[undirected, directed]):
+            apply_changes([(MERGE_PERSON, (person_4, person_2))])
+
+            persons = read_persons()
+            relationships = read_relationships(persons)
+
+        assert persons == [person_1, person_2, person_3]
+        # duplicates of the Relationships of Paul John and the one linking him to himself are dropped
+        assert [(rl.left.person_id, rl.right.person_id, rl.definition.name) for rl in relationships] == [
+            (1, 2, "rs1_name"),
+            (3, 2, "rs2_name"),
+            (2, 3, "rs2_name"),
+        ]
+
+    def test_incomplete_trailing_entry_is_ignored(self):
+        add_person(Person(1, "Jim"))
+        # left by an append interrupted outside of a transaction
+        with open(str(self.persons_file) + ".journal", "a") as f:
+            f.write('{"op": "add", "pers')
+
+        assert [person.person_id for person in read_persons()] == [1]
+
+        add_person(Person(2, "Paul"))
+        clear_cache()
+
+        assert [person.person_id for person in read_persons()] == [1, 2]
+
+    def test_interrupted_compaction_is_completed(self):
+        person_1 = Person(1, "Jim", "Morisson")
+        definition = RelationshipDefinition(name="rs1_name")
+        with patch("pylms.storage.relationship_definitions", new=[definition]):
+            apply_changes(
+                [
+                    (ADD_PERSON, person_1),
+                    (ADD_PERSON, Person(2, "Paul")),
+                    (ADD_RELATIONSHIP, Relationship(person_1, Person(2, "Paul"), definition)),
+                ]
+            )
+        journal_file = Path(str(self.relationships_file) + ".journal")
+
+        unlink = Path.unlink
+
+        def crash_before_journal_is_removed(path: Path, missing_ok: bool = False) -> None:
+            if path == journal_file:
+                raise OSError("crash")
+            unlink(path, missing_ok=missing_ok)
+
+        # crash once the new snapshot is in place but before the journal is removed
+        with (
+            patch("pathlib.Path.unlink", autospec=True, side_effect=crash_before_journal_is_removed),
+            raises(OSError, match="crash"),
+        ):
+            compact()
+
+        assert self.transaction_file.exists() and journal_file.exists()
+        clear_cache()
+        with patch("pylms.storage.relationship_definitions", new=[definition]):
+            persons = read_persons()
+            relationships = read_relationships(persons)
+
+        assert not self.transaction_file.exists() and not journal_file.exists()
+        # the journal was not replayed on top of the snapshot it was folded into
+        assert [(rl.left.person_id, rl.right.person_id) for rl in relationships] == [(1, 2)]
+
+    def test_interrupted_transaction_is_completed(self):
+        person_1 = Person(1, "Jim", "Morisson")
+        person_2 = Person(2, "Paul", "John")
+        definition = RelationshipDefinition(name="rs1_name")
+        store_persons([person_1])
+        append_journal = storage._append_journal
+
+        def crash_after_relationships(journal_file_name: str, size: int, lines: str) -> None:
+            append_journal(journal_file_name, size, lines)
+            # the persons journal is left with half an entry
+            with open(str(self.persons_file) + ".journal", "a") as f:
+                f.write('{"op": "add", "pers')
+            raise OSError("crash")
+
+        with (
+            patch("pylms.storage.relationship_definitions", new=[definition]),
+            patch("pylms.storage._append_journal", side_effect=crash_after_relationships),
+            raises(OSError, match="crash"),
+        ):
+            apply_changes([(ADD_PERSON, person_2), (ADD_RELATIONSHIP, Relationship(person_1, person_2, definition))])
+
+        assert self.transaction_file.exists()
+        with patch("pylms.storage.relationship_definitions", new=[definition]):
+            persons = read_persons()
+            relationships = read_relationships(persons)
+
+        assert not self.transaction_file.exists()
+        assert persons == [person_1, person_2]
+        assert [(rl.left.person_id, rl.right.person_id) for rl in relationships] == [(1, 2)]
+        assert len(Path(str(self.persons_file) + ".journal").read_text().splitlines()) == 1
+
+    def test_transaction_file_is_removed_once_applied(self):
+        add_person(Person(1, "Jim", "Morisson"))
+
+        assert not self.transaction_file.exists()
+        assert not Path(str(self.transaction_file) + ".tmp").exists()
+
+    def test_transaction_is_not_completed_by_another_process_while_running(self):
+        person_1 = Person(1, "Jim", "Morisson")
+        person_2 = Person(2, "Paul", "John")
+        definition = RelationshipDefinition(name="rs1_name")
+        store_persons([person_1, person_2])
+        append_journal = storage._append_journal
+        recoveries = []
+
+        def recover_meanwhile(journal_file_name: str, size: int, lines: str) -> None:
+            append_journal(journal_file_name, size, lines)
+            # another process reads the storage while the transaction is applied
+            recoveries.append(
+                subprocess.Popen(
+                    [
+                        sys.executable,
+                        "-c",
+                        "import sys; from pylms import storage; storage.transaction_file_name = sys.argv[1]; "
+                        "storage.persons_file_name = sys.argv[2]; storage.relationships_file_name = sys.argv[3]; "
+                        "storage.storage_key()",
+                        str(self.transaction_file),
+                        str(self.persons_file),
+                        str(self.relationships_file),
+                    ],
+                    env={**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(storage.__file__))},
+                )
+            )
+            # it waits for the transaction to be done
+            with raises(subprocess.TimeoutExpired):
+                recoveries[-1].wait(timeout=0.5)
+
+        with (
+            patch("pylms.storage.relationship_definitions", new=[definition]),
+            patch("pylms.storage._append_journal", side_effect=recover_meanwhile),
+        ):
+            add_relationship(Relationship(person_1, person_2, definition))
+        assert recoveries[0].wait(timeout=10) == 0
+
+        assert not self.transaction_file.exists()
+        assert len(Path(str(self.relationships_file) + ".journal").read_text().splitlines()) == 1
+
+    def test_transaction_completed_meanwhile(self):
+        end_transaction = storage._end_transaction
+
+        def completed_meanwhile() -> None:
+            self.transaction_file.unlink()
+            end_transaction()
+
+        with patch("pylms.storage._end_transaction", side_effect=completed_meanwhile):
+            add_person(Person(1, "Jim", "Morisson"))
+
+        assert read_persons() == [Person(1, "Jim", "Morisson")]
+
+    def test_apply_unsupported_change(self):
+        with raises(ValueError, match="Unsupported change foo"):
+            apply_changes([("foo", Person(1, "Jim"))])
+
+    def test_store_discards_journal(self):
+        add_person(Person(1, "Jim", "Morisson"))
+
+        store_persons([Person(2, "Paul", "John")])
+
+        assert read_persons() == [Person(2, "Paul", "John")]
+
+    def test_compact(self):
+        person_1 = Person(1, "Jim", "Morisson")
+        person_2 = Person(2, "Paul", "John")
+        definition = RelationshipDefinition(name="rs1_name")
+        add_person(person_1)
+        add_person(person_2)
+        add_relationship(Relationship(person_1, person_2, definition))
+
+        compact()
+
+        assert not Path(str(self.persons_file) + ".journal").exists()
+        assert not Path(str(self.relationships_file) + ".journal").exists()
+        assert read_persons() == [person_1, person_2]
+        assert json.loads(self.relationships_file.read_text()) == [{"left": 1, "right": 2, "definition": "rs1_name"}]
+
+    def test_directory_is_synced_once_files_are_created_replaced_or_removed(self):
+        with patch("pylms.storage._fsync_directory") as mock_fsync_directory:
+            add_person(Person(1, "Jim"))
+            add_person(Person(2, "Paul"))
+            compact()
+
+        assert mock_fsync_directory.call_args_list == [
+            # transaction written, journal created, transaction removed
+            call(str(self.transaction_file)),
+            call(str(self.persons_file) + ".journal"),
+            call(str(self.transaction_file)),
+            # journal appended to
+            call(str(self.transaction_file)),
+            call(str(self.transaction_file)),
+            # transaction written, snapshot replaced and journal removed, transaction removed
+            call(str(self.transaction_file)),
+            call(str(self.persons_file)),
+            call(str(self.transaction_file)),
+            call(str(self.transaction_file)),
+            call(str(self.relationships_file)),
+            call(str(self.transaction_file)),
+        ]
+
+    def test_journal_is_compacted_once_larger_than_snapshot(self):
+        with patch("pylms.storage.journal_compaction_min_size", 0):
+            store_persons([Person(1, "Jim", "Morisson"), Person(2, "Paul", "John")])
+            add_person(Person(3, "Tony", "Parker"))
+            assert Path(str(self.persons_file) + ".journal").exists()
+
+            add_person(Person(4, "Max", "Payne"))
+
+            assert not Path(str(self.persons_file) + ".journal").exists()
+            assert [p.person_id for p in read_persons()] == [1, 2, 3, 4]
+
+
+class TestCache:
+    person_1 = Person(1, "Jim", "Morisson")
+    person_2 = Person(2, "Paul", "John")
+    definition = RelationshipDefinition(name="rs1_name")
+
+    @fixture(autouse=True)
+    def storage_files(self, tmpdir):
+        self.persons_file = Path(tmpdir + "persons.db")
+        with (
+            patch("pylms.storage.persons_file_name", str(self.persons_file)),
+            patch("pylms.storage.relationships_file_name", str(tmpdir + "relationships.db")),
+            patch("pylms.storage.relationship_definitions", new=[self.definition]),
+        ):
+            store_persons([self.person_1, self.person_2])
+            store_relationships([Relationship(self.person_1, self.person_2, self.definition)])
+            yield
+
+    def test_unchanged_files_are_read_once(self):
+        with (
+            patch("pylms.storage._replay_persons", wraps=storage._replay_persons) as mock_replay_persons,
+            patch("pylms.storage._replay_relationships", wraps=storage._replay_relationships) as mock_replay_rls,
+        ):
+            persons = read_persons()
+            relationships = read_relationships(persons)
+            persons.append(Person(3, "Tony", "Parker"))
+
+            assert read_persons() == [self.person_1, self.person_2]
+            assert read_relationships(read_persons()) == relationships
+
+        assert mock_replay_persons.call_count == 1
+        assert mock_replay_rls.call_count == 1
+
+    def test_own_writes_invalidate_cache(self):
+        read_relationships(read_persons())
+
+        add_person(Person(3, "Tony", "Parker"))
+        add_relationship(Relationship(self.person_2, self.person_1, self.definition))
+
+        persons = read_persons()
+        assert [p.person_id for p in persons] == [1, 2, 3]
+        assert [(rl.left.person_id, rl.right.person_id) for rl in read_relationships(persons)] == [(1, 2), (2, 1)]
+
+    def test_changes_by_another_process_invalidate_cache(self):
+        read_persons()
+
+        # same size and modification time as the previous content: only the inode changes
+        stat = self.persons_file.stat()
+        replacement = Path(str(self.persons_file) + ".new")
+        replacement.write_text(self.persons_file.read_text().replace("Jim", "Tom"))
+        os.utime(replacement, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        replacement.replace(self.persons_file)
+
+        assert read_persons()[0].firstname == "Tom"
+
+    def test_relationships_are_resolved_against_other_persons(self):
+        read_relationships(read_persons())
+        other_persons = [Person(1, "Jimmy"), Person(2, "Paulo")]
+
+        relationships = read_relationships(other_persons)
+
+        assert relationships[0].left is other_persons[0]
+        assert relationships[0].right is other_persons[1]
+
+    def test_clear_cache(self):
+        read_persons()[0].firstname = "Tom"
+
+        clear_cache()
+
+        assert read_persons()[0].firstname == "Jim"
+
+
+class TestAncestors:
+    person_1 = Person(1, "Jim", "Morisson")
+    person_2 = Person(2, "Paul", "John")
+    person_3 = Person(3, "Tony", "Parker")
+    definition = RelationshipDefinition(name="rs1_name")
+
+    @fixture(autouse=True)
+    def storage_files(self, tmpdir):
+        self.ancestors_file = Path(tmpdir + "ancestors.db")
+        with (
+            patch("pylms.storage.persons_file_name", str(tmpdir + "persons.db")),
+            patch("pylms.storage.relationships_file_name", str(tmpdir + "relationships.db")),
+            patch("pylms.storage.ancestors_file_name", str(self.ancestors_file)),
+            patch("pylms.storage.transaction_file_name", str(tmpdir + "transaction.db")),
+            patch("pylms.storage.relationship_definitions", new=[self.definition, parent_enfant]),
+        ):
+            store_persons([self.person_1, self.person_2, self.person_3])
+            yield
+
+    def test_no_ancestors(self):
+        assert read_ancestors() is None
+
+    def test_store_and_read(self):
+        store_ancestors([(1, 2, 1)])
+
+        assert read_ancestors().rows() == [(1, 2, 1)]
+
+    def test_later_relationships_are_replayed(self):
+        add_relationship(Relationship(self.person_1, self.person_2, parent_enfant))
+        store_ancestors([(1, 2, 1)])
+        ancestors = self.ancestors_file.read_text()
+
+        add_relationship(Relationship(self.person_2, self.person_3, parent_enfant))
+        add_relationship(Relationship(self.person_1, self.person_3, self.definition))
+
+        # the closure is not written again
+        assert self.ancestors_file.read_text() == ancestors
+        assert sorted(read_ancestors().rows()) == [(1, 2, 1), (1, 3, 2), (2, 3, 1)]
+
+        apply_changes([(MERGE_PERSON, (self.person_2, self.person_1))])
+
+        assert read_ancestors().rows() == [(1, 3, 1)]
+
+        delete_person(self.person_1)
+
+        assert read_ancestors().rows() == []
+
+    def test_stale_once_relationships_snapshot_is_written(self):
+        store_ancestors([])
+        store_relationships([Relationship(self.person_1, self.person_2, parent_enfant)])
+
+        assert read_ancestors() is None
+
+        store_ancestors([(1, 2, 1)])
+        add_relationship(Relationship(self.person_2, self.person_3, parent_enfant))
+        compact()
 
-    mock_read_persons.assert_called_once_with()
-    mock_store_persons.assert_called_once_with([person_3, person_2, person_to_update])
+        assert read_ancestors() is None
@@ -1,6 +1,6 @@
 import random
 
-from pylms.python_utils import first_not_none, require_not_none
+from pylms.python_utils import first_not_none, require_not_none, AhoCorasick, UnionFind
 from pytest import raises, fixture
 from random import randint
 
@@ -60,3 +60,56 @@ class TestRequireNotNone:
     def test_raises_value_error_with_specified_message_if_none(self):
         with raises(ValueError, match=self.message):
             require_not_none(None, self.message)
+
+
+class TestAhoCorasick:
+    under_test = AhoCorasick([("he", 1), ("she", 2), ("his", 3), ("hers", 4), ("he", 5)])
+
+    def test_find_all_overlapping_occurrences(self):
+        assert self.under_test.find_all("ushers") == [(1, 4, 2), (2, 4, 1), (2, 6, 4)]
+        assert self.under_test.find_all("ahishe") == [(1, 4, 3), (3, 6, 2), (4, 6, 1)]
+        assert self.under_test.find_all("xyz") == []
+
+    def test_find_leftmost_longest(self):
+        assert self.under_test.find_leftmost_longest("ushers") == (1, 4, 2)
+        assert self.under_test.find_leftmost_longest("hers") == (0, 4, 4)
+        assert self.under_test.find_leftmost_longest("xyz") is None
+        assert AhoCorasick([]).find_leftmost_longest("xyz") is None
+
+    def test_first_value_of_duplicate_pattern_is_kept(self):
+        assert self.under_test.find_all("he") == [(0, 2, 1)]
+
+    def test_empty_pattern(self):
+        with raises(ValueError, match="pattern can't be empty"):
+            AhoCorasick([("", 1)])
+
+
+class TestUnionFind:
+    def test_groups(self):
+        under_test = UnionFind()
+        for element in range(6):
+            under_test.add(element)
+
+        under_test.union(4, 1)
+        under_test.union(2, 5)
+        under_test.union(1, 5)
+        under_test.union(5, 4)
+
+        assert under_test.groups() == [[0], [1, 2, 4, 5], [3]]
+        assert under_test.find(1) == under_test.find(2)
+        assert under_test.find(0) != under_test.find(3)
+
+    def test_unknown_elements_are_added(self):
+        under_test = UnionFind()
+
+        under_test.union("a", "b")
+
+        assert under_test.find("c") == "c"
+        assert under_test.groups() == [["a", "b"], ["c"]]
+
+    def test_long_chain(self):
+        under_test = UnionFind()
+        for element in range(10_000):
+            under_test.union(element, element + 1)
+
+        assert len(under_test.groups()) == 1